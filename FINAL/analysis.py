@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Out-of-core analysis helpers for generated code: data stays in lazy DuckDB relations and only
+small aggregates, fits and plot samples are materialized in pandas
+"""
+import os, re, functools
+import pandas as pd
+import duckdb_manager, http_cache
+from attachments import READERS
+from lazy_modules import duckdb
+
+PLOT_SAMPLE_ROWS = int(os.getenv("AGENT_PLOT_SAMPLE_ROWS", "5000"))
+
+def quote(value: str) -> str:
+    """SQL string literal"""
+    return "'" + value.replace("'", "''") + "'"
+
+def _strip(path: str):
+    """(path without query string or compression suffix, compression name or None)"""
+    path = path.split("?")[0].split("#")[0]
+    stem, ext = os.path.splitext(path)
+    compression = http_cache.COMPRESSION_BY_SUFFIX.get(ext.lower())
+    return (stem, compression) if compression else (path, None)
+
+def reader(path: str):
+    """DuckDB table function for a file name, by extension (compression suffixes ignored)"""
+    return READERS.get(os.path.splitext(_strip(path)[0])[1].lower())
+
+def load(source, con=None):
+    """Lazy DuckDB relation over a relation, DataFrame, view/table name, file path/glob or URL"""
+    con = con or duckdb_manager.cursor()
+    if isinstance(source, duckdb.DuckDBPyRelation):
+        return source
+    if isinstance(source, pd.DataFrame):
+        return con.from_df(source)
+    if not isinstance(source, str):
+        raise TypeError(f"Cannot load {type(source).__name__}; pass a path, URL, view name, DataFrame or relation")
+    if re.fullmatch(r"[A-Za-z_]\w*", source):
+        return con.table(source)
+
+    fn = reader(source)
+    if fn is None:
+        raise ValueError(f"Cannot tell the format of {source}; expected .csv, .parquet or .json (or a view name)")
+    if http_cache.is_http_url(source):
+        if fn == "read_parquet":
+            # httpfs range requests fetch only the footers and the columns the query touches
+            try:
+                return con.sql(f"SELECT * FROM read_parquet({quote(source)})")
+            except duckdb.Error:
+                # No httpfs here; the failed bind leaves the cursor's transaction aborted
+                try:
+                    con.rollback()
+                except duckdb.Error:
+                    pass
+        # Whole-file formats (or no httpfs): scan the shared HTTP cache's blob in place
+        path = http_cache.get_http_cache().local_path(source)
+        compression = _strip(source)[1]
+        options = f", compression={quote(compression)}" if compression and fn != "read_parquet" else ""
+        return con.sql(f"SELECT * FROM {fn}({quote(path)}{options})")
+    return con.sql(f"SELECT * FROM {fn}({quote(source)})")
+
+def _names(columns) -> list:
+    if columns is None:
+        return []
+    return [columns] if isinstance(columns, str) else list(columns)
+
+def schema(source, con=None) -> list:
+    """[(column, type), ...] without scanning the data"""
+    rel = load(source, con)
+    return list(zip(rel.columns, (str(t) for t in rel.types)))
+
+def peek(source, n: int = 5, con=None) -> pd.DataFrame:
+    """First n rows"""
+    return load(source, con).limit(n).df()
+
+def count(source, where: str = None, con=None) -> int:
+    rel = load(source, con)
+    return rel.query("t", f"SELECT count(*) FROM t{f' WHERE {where}' if where else ''}").fetchone()[0]
+
+def group_agg(source, by=None, where: str = None, order: str = None, limit: int = None, con=None, **aggs) -> pd.DataFrame:
+    """Grouped aggregation in DuckDB, e.g. group_agg(rel, "court", cases="count(*)", avg_delay="avg(delay)")"""
+    rel = load(source, con)
+    by = _names(by)
+    aggs = aggs or {"count": "count(*)"}
+    select = ", ".join(by + [f'{expr} AS "{name}"' for name, expr in aggs.items()])
+    sql = f"SELECT {select} FROM t"
+    if where:
+        sql += f" WHERE {where}"
+    if by:
+        sql += f" GROUP BY {', '.join(by)}"
+    if order or by:
+        sql += f" ORDER BY {order or ', '.join(by)}"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return rel.query("t", sql).df()
+
+def regression(source, x: str, y: str, where: str = None, con=None) -> dict:
+    """Least-squares fit of y on x in one streaming pass: slope, intercept, r, r2, n"""
+    rel = load(source, con)
+    sql = (f"SELECT regr_slope({y}, {x}), regr_intercept({y}, {x}), corr({y}, {x}), regr_r2({y}, {x}), "
+           f"regr_count({y}, {x}) FROM t{f' WHERE {where}' if where else ''}")
+    slope, intercept, r, r2, n = rel.query("t", sql).fetchone()
+    return {"slope": slope, "intercept": intercept, "r": r, "r2": r2, "n": int(n or 0)}
+
+def sample(source, n: int = PLOT_SAMPLE_ROWS, columns=None, where: str = None, seed: int = 42, con=None) -> pd.DataFrame:
+    """Reproducible reservoir sample of at most n rows (all rows if fewer), for scatterplots"""
+    rel = load(source, con)
+    select = ", ".join(_names(columns)) or "*"
+    inner = f"SELECT {select} FROM t{f' WHERE {where}' if where else ''}"
+    return rel.query("t", f"SELECT * FROM ({inner}) USING SAMPLE reservoir({int(n)} ROWS) REPEATABLE ({int(seed)})").df()
+
+def helpers(con) -> dict:
+    """The helpers bound to one execution's DuckDB cursor, for the generated code's namespace"""
+    return {fn.__name__: functools.partial(fn, con=con)
+            for fn in (load, schema, peek, count, group_agg, regression, sample)}
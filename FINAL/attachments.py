@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Data files uploaded with the question: streamed to a per-request spool directory, schema-sniffed
+for the prompt and exposed to generated code as DuckDB views
+"""
+import os, re, hashlib, shutil, tempfile, time, asyncio, logging, contextvars
+from functools import lru_cache
+
+try:
+    from python_multipart import MultipartParser
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart import MultipartParser
+    from multipart.multipart import parse_options_header
+
+from lazy_modules import duckdb
+from code_cache import CACHE_DIR
+
+UPLOAD_DIR = os.getenv("AGENT_UPLOAD_DIR", os.path.join(CACHE_DIR, "uploads"))
+MAX_UPLOAD_MB = float(os.getenv("AGENT_MAX_UPLOAD_MB", "5120"))
+SPOOL_MAX_AGE = 24 * 3600
+WRITE_BATCH = 1 << 20  # hand the parser ~1MB at a time so disk writes stay off the event loop
+MAX_FIELD_BYTES = 1 << 20
+SNIFF_PREVIEW_ROWS = int(os.getenv("AGENT_SNIFF_PREVIEW_ROWS", "3"))  # first rows shown in the prompt
+
+QUESTION_FIELDS = ("file", "question", "questions", "question.txt", "questions.txt")
+READERS = {
+    ".csv": "read_csv_auto", ".tsv": "read_csv_auto", ".txt": "read_csv_auto",
+    ".parquet": "read_parquet", ".pq": "read_parquet",
+    ".json": "read_json_auto", ".jsonl": "read_json_auto", ".ndjson": "read_json_auto",
+}
+
+class UploadError(ValueError):
+    """Rejected upload; status is the HTTP code to answer with"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _safe_name(filename: str) -> str:
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(filename.replace("\\", "/"))).lstrip(".")
+    return name or "upload"
+
+def _disposition(value: bytes) -> dict:
+    _, options = parse_options_header(value)
+    return {k.decode("latin-1"): v.decode("utf-8", errors="replace") for k, v in options.items()}
+
+class Upload:
+    """One multipart request: form fields in memory, files in `spool` until cleanup()"""
+
+    def __init__(self, spool: str):
+        self.spool = spool
+        self.fields = {}
+        self.files = []  # {"field", "name", "path", "size", "sha256"}
+
+    def pop_question(self) -> str:
+        """Remove and return the question text (question field/file or the first .txt upload)"""
+        for name in QUESTION_FIELDS:
+            if name in self.fields:
+                return self.fields.pop(name).strip()
+        candidates = [f for f in self.files if f["field"] in QUESTION_FIELDS] or \
+                     [f for f in self.files if f["name"].lower().endswith(".txt")]
+        if not candidates:
+            raise UploadError(400, "Upload a .txt question file")
+        question = candidates[0]
+        self.files.remove(question)
+        with open(question["path"], "rb") as fh:
+            text = fh.read().decode("utf-8", errors="ignore").strip()
+        os.remove(question["path"])
+        return text
+
+    def pop_questions(self) -> list:
+        """Remove and return every question as (name, text): question form fields and all .txt uploads"""
+        questions = [(name, self.fields.pop(name).strip()) for name in QUESTION_FIELDS if name in self.fields]
+        for f in [f for f in self.files if f["name"].lower().endswith(".txt")]:
+            self.files.remove(f)
+            with open(f["path"], "rb") as fh:
+                questions.append((f["name"], fh.read().decode("utf-8", errors="ignore").strip()))
+            os.remove(f["path"])
+        if not questions:
+            raise UploadError(400, "Upload one or more .txt question files")
+        return questions
+
+    def cleanup(self):
+        shutil.rmtree(self.spool, ignore_errors=True)
+
+class _PartWriter:
+    """python-multipart callbacks that stream file parts straight into the spool directory"""
+
+    def __init__(self, upload: Upload, max_bytes: float):
+        self.upload = upload
+        self.max_bytes = max_bytes
+        self.total = 0
+        self._reset()
+
+    def _reset(self):
+        self.headers = {}
+        self._field = b""
+        self._value = b""
+        self.part = None
+        self.fh = None
+        self.buffer = None
+        self.digest = None
+
+    def on_part_begin(self):
+        self._reset()
+
+    def on_header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self._field.lower()] = self._value
+        self._field, self._value = b"", b""
+
+    def on_headers_finished(self):
+        options = _disposition(self.headers.get(b"content-disposition", b""))
+        field = options.get("name", "")
+        if "filename" in options:
+            name = _safe_name(options["filename"])
+            path = os.path.join(self.upload.spool, name)
+            stem, ext = os.path.splitext(name)
+            n = 1
+            while os.path.exists(path):
+                name = f"{stem}_{n}{ext}"
+                path = os.path.join(self.upload.spool, name)
+                n += 1
+            self.part = {"field": field, "name": name, "path": path, "size": 0}
+            self.fh = open(path, "wb")
+            # Hashed while streaming so identical uploads can be recognised without re-reading them
+            self.digest = hashlib.sha256()
+        else:
+            self.part = {"field": field}
+            self.buffer = bytearray()
+
+    def on_part_data(self, data, start, end):
+        size = end - start
+        self.total += size
+        if self.total > self.max_bytes:
+            raise UploadError(413, f"Upload exceeds {self.max_bytes / 2**20:.0f}MB")
+        if self.fh is not None:
+            self.fh.write(data[start:end])
+            self.digest.update(data[start:end])
+            self.part["size"] += size
+        else:
+            if len(self.buffer) + size > MAX_FIELD_BYTES:
+                raise UploadError(413, f"Form field {self.part['field']!r} is too large")
+            self.buffer += data[start:end]
+
+    def on_part_end(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.part["sha256"] = self.digest.hexdigest()
+            self.upload.files.append(self.part)
+        elif self.part is not None:
+            self.upload.fields[self.part["field"]] = self.buffer.decode("utf-8", errors="ignore")
+        self._reset()
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+
+    def callbacks(self) -> dict:
+        return {name: getattr(self, name) for name in (
+            "on_part_begin", "on_header_field", "on_header_value", "on_header_end",
+            "on_headers_finished", "on_part_data", "on_part_end")}
+
+async def receive(request, max_bytes: float = MAX_UPLOAD_MB * 2**20) -> Upload:
+    """Stream a multipart request body to a fresh spool directory, chunk by chunk"""
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise UploadError(400, "Expected a multipart/form-data upload")
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    upload = Upload(tempfile.mkdtemp(prefix="req-", dir=UPLOAD_DIR))
+    writer = _PartWriter(upload, max_bytes)
+    parser = MultipartParser(options[b"boundary"], writer.callbacks())
+    pending, pending_size = [], 0
+    try:
+        async for chunk in request.stream():
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= WRITE_BATCH:
+                await asyncio.to_thread(parser.write, b"".join(pending))
+                pending, pending_size = [], 0
+        if pending:
+            await asyncio.to_thread(parser.write, b"".join(pending))
+        parser.finalize()
+    except BaseException as e:
+        writer.close()
+        upload.cleanup()
+        if isinstance(e, ValueError) and not isinstance(e, UploadError):
+            raise UploadError(400, f"Malformed multipart body: {str(e)}")
+        raise
+    return upload
+
+def purge_spool(max_age: float = SPOOL_MAX_AGE):
+    """Remove spool directories left behind by a previous server process"""
+    if not os.path.isdir(UPLOAD_DIR):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.is_dir() and entry.name.startswith("req-") and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+# --- worker side ---
+
+_current = contextvars.ContextVar("agent_attachments", default=())
+
+@lru_cache(maxsize=1)
+def _keywords() -> frozenset:
+    """DuckDB keywords that cannot name a table unquoted (order, group, table, select, limit, join, ...)"""
+    rows = duckdb.connect().execute("SELECT keyword_name FROM duckdb_keywords() "
+                                    "WHERE keyword_category IN ('reserved', 'type_function')").fetchall()
+    return frozenset(r[0].lower() for r in rows)
+
+def view_name(filename: str) -> str:
+    """SQL identifier for a file: lower-cased stem with non-word characters replaced, prefixed with t_
+    where it would start with a digit or be a keyword (programs write it unquoted)"""
+    stem = re.sub(r"\W+", "_", os.path.splitext(filename)[0]).strip("_").lower() or "data"
+    return f"t_{stem}" if stem[0].isdigit() or stem in _keywords() else stem
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _quote(path: str) -> str:
+    return "'" + path.replace("'", "''") + "'"
+
+def reader(path: str):
+    return READERS.get(os.path.splitext(path)[1].lower())
+
+def _preview(value) -> str:
+    text = str(value)
+    return text if len(text) <= 40 else text[:37] + "..."
+
+def describe(files, con=None, preview: int = SNIFF_PREVIEW_ROWS) -> list:
+    """Attach view names, sniffed column types, the first rows and (parquet footers) row counts to
+    data files; DuckDB reads only a sample"""
+    con = con or duckdb.connect()
+    described, used = [], set()
+    for f in files or []:
+        info = dict(f)
+        view = view_name(f["name"])
+        while view in used:
+            view += "_"
+        used.add(view)
+        fn = reader(f["name"])
+        if fn:
+            info["view"] = view
+            try:
+                rows = con.execute(f"DESCRIBE SELECT * FROM {fn}({_quote(f['path'])})").fetchall()
+                info["columns"] = [(r[0], r[1]) for r in rows]
+                if preview:
+                    head = con.execute(f"SELECT * FROM {fn}({_quote(f['path'])}) LIMIT {int(preview)}").fetchall()
+                    info["preview"] = [[_preview(v) for v in row] for row in head]
+                if fn == "read_parquet":
+                    info["rows"] = con.execute(
+                        f"SELECT sum(num_rows) FROM parquet_file_metadata({_quote(f['path'])})").fetchone()[0]
+            except duckdb.Error as e:
+                logging.warning(f"Could not sniff {f['name']}: {str(e)}")
+                info["columns"] = None
+        described.append(info)
+    return described
+
+def activate(described):
+    """Make the request's attachments visible to plan_task and run_code"""
+    _current.set(tuple(described or ()))
+
+def current() -> tuple:
+    return _current.get()
+
+def file_lines(described) -> list:
+    """Prompt lines for described files: view, schema and first rows"""
+    lines = []
+    for f in described:
+        size = f"{f['size'] / 2**20:.1f}MB" if f.get("size") is not None else "?"
+        origin = f"from {f['url']}, " if f.get("url") else ""
+        rows = f", {f['rows']} rows" if f.get("rows") is not None else ""
+        if f.get("view"):
+            columns = ", ".join(f"{c} {t}" for c, t in f["columns"]) if f.get("columns") else "schema unknown"
+            lines.append(f"- {f['name']} ({origin}{size}{rows}) -> view `{f['view']}`: {columns}")
+            if f.get("preview"):
+                lines.append("  first rows: " + " | ".join("(" + ", ".join(row) + ")" for row in f["preview"]))
+        else:
+            lines.append(f"- {f['name']} ({size}) -> files[{f['name']!r}] (not a DuckDB-readable format)")
+    return lines
+
+def prompt_section(described=None) -> str:
+    described = current() if described is None else described
+    if not described:
+        return ""
+    lines = ["ATTACHED FILES (use the DuckDB view or files[name]; never hardcode paths; "
+             "load(view) with group_agg/regression/sample or db.sql(...) instead of loading large files into pandas):"]
+    return "\n".join(lines + file_lines(described))
+
+def fingerprint(described=None) -> str:
+    """Stable description of the attachments (names and schemas, not spool paths) for cache keys"""
+    described = current() if described is None else described
+    return "\n".join(f"{f['name']}:{f.get('view')}:{f.get('columns')}" for f in described)
+
+def register_views(con, described):
+    """Expose attachments as temporary views on this connection; scans stay out of core. A view that
+    cannot be created is logged and left out, so programs that do not read it still run"""
+    for f in described or ():
+        if f.get("view"):
+            try:
+                con.execute(f"CREATE OR REPLACE TEMP VIEW {_quote_identifier(f['view'])} AS "
+                            f"SELECT * FROM {reader(f['name'])}({_quote(f['path'])})")
+            except duckdb.Error as e:
+                logging.warning(f"Could not create view {f['view']} for {f['name']}: {str(e)}")
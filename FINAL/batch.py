@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Batch requests: question files are grouped by the data they use so each group runs in one worker,
+which fetches its datasets once and can plan every question with a single LLM call
+"""
+import os, json
+from task_patterns import detect_task_patterns, extract_urls
+
+BATCH_MAX_GROUP = int(os.getenv("AGENT_BATCH_MAX_GROUP", "8"))
+BATCH_COMBINED_PLAN = os.getenv("AGENT_BATCH_COMBINED_PLAN", "0") == "1"
+BATCH_MARKER = "# === QUESTION {n} ==="
+
+def source_key(task: str):
+    """What a question reads: the URLs it names, else its detected source kinds (None when unknown)"""
+    urls = extract_urls(task)
+    if urls:
+        return tuple(sorted(urls))
+    sources = detect_task_patterns(task)["data_sources"]
+    return ("kind",) + tuple(sorted(sources)) if sources else None
+
+def group(questions, shared_files: bool = False, max_group: int = BATCH_MAX_GROUP) -> list:
+    """Lists of question indices; uploaded data files put every question in one group"""
+    groups = {}
+    for i, (_, task) in enumerate(questions):
+        key = "files" if shared_files else source_key(task)
+        # Questions with no recognisable source have nothing to share
+        groups.setdefault(key if key is not None else ("alone", i), []).append(i)
+    chunks = []
+    for indices in groups.values():
+        chunks.extend(indices[i:i + max_group] for i in range(0, len(indices), max_group))
+    return chunks
+
+def entry(name: str, outcome: dict = None, error: str = None) -> bytes:
+    """One question's slot in the batch response; a result's pre-serialized bytes are spliced in"""
+    if outcome is not None and outcome.get("success"):
+        head = json.dumps({"question": name, "status": "succeeded"}).encode("utf-8")
+        return head[:-1] + b', "result": ' + outcome["result"].data + b"}"
+    error = error or (outcome or {}).get("error") or "No outcome"
+    return json.dumps({"question": name, "status": "failed", "error": error}).encode("utf-8")
+
+def response(entries) -> bytes:
+    return b"[" + b", ".join(entries) + b"]"
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Offline throughput check for /api/batch: N variants of the tips question sent as N concurrent /api
+calls, as one batch, and as one batch planned with a single LLM call (recorded-code Gemini stub)
+
+Usage: python bench/batch_test.py [--questions 6] [--llm-latency 0.5] [--rounds 3]
+"""
+import os, re, sys, json, time, shutil, argparse, tempfile, subprocess
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+from load_test import APP_DIR, BENCH_DIR, make_fixtures, serve_directory, rewrite, start_server, free_port, post
+
+THRESHOLDS = (30, 20, 25, 35, 40, 15, 45, 10, 50, 12)
+
+def variants(n: int, data_url: str, parquet: str) -> list:
+    with open(os.path.join(APP_DIR, "test_question_1.txt"), encoding="utf-8") as fh:
+        base = rewrite(fh.read(), data_url, parquet)
+    return [base.replace("higher than $30", f"higher than ${THRESHOLDS[i % len(THRESHOLDS)]}") +
+            ("" if i < len(THRESHOLDS) else f"\n(variant {i})") for i in range(n)]
+
+def recordings(n: int, data_url: str, parquet: str) -> list:
+    """Single-question replies plus one combined reply per possible batch-plan size"""
+    with open(os.path.join(BENCH_DIR, "recordings", "tips.py"), encoding="utf-8") as fh:
+        program = rewrite(fh.read(), data_url, parquet)
+    combined = [{"match": f"QUESTION {k} ===)", "code": "\n".join(f"# === QUESTION {i} ===\n{program}" for i in range(1, k + 1))}
+                for k in range(n, 1, -1)]
+    return combined + [{"match": "tips.csv", "code": program}]
+
+def llm_calls(base: str) -> float:
+    """Gemini calls so far, from the llm stage histogram on /metrics"""
+    text = requests.get(f"{base}/metrics", timeout=10).text
+    return sum(float(v) for v in re.findall(r'^agent_stage_seconds_count\{stage="llm"\} (\S+)$', text, re.MULTILINE))
+
+def independent(base: str, questions: list) -> dict:
+    with ThreadPoolExecutor(len(questions)) as pool:
+        results = list(pool.map(lambda q: post(f"{base}/api", q), questions))
+    return {"ok": sum(r["ok"] for r in results)}
+
+def batched(base: str, questions: list, combined: bool) -> dict:
+    files = [("files", (f"q{i}.txt", q.encode())) for i, q in enumerate(questions)]
+    resp = requests.post(f"{base}/api/batch", params={"combined": int(combined)}, files=files, timeout=600)
+    if resp.status_code != 200:
+        return {"ok": 0, "status": resp.status_code}
+    return {"ok": sum(entry["status"] == "succeeded" for entry in resp.json())}
+
+def measure(base: str, fn, rounds: int) -> dict:
+    best, calls, ok = float("inf"), 0.0, 0
+    for _ in range(rounds):
+        before = llm_calls(base)
+        start = time.perf_counter()
+        outcome = fn()
+        best = min(best, time.perf_counter() - start)
+        calls, ok = llm_calls(base) - before, outcome["ok"]
+    return {"wall_seconds": round(best, 3), "succeeded": ok, "llm_calls": calls}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--questions", type=int, default=6)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds the Gemini stub takes per call")
+    parser.add_argument("--rounds", type=int, default=3, help="best-of rounds per mode")
+    parser.add_argument("--pool-size", type=int, default=None)
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (fixtures, caches, server log)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="agent-batch-")
+    fixtures = make_fixtures(work)
+    data_server = serve_directory(fixtures["www"])
+    data_url = f"http://127.0.0.1:{data_server.server_address[1]}"
+    questions = variants(args.questions, data_url, fixtures["parquet"])
+    stub_path = os.path.join(work, "recordings.json")
+    with open(stub_path, "w") as fh:
+        json.dump(recordings(args.questions, data_url, fixtures["parquet"]), fh)
+
+    # Every question goes through planning and execution: no template answers, no cached programs
+    env = dict(os.environ,
+               AGENT_LLM_STUB=stub_path, AGENT_LLM_STUB_LATENCY=str(args.llm_latency),
+               AGENT_CACHE_DIR=os.path.join(work, "cache"),
+               AGENT_TEMPLATE_FAST_PATH="0", AGENT_CODE_CACHE="0", AGENT_RESPONSE_CACHE="0",
+               AGENT_MAX_QUEUED_JOBS=str(max(32, args.questions)))
+    if args.pool_size:
+        env["AGENT_POOL_SIZE"] = str(args.pool_size)
+
+    port = free_port()
+    log_path = os.path.join(work, "server.log")
+    server = start_server(env, port, log_path)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        independent(base, questions)  # warm-up: worker imports, sandbox children, HTTP cache
+        report = {
+            "questions": args.questions, "llm_latency": args.llm_latency,
+            "independent": measure(base, lambda: independent(base, questions), args.rounds),
+            "batch": measure(base, lambda: batched(base, questions, combined=False), args.rounds),
+            "batch_combined": measure(base, lambda: batched(base, questions, combined=True), args.rounds),
+        }
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        data_server.shutdown()
+
+    for mode in ("independent", "batch", "batch_combined"):
+        report[mode]["throughput_qps"] = round(args.questions / report[mode]["wall_seconds"], 3)
+    for mode in ("batch", "batch_combined"):
+        report[mode]["speedup"] = round(report["independent"]["wall_seconds"] / report[mode]["wall_seconds"], 2)
+    print(json.dumps(report, indent=2))
+    if args.keep:
+        print(f"work directory: {work}", file=sys.stderr)
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    failed = any(report[m]["succeeded"] < args.questions for m in ("independent", "batch", "batch_combined"))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
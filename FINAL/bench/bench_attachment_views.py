@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Check of the DuckDB views made for data files: uploads and prefetched URLs named after SQL keywords
+(order.csv, group.csv, table.csv, ...) get usable view names, and a view that cannot be created is
+skipped without failing programs that do not read it
+
+Usage: python bench/bench_attachment_views.py
+Exits 1 if a view is missing or unusable, or an execution fails because of another file's view.
+"""
+import os, sys, json, tempfile
+
+from load_test import APP_DIR, serve_directory
+
+sys.path.insert(0, APP_DIR)
+
+KEYWORD_FILES = ("order.csv", "group.csv", "table.csv", "select.csv", "limit.csv")
+
+def write_csv(path: str, rows: int):
+    with open(path, "w") as fh:
+        fh.write("id,amount\n" + "".join(f"{i},{i * 1.5}\n" for i in range(rows)))
+
+def main():
+    failures, report = [], {}
+    with tempfile.TemporaryDirectory(prefix="attachment-views-") as work:
+        os.environ["AGENT_CACHE_DIR"] = os.path.join(work, "cache")
+        import attachments, prefetch, duckdb_manager
+        import data_analyst_agent as agent
+
+        www = os.path.join(work, "www")
+        os.makedirs(www)
+        uploads = []
+        for i, name in enumerate(KEYWORD_FILES):
+            path = os.path.join(work, name)
+            write_csv(path, 10 + i)
+            uploads.append({"field": "file", "name": name, "path": path, "size": os.path.getsize(path)})
+        broken = os.path.join(work, "broken.parquet")
+        with open(broken, "wb") as fh:
+            fh.write(b"not a parquet file")
+        uploads.append({"field": "file", "name": "broken.parquet", "path": broken, "size": os.path.getsize(broken)})
+        write_csv(os.path.join(www, "order.csv"), 7)
+
+        # A question naming .../order.csv: downloaded and described as the prefetch does it
+        server = serve_directory(www)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/order.csv"
+            fetched = prefetch.dataset(url)
+        finally:
+            server.shutdown()
+        con = duckdb_manager.cursor()
+        prefetched = attachments.describe([fetched], con)[0]
+        described = attachments.describe(uploads, con)
+        report["views"] = {f["name"]: f.get("view") for f in described}
+        report["prefetched_view"] = prefetched.get("view")
+
+        for f in described[:len(KEYWORD_FILES)]:
+            expected = "t_" + os.path.splitext(f["name"])[0]
+            if f.get("view") != expected:
+                failures.append(f"{f['name']}: view {f.get('view')!r}, expected {expected}")
+        if prefetched.get("view") != "t_order":
+            failures.append(f"prefetched order.csv: view {prefetched.get('view')!r}, expected t_order")
+
+        programs = {
+            "reads_keyword_views": ("result = [int(db.sql('SELECT count(*) FROM t_order').fetchone()[0]), "
+                                    "int(db.sql('SELECT sum(id) FROM t_group').fetchone()[0])]", [10, 55]),
+            "ignores_views": ("result = [1 + 1]", [2]),
+        }
+        # With the broken upload among the files: its view is skipped, the others still work
+        for name, (code, expected) in programs.items():
+            result = agent.execute_code(code, files=described)
+            value = getattr(result, "value", result)
+            report[name] = value
+            if value != expected:
+                failures.append(f"{name}: got {value}, expected {expected}")
+
+        # The prefetched view on its own, as for a question with no uploads
+        result = agent.execute_code("result = [int(db.sql('SELECT count(*) FROM t_order').fetchone()[0])]",
+                                    files=[prefetched])
+        report["prefetched_only"] = getattr(result, "value", result)
+        if report["prefetched_only"] != [7]:
+            failures.append(f"prefetched order.csv: got {report['prefetched_only']}, expected [7]")
+
+    print(json.dumps(report, indent=2, default=str))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
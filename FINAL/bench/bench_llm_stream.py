@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Offline check of streaming code validation (llm_client.stream_code) against the stub's chunked replies:
+prose and syntax errors are abandoned mid-stream, a MAX_TOKENS finish is rejected as truncated and a
+program without `result` as no_result; generate_code's re-request carries the repair hint, succeeds,
+and counts each rejection in agent_llm_rejected_total
+
+Usage: python bench/bench_llm_stream.py [--chunk-chars 40] [--latency 1.0]
+Exits 1 if a reply is accepted or rejected for the wrong reason, read to the end when it could be
+abandoned early, or a repaired request fails.
+"""
+import os, sys, json, time, shutil, asyncio, argparse, tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROGRAM = "".join(f"x{i} = {i} * 2\n" for i in range(30)) + "result = [x29]\n"
+PROSE = "".join(f"I would first look at the data and then work out answer number {i}.\n" for i in range(30))
+SYNTAX = "import pandas as pd\ntotal = 0\nfor x in range(10)\n    total += x\n" + PROGRAM
+NO_RESULT = PROGRAM.replace("result = [x29]\n", "answer = [x29]\n")
+
+# (stub reply, finish reason, expected rejection or None, whether the stream must stop early)
+CASES = {
+    "prose": (PROSE, "STOP", "prose", True),
+    "syntax": (SYNTAX, "STOP", "syntax", True),
+    "truncated": (PROGRAM, "MAX_TOKENS", "truncated", False),
+    "no_result": (NO_RESULT, "STOP", "no_result", False),
+    "valid": (PROGRAM, "STOP", None, False),
+}
+
+def recordings(latency: float) -> list:
+    out = [{"match": f"CASE {name}", "code": reply, "finish_reason": finish, "latency": latency}
+           for name, (reply, finish, _, _) in CASES.items()]
+    # Successive replies: prose, then a syntax error, then a program (the third and last try)
+    out.append({"match": "CASE sequence", "code": [PROSE, SYNTAX, PROGRAM]})
+    # The repaired request matches on its hint; the first one gets prose
+    out.append({"match": "PREVIOUS REPLY REJECTED: it was prose", "code": PROGRAM})
+    out.append({"match": "CASE repair", "code": PROSE})
+    return out
+
+def rejected_total(metrics) -> dict:
+    """{reason: count} from the agent_llm_rejected_total samples"""
+    counts = {}
+    for line in metrics.render().splitlines():
+        if line.startswith("agent_llm_rejected_total{"):
+            labels, value = line.rsplit(" ", 1)
+            counts[labels.split('reason="')[1].split('"')[0]] = float(value)
+    return counts
+
+async def generate(agent, metrics, prompt: str) -> tuple:
+    """generate_code under a trace; (code or the exception, llm spans), folded into the metrics like a task"""
+    trace = metrics.start_trace()
+    start = time.perf_counter()
+    try:
+        out = await agent.generate_code(prompt)
+    except Exception as e:
+        out = e
+    metrics.observe_task("error" if isinstance(out, Exception) else "success", time.perf_counter() - start, trace.spans)
+    return out, [s for s in trace.spans if s["stage"] == "llm"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunk-chars", type=int, default=40, help="characters per streamed chunk")
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds a whole stub reply takes to stream")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="agent-llm-stream-")
+    stub_path = os.path.join(work, "recordings.json")
+    with open(stub_path, "w") as fh:
+        json.dump(recordings(args.latency), fh)
+    # Read when the agent is imported
+    os.environ.update(AGENT_CACHE_DIR=os.path.join(work, "cache"), AGENT_LLM_STUB=stub_path,
+                      AGENT_LLM_STUB_CHUNK_CHARS=str(args.chunk_chars))
+    sys.path.insert(0, APP_DIR)
+    import data_analyst_agent as agent
+    import llm_client, llm_stub, metrics
+
+    problems, report = [], {}
+    model = llm_stub.StubModel(stub_path, chunk_chars=args.chunk_chars)
+    for name, (reply, _, expected, early) in CASES.items():
+        stats = {}
+        start = time.perf_counter()
+        try:
+            llm_client.stream_code(model, f"CASE {name}", {}, stats)
+            reason = None
+        except llm_client.RejectedOutput as e:
+            reason = e.reason
+        chunks = -(-len(reply) // args.chunk_chars)
+        report[name] = {"rejected": reason, "chunks_read": stats["chunks"], "chunks": chunks,
+                        "seconds": round(time.perf_counter() - start, 3)}
+        if reason != expected:
+            problems.append(f"{name}: rejected as {reason}, expected {expected}")
+        if early and stats["chunks"] >= chunks:
+            problems.append(f"{name}: read all {chunks} chunks instead of stopping early")
+
+    before = rejected_total(metrics)
+    for name, tries in (("repair", ["prose", None]), ("sequence", ["prose", "syntax", None])):
+        code, spans = asyncio.run(generate(agent, metrics, f"CASE {name}"))
+        got = [s.get("rejected") for s in spans]
+        report[name] = {"tries": got, "succeeded": isinstance(code, str)}
+        if code != PROGRAM.strip():
+            problems.append(f"{name}: re-request did not return the program ({code!r:.80})")
+        if got != tries:
+            problems.append(f"{name}: tries rejected as {got}, expected {tries}")
+    after = rejected_total(metrics)
+    increments = {reason: after.get(reason, 0) - before.get(reason, 0) for reason in after}
+    report["agent_llm_rejected_total"] = increments
+    if increments != {"prose": 2, "syntax": 1}:
+        problems.append(f"agent_llm_rejected_total grew by {increments}, expected prose 2, syntax 1")
+
+    report["problems"] = problems
+    print(json.dumps(report, indent=2))
+    shutil.rmtree(work, ignore_errors=True)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Peak-memory check for the out-of-core helpers (analysis.py) against loading the file into pandas,
+on a synthetic multi-million-row court-metadata-style parquet file
+
+Usage: python bench/bench_out_of_core.py [--rows 5000000] [--max-mb 400] [--skip-pandas]
+Exits 1 if the helpers' peak RSS exceeds --max-mb or their answers disagree with pandas.
+"""
+import os, sys, json, time, argparse, resource, tempfile, subprocess
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+COURTS = 25
+
+def make_parquet(path: str, rows: int):
+    """Written by DuckDB straight from range() so generating the file never holds it in memory"""
+    import duckdb
+    duckdb.connect().execute(f"""
+        COPY (
+            SELECT
+                i AS case_id,
+                '33_' || (i % {COURTS}) AS court,
+                2010 + (i % 15) AS year,
+                DATE '2010-01-01' + CAST(i % 5000 AS INTEGER) AS date_of_registration,
+                DATE '2010-01-01' + CAST(i % 5000 + 30 + (i % 15) * 4 + (hash(i) % 60) AS INTEGER) AS decision_date,
+                'Judge ' || (hash(i) % 500) AS judge,
+                md5(CAST(i AS VARCHAR)) AS title
+            FROM range({rows}) t(i)
+        ) TO '{path}' (FORMAT parquet, ROW_GROUP_SIZE 122880)""")
+
+def run_pandas(path: str) -> dict:
+    import pandas as pd, numpy as np
+    df = pd.read_parquet(path)
+    counts = df.groupby("court").size()
+    sub = df[df["court"] == "33_10"].copy()
+    sub["delay"] = (pd.to_datetime(sub["decision_date"]) - pd.to_datetime(sub["date_of_registration"])).dt.days
+    yearly = sub.groupby("year")["delay"].mean().reset_index()
+    slope = float(np.polyfit(yearly["year"], yearly["delay"], 1)[0])
+    points = df.sample(n=min(len(df), 5000), random_state=42)[["year", "date_of_registration", "decision_date"]]
+    return {"top_court": counts.idxmax(), "cases": int(counts.max()), "slope": slope, "points": len(points)}
+
+def run_helpers(path: str) -> dict:
+    import analysis, duckdb_manager
+    h = analysis.helpers(duckdb_manager.cursor())
+    rel = h["load"](path)
+    counts = h["group_agg"](rel, by="court", cases="count(*)", order="cases DESC, court", limit=1)
+    yearly = h["group_agg"](rel, by="year", where="court = '33_10'",
+                            delay="avg(decision_date - date_of_registration)")
+    slope = h["regression"](yearly, "year", "delay")["slope"]
+    points = h["sample"](rel, n=5000, columns=["year", "decision_date - date_of_registration AS delay"])
+    return {"top_court": counts["court"][0], "cases": int(counts["cases"][0]), "slope": slope, "points": len(points)}
+
+def measure(mode: str, path: str) -> dict:
+    """Run one approach in a fresh interpreter so ru_maxrss is that approach's own peak"""
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", mode, path],
+                         capture_output=True, text=True, cwd=APP_DIR)
+    if out.returncode != 0:
+        raise RuntimeError(f"{mode} run failed:\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def worker(mode: str, path: str):
+    import pandas, numpy, duckdb  # noqa: F401 - library imports count towards the baseline, not the workload
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    answer = (run_pandas if mode == "pandas" else run_helpers)(path)
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"mode": mode, "seconds": seconds, "baseline_mb": baseline, "peak_mb": peak, "answer": answer}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--max-mb", type=float, default=400, help="peak RSS bound for the helpers run")
+    parser.add_argument("--memory-limit", default="256MB", help="AGENT_DUCKDB_MEMORY_LIMIT for the helpers run")
+    parser.add_argument("--skip-pandas", action="store_true", help="only measure the helpers")
+    parser.add_argument("--worker", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return 0
+
+    os.environ["AGENT_DUCKDB_MEMORY_LIMIT"] = args.memory_limit
+    with tempfile.TemporaryDirectory(prefix="ooc-") as work:
+        os.environ["AGENT_DUCKDB_TEMP_DIR"] = os.path.join(work, "spill")
+        path = os.path.join(work, "metadata.parquet")
+        start = time.perf_counter()
+        make_parquet(path, args.rows)
+        print(f"rows={args.rows:,} file={os.path.getsize(path) / 2**20:.0f}MB generated in {time.perf_counter() - start:.1f}s")
+
+        runs = [measure("helpers", path)] + ([] if args.skip_pandas else [measure("pandas", path)])
+        for run in runs:
+            print(f"{run['mode']:8s} {run['seconds']:7.2f}s  peak {run['peak_mb']:7.0f}MB "
+                  f"(+{run['peak_mb'] - run['baseline_mb']:.0f}MB over imports)  {run['answer']}")
+
+    failures = []
+    helpers = runs[0]
+    if helpers["peak_mb"] > args.max_mb:
+        failures.append(f"helpers peak {helpers['peak_mb']:.0f}MB exceeds {args.max_mb:.0f}MB")
+    if len(runs) > 1:
+        expected, got = runs[1]["answer"], helpers["answer"]
+        if (got["top_court"], got["cases"]) != (expected["top_court"], expected["cases"]) or \
+                abs(got["slope"] - expected["slope"]) > 1e-6 * max(1, abs(expected["slope"])):
+            failures.append(f"answers differ: helpers {got} vs pandas {expected}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
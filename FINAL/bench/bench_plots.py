@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Render time and memory of the chart helpers (plots.py) against the pattern templates and generated
+code used before: pyplot figure, scatter, stats.linregress line, savefig(bbox_inches="tight"), base64
+
+Usage: python bench/bench_plots.py [--points 244,100000,1000000] [--repeat 5]
+Each variant runs in a fresh process; memory is the growth of peak RSS over the imports.
+"""
+import os, sys, json, time, argparse, resource, multiprocessing
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+def legacy_scatter(x, y) -> str:
+    import io, base64
+    import matplotlib.pyplot as plt
+    from scipy import stats
+    plt.figure(figsize=(8, 6))
+    plt.scatter(x, y, alpha=0.6)
+    slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
+    plt.plot(x, slope * x + intercept, "r--", alpha=0.8)
+    plt.xlabel("x")
+    plt.ylabel("y")
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format="png", dpi=80, bbox_inches="tight")
+    plt.close()
+    return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+
+def legacy_hist(x, y) -> str:
+    import io, base64
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(8, 6))
+    plt.hist(x, bins=20)
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format="png", dpi=80, bbox_inches="tight")
+    plt.close()
+    return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+
+def helper_scatter(x, y) -> str:
+    import plots
+    return plots.scatter_with_regression(x, y, xlabel="x", ylabel="y")
+
+def helper_hist(x, y) -> str:
+    import plots
+    return plots.hist(x, bins=20)
+
+VARIANTS = {"scatter+regression": (legacy_scatter, helper_scatter), "hist": (legacy_hist, helper_hist)}
+
+def measure(chart: str, which: int, points: int, repeat: int, out):
+    import numpy as np, pandas as pd
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot, scipy.stats, plots  # imports are not part of the measurement
+    rng = np.random.default_rng(0)
+    x = pd.Series(rng.normal(30, 10, points))
+    y = 0.15 * x + rng.normal(0, 1, points)
+    fn = VARIANTS[chart][which]
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times, size = [], 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(fn(x, y))
+        times.append(time.perf_counter() - start)
+    out.send({"seconds": min(times), "first_seconds": times[0], "uri_chars": size,
+              "peak_rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024})
+
+def run(chart: str, which: int, points: int, repeat: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=measure, args=(chart, which, points, repeat, send))
+    proc.start()
+    result = recv.recv()
+    proc.join()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", default="244,100000,1000000", help="comma-separated point counts")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    report = []
+    for chart in VARIANTS:
+        for points in (int(p) for p in args.points.split(",")):
+            legacy, helper = run(chart, 0, points, args.repeat), run(chart, 1, points, args.repeat)
+            report.append({"chart": chart, "points": points, "legacy": legacy, "helper": helper,
+                           "speedup": round(legacy["seconds"] / helper["seconds"], 2)})
+            print(f"{chart:20s} {points:>9,} points  legacy {legacy['seconds'] * 1000:7.1f} ms "
+                  f"{legacy['peak_rss_growth_mb']:6.1f} MB  helper {helper['seconds'] * 1000:7.1f} ms "
+                  f"{helper['peak_rss_growth_mb']:6.1f} MB  ({report[-1]['speedup']}x)", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
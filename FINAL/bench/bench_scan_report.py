@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Check of duckdb_manager.scan_report on a hive-partitioned parquet tree (year=/court=): files scanned
+with and without a partition filter, the reported source glob, and the SELECT * warning
+
+Usage: python bench/bench_scan_report.py [--years 4] [--courts 3] [--rows 1000]
+Exits 1 if a report disagrees with the files the query has to read.
+"""
+import os, sys, json, argparse, tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+def make_tree(root: str, years: int, courts: int, rows: int):
+    """One parquet file per year=/court= partition"""
+    import duckdb
+    duckdb.connect().execute(f"""
+        COPY (
+            SELECT i AS case_id, 2020 + (i % {years}) AS year, 'c' || (i % {courts}) AS court,
+                   md5(CAST(i AS VARCHAR)) AS title
+            FROM range({rows * years * courts}) t(i)
+        ) TO '{root}' (FORMAT parquet, PARTITION_BY (year, court))""")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--years", type=int, default=4)
+    parser.add_argument("--courts", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=1000, help="rows per partition")
+    args = parser.parse_args()
+
+    import duckdb_manager
+    total = args.years * args.courts
+    with tempfile.TemporaryDirectory(prefix="scan-report-") as work:
+        root = os.path.join(work, "cases")
+        make_tree(root, args.years, args.courts, args.rows)
+        glob = f"{root}/*/*/*.parquet"
+        source = f"read_parquet('{glob}', hive_partitioning = true)"
+        # (query, expected files scanned, SELECT * warning expected)
+        cases = {
+            "no_filter": (f"SELECT case_id, court FROM {source}", total, False),
+            "year": (f"SELECT case_id FROM {source} WHERE year = 2021", args.courts, False),
+            "year_court": (f"SELECT case_id FROM {source} WHERE year = 2021 AND court = 'c1'", 1, False),
+            "column_filter": (f"SELECT case_id FROM {source} WHERE case_id < 10", total, False),
+            "star": (f"SELECT * FROM {source} WHERE year = 2021", args.courts, True),
+        }
+        failures, report = [], {}
+        for name, (query, scanned, star) in cases.items():
+            result = duckdb_manager.scan_report(query)
+            report[name] = result
+            scan = result["scans"][0] if result["scans"] else {}
+            if scan.get("source") != glob:
+                failures.append(f"{name}: source {scan.get('source')!r}, expected the glob")
+            if (scan.get("files_scanned"), scan.get("files_total")) != (scanned, total):
+                failures.append(f"{name}: scans {scan.get('files_scanned')}/{scan.get('files_total')} files, "
+                                f"expected {scanned}/{total}")
+            star_warned = any("SELECT *" in w for w in result["warnings"])
+            if result["select_star"] != star or star_warned != star:
+                failures.append(f"{name}: SELECT * reported {result['select_star']}, warned {star_warned}")
+            all_warned = any("reads all" in w for w in result["warnings"])
+            if all_warned != (scanned == total):
+                failures.append(f"{name}: all-files warning {'given' if all_warned else 'missing'}")
+
+    print(json.dumps(report, indent=2))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
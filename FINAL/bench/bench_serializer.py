@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: legacy recursive sanitize + double json.dumps vs serializer.dumps on large tabular results
+
+Usage: python bench/bench_serializer.py [--rows 200000] [--repeat 3]
+"""
+import os, sys, json, time, argparse
+import numpy as np, pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import serializer
+
+def legacy_sanitize(obj):
+    """The element-wise sanitize() that execute_code used before serializer.py"""
+    if isinstance(obj, (np.integer, np.int32, np.int64)):
+        return int(obj)
+    elif isinstance(obj, (np.floating, np.float32, np.float64)):
+        val = float(obj)
+        if np.isnan(val) or np.isinf(val):
+            return None
+        return val
+    elif isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="ignore")
+    elif isinstance(obj, list):
+        return [legacy_sanitize(x) for x in obj]
+    elif isinstance(obj, dict):
+        return {k: legacy_sanitize(v) for k, v in obj.items()}
+    elif pd.isna(obj):
+        return None
+    else:
+        return obj
+
+def legacy_pipeline(frame: pd.DataFrame, series: np.ndarray) -> bytes:
+    # Generated code had to hand over plain Python containers for sanitize() to cope
+    result = [frame.to_dict(orient="records"), series.tolist()]
+    result = legacy_sanitize(result)
+    json.dumps(result)                          # validation pass in execute_code
+    return json.dumps(result).encode("utf-8")   # output pass in main()
+
+def new_pipeline(frame: pd.DataFrame, series: np.ndarray) -> bytes:
+    return serializer.dumps([frame, series])
+
+def make_data(rows: int):
+    rng = np.random.default_rng(42)
+    values = rng.normal(size=rows)
+    values[rng.random(rows) < 0.05] = np.nan
+    frame = pd.DataFrame({
+        "id": np.arange(rows),
+        "value": values,
+        "ratio": rng.random(rows),
+        "label": rng.choice(["alpha", "beta", "gamma", None], size=rows),
+        "when": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 10**6, rows), unit="s"),
+    })
+    series = rng.normal(size=rows * 5)
+    series[::97] = np.inf
+    return frame, series
+
+def timed(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    frame, series = make_data(args.rows)
+    # Legacy path cannot serialize Timestamps at all; give it ISO strings so it gets to run
+    legacy_frame = frame.assign(when=frame["when"].astype(str))
+
+    legacy_s, legacy_out = timed(lambda: legacy_pipeline(legacy_frame, series), args.repeat)
+    new_s, new_out = timed(lambda: new_pipeline(frame, series), args.repeat)
+
+    print(f"rows={args.rows:,} array={len(series):,}")
+    print(f"legacy sanitize + 2x json.dumps: {legacy_s:8.3f}s  {len(legacy_out) / 1e6:7.1f}MB")
+    print(f"serializer.dumps (single pass):  {new_s:8.3f}s  {len(new_out) / 1e6:7.1f}MB")
+    print(f"speedup: {legacy_s / new_s:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Check of template matching: the three known questions (also with other thresholds and URLs) use their
+template, while near-miss questions over the same datasets, or with a similar wording, use none
+
+Usage: python bench/bench_template_match.py
+Exits 1 if a known question is not matched or a near miss is.
+"""
+import os, sys, json
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from fallback_templates import registry
+
+def known(number: int) -> str:
+    with open(os.path.join(APP_DIR, f"test_question_{number}.txt"), encoding="utf-8") as fh:
+        return fh.read()
+
+NEAR_MISSES = {
+    # The films page, but other sub-questions
+    "films_other_questions": """Scrape the list of highest grossing films from Wikipedia. It is at the URL:
+https://en.wikipedia.org/wiki/List_of_highest-grossing_films
+
+Answer the following questions and respond with a JSON array of strings containing the answer.
+
+1. Which film has the highest worldwide gross?
+2. How many films in the top 50 were released after 2010?
+3. What's the average Peak of films released before 2000?
+4. Draw a bar chart of the number of films per decade.""",
+    # The films questions with one extra sub-question
+    "films_extra_question": known(2) + "\n5. Which studio has the most films in the list?",
+    "video_games": """Scrape the list of highest grossing video games from Wikipedia:
+https://en.wikipedia.org/wiki/List_of_best-selling_video_games
+
+1. How many games sold over 50 million copies?
+2. Which is the earliest game in the list?
+3. What's the correlation between Rank and Sales?""",
+    "tips_single_question": """How many tips were above $5 at dinner in the tips dataset?
+https://raw.githubusercontent.com/mwaskom/seaborn-data/master/tips.csv""",
+    # The tips questions without the plot
+    "tips_fewer_questions": """Fetch the "tips" dataset (CSV) from:
+https://raw.githubusercontent.com/mwaskom/seaborn-data/master/tips.csv
+
+1. How many dinner bills (time == "Dinner") were higher than $30?
+2. Which day of the week had the largest average tip? (return the day string)
+3. What is the Pearson correlation (rounded to 3 decimals) between total_bill and tip?""",
+    "court_other_questions": """The Indian high court judgement dataset, structured metadata at
+s3://indian-high-court-judgments/metadata/parquet/year=*/court=*/bench=*/metadata.parquet?s3_region=ap-south-1
+
+Answer the following questions and respond with a JSON object:
+
+{
+  "Which judge decided the most cases in 2021?": "...",
+  "How many cases did court=33_10 register in 2020?": "..."
+}""",
+}
+
+def main():
+    expected = {"tips": (known(1), "tips"), "films": (known(2), "highest_grossing_films"),
+                "court": (known(3), "indian_high_court"),
+                "tips_threshold": (known(1).replace("$30", "$25"), "tips"),
+                "films_local_url": (known(2).replace("https://en.wikipedia.org/wiki", "http://127.0.0.1:8000"),
+                                    "highest_grossing_films")}
+    expected.update((name, (task, None)) for name, task in NEAR_MISSES.items())
+
+    failures, report = [], {}
+    for name, (task, template) in expected.items():
+        best, confidence = registry.scores(task)[0]
+        match = registry.match(task)
+        got = match.name if match else None
+        report[name] = {"best_score": [best.name, confidence], "match": got}
+        if got != template:
+            failures.append(f"{name}: matched {got}, expected {template}")
+
+    print(json.dumps(report, indent=2))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Timing check for read_wiki_table (wiki_tables.py) against pd.read_html + picking a table, on a
+synthetic Wikipedia-style list page with navboxes, side tables and one large footnoted main table
+
+Usage: python bench/bench_wiki_tables.py [--rows 5000] [--side-tables 20] [--repeat 5]
+"""
+import os, sys, time, random, shutil, argparse, tempfile, functools, threading
+from http.server import ThreadingHTTPServer
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from load_test import _QuietHandler
+
+COLUMNS = ["Rank", "Peak", "Title", "Worldwide gross", "Year"]
+
+def make_page(path: str, rows: int, side_tables: int):
+    rnd = random.Random(0)
+    navboxes = "".join(f'<table class="navbox"><tr><th>Navigation {i}</th></tr>'
+                       + "".join(f"<tr><td><a href='#'>Link {j}</a></td></tr>" for j in range(60)) + "</table>"
+                       for i in range(40))
+    side = "".join(f'<table class="wikitable sortable"><caption>Box office records {i}</caption>'
+                   "<tr><th>Year</th><th>Film</th><th>Gross</th></tr>"
+                   + "".join(f"<tr><td>{1980 + j % 45}</td><td>Film {j}</td><td>${rnd.randint(1, 9) * 10 ** 8:,}</td></tr>"
+                             for j in range(300)) + "</table>"
+                   for i in range(side_tables))
+    body = "".join(
+        f"<tr><td>{r}</td><td>{rnd.randint(1, r)}{'[a]' if r % 7 == 0 else ''}</td>"
+        f"<td><i><a href='#'>Film {r}</a></i>{'†' if r % 5 == 0 else ''}</td>"
+        f"<td>${3_000_000_000 - r * 500_000:,}{'[# 2]' if r % 3 == 0 else ''}</td>"
+        f"<td>{rnd.randint(1980, 2024)}</td><td>[{r}]</td></tr>"
+        for r in range(1, rows + 1))
+    main = ('<table class="wikitable sortable plainrowheaders"><caption>Highest-grossing films</caption><tbody>'
+            "<tr><th>Rank</th><th>Peak</th><th>Title</th><th>Worldwide gross</th><th>Year</th><th>Ref</th></tr>"
+            f"{body}</tbody></table>")
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write('<!DOCTYPE html><html><head><script>RLCONF={"wgRevisionId":1234567890}</script></head>'
+                 f"<body>{navboxes}{side}{main}{navboxes}</body></html>")
+
+def with_read_html(url: str):
+    import pandas as pd
+    tables = pd.read_html(url)
+    df = next(t for t in tables if "Rank" in t.columns and "Peak" in t.columns)
+    df["Worldwide gross"] = pd.to_numeric(df["Worldwide gross"].astype(str).str.replace(r"\[.*?\]|[^0-9.]", "", regex=True),
+                                          errors="coerce")
+    return len(df), len(tables)
+
+def best(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000, help="rows of the main table")
+    parser.add_argument("--side-tables", type=int, default=20, help="other wikitables on the page")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="wiki-") as work:
+        os.environ["AGENT_CACHE_DIR"] = work
+        import http_cache, wiki_tables
+        http_cache.install()
+        make_page(os.path.join(work, "list.html"), args.rows, args.side_tables)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_QuietHandler, directory=work))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/list.html"
+        try:
+            http_cache.fetch(url)  # every variant reads the page from the HTTP cache
+            rows, tables = with_read_html(url)
+            read_html = best(lambda: with_read_html(url), args.repeat)
+
+            def cold():
+                wiki_tables.get_wiki_cache()._memory.clear()
+                shutil.rmtree(wiki_tables.WIKI_CACHE_DIR, ignore_errors=True)
+                return wiki_tables.read_wiki_table(url, match="grossing", columns=COLUMNS)
+
+            df = cold()
+            assert len(df) == rows and str(df["Worldwide gross"].dtype) == "Int64", df.dtypes
+            timings = {"read_html (all tables)": read_html, "read_wiki_table cold": best(cold, args.repeat)}
+            wiki_tables.read_wiki_table(url, match="grossing", columns=COLUMNS)
+            timings["read_wiki_table same revision"] = best(
+                lambda: wiki_tables.read_wiki_table(url, match="grossing", columns=COLUMNS), args.repeat)
+        finally:
+            server.shutdown()
+
+    print(f"page: {tables} tables, main table {rows:,} rows")
+    for name, seconds in timings.items():
+        print(f"{name:32s} {seconds * 1000:8.1f} ms  ({read_html / seconds:5.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end load test: the real server (main.py) with a recorded-code Gemini stub and local
+copies of the tips CSV, the Wikipedia films page and a partitioned court-metadata parquet tree
+
+Usage: python bench/load_test.py [--concurrency 4] [--requests 24] [--llm-latency 0.5]
+                                 [--no-fast-path] [--no-code-cache] [--record-baseline | --threshold 0.2]
+"""
+import os, sys, json, time, shutil, socket, argparse, tempfile, threading, subprocess, functools
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import numpy as np, pandas as pd, requests, duckdb
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+LOAD_BASELINE = os.getenv("AGENT_LOAD_BASELINE", os.path.join(BENCH_DIR, "load_baseline.json"))
+
+TIPS_URL = "https://raw.githubusercontent.com/mwaskom/seaborn-data/master/tips.csv"
+FILMS_URL = "https://en.wikipedia.org/wiki/List_of_highest-grossing_films"
+COURT_PATH = "s3://indian-high-court-judgments/metadata/parquet/year=*/court=*/bench=*/metadata.parquet?s3_region=ap-south-1"
+
+# Recorded programs; `match` is a string that only that question's prompt contains
+RECORDINGS = [
+    ("tips.csv", "tips.py"),
+    ("List_of_highest-grossing_films", "films.py"),
+    ("metadata.parquet", "court.py"),
+]
+QUESTIONS = ["test_question_1.txt", "test_question_2.txt", "test_question_3.txt"]
+
+FILMS = [
+    (1, 1, "Avatar", 2923706026, 2009), (2, 1, "Avengers: Endgame", 2797501328, 2019),
+    (3, 3, "Avatar: The Way of Water", 2320250281, 2022), (4, 1, "Titanic", 2264743305, 1997),
+    (5, 3, "Star Wars: The Force Awakens", 2071310218, 2015), (6, 4, "Avengers: Infinity War", 2052415039, 2018),
+    (7, 6, "Spider-Man: No Way Home", 1921847111, 2021), (8, 8, "Inside Out 2", 1698863816, 2024),
+    (9, 3, "Jurassic World", 1671537444, 2015), (10, 7, "The Lion King", 1662020819, 2019),
+    (11, 3, "The Avengers", 1520538536, 2012), (12, 4, "Furious 7", 1515341399, 2015),
+    (13, 11, "Top Gun: Maverick", 1495696292, 2022), (14, 10, "Frozen II", 1453683476, 2019),
+    (15, 14, "Barbie", 1447038421, 2023), (16, 5, "Avengers: Age of Ultron", 1405018048, 2015),
+    (17, 16, "The Super Mario Bros. Movie", 1361992475, 2023), (18, 9, "Black Panther", 1349926083, 2018),
+    (19, 3, "Harry Potter and the Deathly Hallows – Part 2", 1342359942, 2011),
+    (20, 9, "Star Wars: The Last Jedi", 1332539889, 2017),
+]
+
+# --- fixtures ---
+
+def make_tips(path: str):
+    rng = np.random.default_rng(0)
+    n = 244
+    total_bill = rng.gamma(4.5, 4.4, n).round(2) + 3
+    pd.DataFrame({
+        "total_bill": total_bill,
+        "tip": (total_bill * rng.normal(0.15, 0.04, n)).clip(1).round(2),
+        "sex": rng.choice(["Male", "Female"], n),
+        "smoker": rng.choice(["Yes", "No"], n),
+        "day": rng.choice(["Thur", "Fri", "Sat", "Sun"], n, p=[0.25, 0.08, 0.36, 0.31]),
+        "time": rng.choice(["Lunch", "Dinner"], n, p=[0.28, 0.72]),
+        "size": rng.integers(1, 7, n),
+    }).to_csv(path, index=False)
+
+def make_films_page(path: str):
+    rng = np.random.default_rng(1)
+    rows = list(FILMS)
+    gross = rows[-1][3]
+    for rank in range(len(rows) + 1, 51):
+        gross -= int(rng.integers(5_000_000, 20_000_000))
+        rows.append((rank, int(rng.integers(1, rank + 1)), f"Film {rank}", gross, int(rng.integers(1993, 2025))))
+    body = "\n".join(
+        f"<tr><td>{r}</td><td>{p}</td><td><i><a href='#'>{t}</a></i></td><td>${g:,}</td><td>{y}</td><td>[{r}]</td></tr>"
+        for r, p, t, g, y in rows)
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write(f"""<!DOCTYPE html><html><head><title>List of highest-grossing films</title></head><body>
+<table class="wikitable"><caption>Highest-grossing films</caption>
+<tr><th>Rank</th><th>Peak</th><th>Title</th><th>Worldwide gross</th><th>Year</th><th>Ref</th></tr>
+{body}
+</table></body></html>""")
+
+def make_court_tree(root: str):
+    """year=/court=/bench= partitions with the columns the court questions use"""
+    rng = np.random.default_rng(2)
+    con = duckdb.connect()
+    for year in range(2019, 2023):
+        for court, weight in (("33_10", 3), ("27_1", 5), ("9_13", 2), ("19_16", 1)):
+            for bench in ("b1", "b2"):
+                n = int(rng.integers(50, 150)) * weight
+                registered = pd.Timestamp(f"{year - 1}-01-01") + pd.to_timedelta(rng.integers(0, 365, n), unit="D")
+                delay = rng.integers(30, 400, n) + (year - 2019) * 25
+                part = pd.DataFrame({
+                    "court_code": court.replace("_", "~"),
+                    "title": [f"Case {i}" for i in range(n)],
+                    "date_of_registration": registered.strftime("%Y-%m-%d"),
+                    "decision_date": (registered + pd.to_timedelta(delay, unit="D")).strftime("%Y-%m-%d"),
+                    "disposal_nature": rng.choice(["DISMISSED", "ALLOWED", "DISPOSED"], n),
+                })
+                directory = os.path.join(root, f"year={year}", f"court={court}", f"bench={bench}")
+                os.makedirs(directory, exist_ok=True)
+                con.register("part", part)
+                con.execute(f"COPY part TO '{os.path.join(directory, 'metadata.parquet')}' (FORMAT parquet)")
+                con.unregister("part")
+
+def make_fixtures(root: str) -> dict:
+    os.makedirs(os.path.join(root, "www", "wiki"), exist_ok=True)
+    make_tips(os.path.join(root, "www", "tips.csv"))
+    make_films_page(os.path.join(root, "www", "wiki", "List_of_highest-grossing_films.html"))
+    make_court_tree(os.path.join(root, "parquet"))
+    return {"www": os.path.join(root, "www"),
+            "parquet": os.path.join(root, "parquet", "year=*", "court=*", "bench=*", "metadata.parquet")}
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def serve_directory(directory: str) -> ThreadingHTTPServer:
+    """Local stand-in for GitHub raw and Wikipedia"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def rewrite(text: str, data_url: str, parquet: str) -> str:
+    """Point a question (or recorded program) at the local copies"""
+    return (text.replace(TIPS_URL, f"{data_url}/tips.csv")
+                .replace(FILMS_URL, f"{data_url}/wiki/List_of_highest-grossing_films.html")
+                .replace(COURT_PATH, parquet)
+                .replace("__DATA_URL__", data_url)
+                .replace("__PARQUET__", parquet))
+
+# --- process accounting (/proc, Linux) ---
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+def _stat_fields(pid: int):
+    with open(f"/proc/{pid}/stat") as fh:
+        return fh.read().rsplit(")", 1)[1].split()
+
+def process_tree(root: int) -> list:
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                children.setdefault(int(_stat_fields(int(entry))[1]), []).append(int(entry))
+            except (OSError, IndexError):
+                continue
+    pids, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+def tree_usage(root: int):
+    """(CPU seconds incl. reaped children, RSS MB) summed over a process tree"""
+    cpu, rss = 0.0, 0.0
+    for pid in process_tree(root):
+        try:
+            fields = _stat_fields(pid)
+            cpu += sum(int(f) for f in fields[11:15]) / _CLK_TCK
+            with open(f"/proc/{pid}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) / 1024
+        except (OSError, IndexError, ValueError):
+            continue
+    return cpu, rss
+
+class Sampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.25):
+        super().__init__(daemon=True)
+        self.pid, self.interval = pid, interval
+        self.peak_rss_mb = 0.0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak_rss_mb = max(self.peak_rss_mb, tree_usage(self.pid)[1])
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+# --- server + load ---
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(env: dict, port: int, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited during startup; see {log_path}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1).ok:
+                return proc
+        except requests.RequestException:
+            time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError(f"Server did not become ready; see {log_path}")
+
+def post(url: str, question: str) -> dict:
+    start = time.perf_counter()
+    try:
+        resp = requests.post(url, files={"file": ("question.txt", question.encode())}, timeout=300)
+        ok = resp.status_code == 200
+        if ok:
+            json.loads(resp.content)
+        status = resp.status_code
+    except (requests.RequestException, ValueError) as e:
+        ok, status = False, type(e).__name__
+    return {"seconds": time.perf_counter() - start, "ok": ok, "status": status}
+
+def percentile(values, q: float) -> float:
+    return float(np.percentile(values, q)) if values else float("nan")
+
+def run_load(url: str, questions: list, total: int, concurrency: int) -> tuple:
+    jobs = [(i % len(questions), questions[i % len(questions)]) for i in range(total)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda job: {**post(url, job[1]), "question": job[0]}, jobs))
+    return results, time.perf_counter() - start
+
+def summarize(results: list, wall: float, cpu_s: float, peak_rss_mb: float, args) -> dict:
+    ok = [r["seconds"] for r in results if r["ok"]]
+    report = {
+        "requests": len(results), "concurrency": args.concurrency, "llm_latency": args.llm_latency,
+        "fast_path": args.fast_path, "code_cache": args.code_cache,
+        "p50": round(percentile(ok, 50), 3), "p95": round(percentile(ok, 95), 3), "p99": round(percentile(ok, 99), 3),
+        "throughput_rps": round(len(ok) / wall, 3), "error_rate": round(1 - len(ok) / len(results), 4),
+        "cpu_seconds": round(cpu_s, 2), "cpu_utilization": round(cpu_s / wall, 2), "peak_rss_mb": round(peak_rss_mb, 1),
+        "wall_seconds": round(wall, 2),
+        "per_question_p50": {QUESTIONS[q]: round(percentile([r["seconds"] for r in results if r["ok"] and r["question"] == q], 50), 3)
+                             for q in range(len(QUESTIONS))},
+    }
+    errors = [r["status"] for r in results if not r["ok"]]
+    if errors:
+        report["errors"] = {str(s): errors.count(s) for s in set(errors)}
+    return report
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """Regressions beyond the threshold (latency up, throughput down, more errors)"""
+    problems = []
+    for key in ("p50", "p95", "p99"):
+        if report[key] > baseline[key] * (1 + threshold):
+            problems.append(f"{key} {report[key]:.3f}s vs baseline {baseline[key]:.3f}s")
+    if report["throughput_rps"] < baseline["throughput_rps"] * (1 - threshold):
+        problems.append(f"throughput {report['throughput_rps']:.3f} rps vs baseline {baseline['throughput_rps']:.3f} rps")
+    if report["error_rate"] > baseline["error_rate"] + 0.01:
+        problems.append(f"error rate {report['error_rate']:.2%} vs baseline {baseline['error_rate']:.2%}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=24)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds the Gemini stub takes per call")
+    parser.add_argument("--no-fast-path", dest="fast_path", action="store_false", help="disable template answers")
+    parser.add_argument("--no-code-cache", dest="code_cache", action="store_false", help="plan every request")
+    parser.add_argument("--pool-size", type=int, default=None)
+    parser.add_argument("--baseline", default=LOAD_BASELINE)
+    parser.add_argument("--record-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (fixtures, caches, server log)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="agent-load-")
+    fixtures = make_fixtures(work)
+    data_server = serve_directory(fixtures["www"])
+    data_url = f"http://127.0.0.1:{data_server.server_address[1]}"
+
+    recordings = []
+    for match, name in RECORDINGS:
+        with open(os.path.join(BENCH_DIR, "recordings", name), encoding="utf-8") as fh:
+            recordings.append({"match": match, "code": rewrite(fh.read(), data_url, fixtures["parquet"])})
+    stub_path = os.path.join(work, "recordings.json")
+    with open(stub_path, "w") as fh:
+        json.dump(recordings, fh)
+
+    questions = []
+    for name in QUESTIONS:
+        with open(os.path.join(APP_DIR, name), encoding="utf-8") as fh:
+            questions.append(rewrite(fh.read(), data_url, fixtures["parquet"]))
+
+    env = dict(os.environ,
+               AGENT_LLM_STUB=stub_path, AGENT_LLM_STUB_LATENCY=str(args.llm_latency),
+               AGENT_CACHE_DIR=os.path.join(work, "cache"),
+               AGENT_TEMPLATE_FAST_PATH="1" if args.fast_path else "0",
+               AGENT_CODE_CACHE="1" if args.code_cache else "0",
+               AGENT_RESPONSE_CACHE="0",  # the questions repeat; every request should reach a worker
+               AGENT_MAX_QUEUED_JOBS=str(max(32, args.requests)))
+    if args.pool_size:
+        env["AGENT_POOL_SIZE"] = str(args.pool_size)
+
+    port = free_port()
+    log_path = os.path.join(work, "server.log")
+    server = start_server(env, port, log_path)
+    url = f"http://127.0.0.1:{port}/api"
+    try:
+        # One untimed pass so worker start-up and first-use imports are not in the numbers
+        run_load(url, questions, len(questions), len(questions))
+        cpu_before, _ = tree_usage(server.pid)
+        sampler = Sampler(server.pid)
+        sampler.start()
+        results, wall = run_load(url, questions, args.requests, args.concurrency)
+        sampler.stop()
+        cpu_after, _ = tree_usage(server.pid)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        data_server.shutdown()
+
+    report = summarize(results, wall, cpu_after - cpu_before, sampler.peak_rss_mb, args)
+    status = 0
+    if args.record_baseline:
+        with open(args.baseline, "w") as fh:
+            json.dump(report, fh, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            problems = compare(report, json.load(fh), args.threshold)
+        report["regressions"] = problems
+        status = 1 if problems else 0
+    print(json.dumps(report, indent=2))
+    if args.keep:
+        print(f"work directory: {work}", file=sys.stderr)
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Offline check of the speculative prefetch: end-to-end latency of the tips and films questions with
+AGENT_PREFETCH on and off, behind a data server that takes --download-delay per response, and whether
+the sniffed columns reached the prompt (recorded-code Gemini stub)
+
+Usage: python bench/prefetch_test.py [--rounds 5] [--llm-latency 0.5] [--download-delay 0.5] [--deadline 1.5]
+Exits 1 if an answer differs between the two modes, or a prefetched prompt lacks the sniffed columns
+although the sniff fits the deadline.
+"""
+import os, sys, json, time, shutil, sqlite3, argparse, tempfile, threading, subprocess, functools
+from http.server import ThreadingHTTPServer
+import requests
+
+from load_test import APP_DIR, BENCH_DIR, _QuietHandler, make_fixtures, rewrite, start_server, free_port
+
+# Sniffed columns as the prompt lists them; the stub answers these prompts with a marker appended
+SCHEMA_MARKS = {"tips": "total_bill DOUBLE", "films": "'Rank', 'Peak'"}
+SNIFFED = "_sniffed = True\n"
+
+def serve_slowly(directory: str, delay: float) -> ThreadingHTTPServer:
+    """The local data server, with a fixed delay before each response (a remote origin)"""
+    class Handler(_QuietHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            super().do_GET()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(Handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def forget_downloads(cache_dir: str):
+    """Empty the server's HTTP cache index, so each round downloads its data as if first seen"""
+    path = os.path.join(cache_dir, "http", "index.sqlite")
+    if os.path.exists(path):
+        with sqlite3.connect(path, timeout=30) as db:
+            db.execute("DELETE FROM responses")
+
+def ask(base: str, question: str) -> tuple:
+    start = time.perf_counter()
+    resp = requests.post(f"{base}/api", params={"profile": "1"}, files={"file": ("question.txt", question.encode())},
+                         timeout=300)
+    resp.raise_for_status()
+    return time.perf_counter() - start, resp.json()
+
+def run_mode(env: dict, work: str, questions: dict, rounds: int, mode: str) -> dict:
+    cache_dir = env["AGENT_CACHE_DIR"]
+    port = free_port()
+    server = start_server(dict(env, AGENT_PREFETCH=mode), port, os.path.join(work, f"server-{mode}.log"))
+    base = f"http://127.0.0.1:{port}"
+    out = {name: {"seconds": [], "answers": [], "sniffed": 0, "stages": []} for name in questions}
+    try:
+        for name, question in questions.items():
+            for _ in range(rounds):
+                forget_downloads(cache_dir)
+                seconds, body = ask(base, question)
+                entry = out[name]
+                entry["seconds"].append(seconds)
+                entry["answers"].append(json.dumps(body["result"], sort_keys=True))
+                statements = [s["source"] for e in body["debug"]["executions"] for s in e.get("statements", ())]
+                entry["sniffed"] += int(SNIFFED.strip() in statements)
+                entry["stages"].append(body["debug"]["stages"])
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds the Gemini stub takes per call")
+    parser.add_argument("--download-delay", type=float, default=0.5, help="seconds the data server waits per response")
+    parser.add_argument("--deadline", type=float, default=1.5,
+                        help="AGENT_PREFETCH_SCHEMA_DEADLINE: how long planning waits for the sniff")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (server logs)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="agent-prefetch-")
+    fixtures = make_fixtures(work)
+    data_server = serve_slowly(fixtures["www"], args.download_delay)
+    data_url = f"http://127.0.0.1:{data_server.server_address[1]}"
+    questions, recordings = {}, []
+    for name, number in (("tips", 1), ("films", 2)):
+        with open(os.path.join(APP_DIR, f"test_question_{number}.txt"), encoding="utf-8") as fh:
+            questions[name] = rewrite(fh.read(), data_url, fixtures["parquet"])
+        with open(os.path.join(BENCH_DIR, "recordings", f"{name}.py"), encoding="utf-8") as fh:
+            program = rewrite(fh.read(), data_url, fixtures["parquet"])
+        # The marker statement only runs (and shows in the profile) when the prompt had the sniffed columns
+        recordings.append({"match": SCHEMA_MARKS[name], "code": SNIFFED + program})
+        recordings.append({"match": "tips.csv" if name == "tips" else "highest-grossing", "code": program})
+    stub_path = os.path.join(work, "recordings.json")
+    with open(stub_path, "w") as fh:
+        json.dump(recordings, fh)
+
+    # Every run plans and executes: no templates, code/response caches or memo
+    env = dict(os.environ, AGENT_LLM_STUB=stub_path, AGENT_LLM_STUB_LATENCY=str(args.llm_latency),
+               AGENT_TEMPLATE_FAST_PATH="0", AGENT_CODE_CACHE="0", AGENT_RESPONSE_CACHE="0", AGENT_CELL_MEMO="0",
+               AGENT_PREFETCH_SCHEMA_DEADLINE=str(args.deadline))
+    results, problems = {}, []
+    try:
+        for mode in ("0", "1"):
+            results[mode] = run_mode(dict(env, AGENT_CACHE_DIR=os.path.join(work, f"cache-{mode}")), work,
+                                     questions, args.rounds, mode)
+    finally:
+        data_server.shutdown()
+
+    def median(values):
+        values = sorted(values)
+        return round(values[len(values) // 2], 3) if values else None
+
+    report = {"rounds": args.rounds, "llm_latency": args.llm_latency, "download_delay": args.download_delay,
+              "deadline": args.deadline}
+    for name in questions:
+        off, on = results["0"][name], results["1"][name]
+        if set(off["answers"]) != set(on["answers"]) or len(set(on["answers"])) != 1:
+            problems.append(f"{name}: answers differ with prefetch on")
+        if on["sniffed"] < args.rounds and args.deadline > 2 * args.download_delay:
+            problems.append(f"{name}: sniffed schema missing from {args.rounds - on['sniffed']} prompts")
+        report[name] = {"off_seconds": median(off["seconds"]), "on_seconds": median(on["seconds"]),
+                        "sniffed_prompts": on["sniffed"]}
+        for mode, runs in (("off", off), ("on", on)):
+            stages = sorted({stage for run in runs["stages"] for stage in run})
+            report[name][f"{mode}_stage_ms"] = {stage: median([run.get(stage, 0.0) for run in runs["stages"]])
+                                                for stage in stages}
+    report["problems"] = problems
+    print(json.dumps(report, indent=2))
+    if args.keep:
+        print(f"work directory: {work}", file=sys.stderr)
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
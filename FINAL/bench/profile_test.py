@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Offline check of /api?profile=: the debug block (CPU, peak RSS, allocation sites, bytes per URL,
+statement timings), the slowest-statements report, the stack-sample dump and the profiling overhead
+on the tips question (recorded-code Gemini stub)
+
+Usage: python bench/profile_test.py [--rounds 5] [--llm-latency 0.1]
+Exits 1 if a profiled answer differs from the plain one or the debug block misses a section.
+"""
+import os, sys, json, time, shutil, argparse, tempfile, subprocess
+import requests
+
+from load_test import APP_DIR, BENCH_DIR, make_fixtures, serve_directory, rewrite, start_server, free_port
+
+def ask(base: str, question: str, profile: str = None) -> tuple:
+    start = time.perf_counter()
+    resp = requests.post(f"{base}/api", params={"profile": profile} if profile else None,
+                         files={"file": ("question.txt", question.encode())}, timeout=300)
+    resp.raise_for_status()
+    return time.perf_counter() - start, resp.json()
+
+def check(debug: dict, data_url: str) -> list:
+    """What the debug block of one profiled tips run is missing"""
+    problems = []
+    executions = debug.get("executions") or []
+    if not executions:
+        return ["no execution profile"]
+    profile = executions[-1]
+    for field in ("cpu_seconds", "peak_rss_mb", "peak_rss_delta_mb", "python_peak_mb"):
+        if not isinstance(profile.get(field), (int, float)):
+            problems.append(f"missing {field}")
+    if not profile.get("allocations"):
+        problems.append("no allocation sites")
+    if not any(n["url"].startswith(data_url) and n["bytes"] > 0 for n in profile.get("network", [])):
+        problems.append("tips.csv download not attributed")
+    if not any("read_csv" in s["source"] for s in profile.get("statements", [])):
+        problems.append("read_csv statement not timed")
+    if "plan" not in debug.get("stages", {}):
+        problems.append("no planning stage total")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.1, help="seconds the Gemini stub takes per call")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (server log, sample dumps)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="agent-profile-")
+    fixtures = make_fixtures(work)
+    data_server = serve_directory(fixtures["www"])
+    data_url = f"http://127.0.0.1:{data_server.server_address[1]}"
+    with open(os.path.join(APP_DIR, "test_question_1.txt"), encoding="utf-8") as fh:
+        question = rewrite(fh.read(), data_url, fixtures["parquet"])
+    with open(os.path.join(BENCH_DIR, "recordings", "tips.py"), encoding="utf-8") as fh:
+        program = rewrite(fh.read(), data_url, fixtures["parquet"])
+    stub_path = os.path.join(work, "recordings.json")
+    with open(stub_path, "w") as fh:
+        json.dump([{"match": "tips.csv", "code": program}], fh)
+
+    # No memo or caches, so every run executes (and profiles) the whole program
+    env = dict(os.environ, AGENT_LLM_STUB=stub_path, AGENT_LLM_STUB_LATENCY=str(args.llm_latency),
+               AGENT_CACHE_DIR=os.path.join(work, "cache"), AGENT_TEMPLATE_FAST_PATH="0", AGENT_CODE_CACHE="0",
+               AGENT_RESPONSE_CACHE="0", AGENT_CELL_MEMO="0")
+    port = free_port()
+    server = start_server(env, port, os.path.join(work, "server.log"))
+    base = f"http://127.0.0.1:{port}"
+    plain, basic, problems, debug, sample, report, seconds = [], [], [], {}, {}, [], None
+    try:
+        ask(base, question)  # warm-up
+        for _ in range(args.rounds):
+            seconds, expected = ask(base, question)
+            plain.append(seconds)
+            seconds, body = ask(base, question, "1")
+            basic.append(seconds)
+            debug = body["debug"]
+            if body["result"] != expected:
+                problems.append("profiled answer differs from the plain one")
+            problems.extend(check(debug, data_url))
+        seconds, body = ask(base, question, "sample")
+        sample = body["debug"]["executions"][-1].get("sample", {})
+        dump = requests.get(f"{base}/api/profile/samples/{sample.get('file')}", timeout=30)
+        if dump.status_code != 200 or not dump.text.strip():
+            problems.append("stack-sample dump not served")
+        report = requests.get(f"{base}/api/profile", params={"limit": 5}, timeout=30).json()["statements"]
+        if not report or report[0]["runs"] < args.rounds:
+            problems.append("slowest-statements report not aggregated")
+        for by, status in (("alloc_kb", 200), ("source", 400)):
+            if requests.get(f"{base}/api/profile", params={"by": by}, timeout=30).status_code != status:
+                problems.append(f"/api/profile?by={by} did not answer {status}")
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        data_server.shutdown()
+
+    def median(values):
+        values = sorted(values)
+        return round(values[len(values) // 2], 3) if values else None
+
+    execution = (debug.get("executions") or [{}])[-1]
+    print(json.dumps({
+        "rounds": args.rounds, "plain_seconds": median(plain), "profiled_seconds": median(basic),
+        "sample_seconds": seconds and round(seconds, 3), "samples": sample.get("samples"),
+        "last_profile": {k: execution.get(k) for k in ("cpu_seconds", "peak_rss_delta_mb", "python_peak_mb", "network")},
+        "slowest_statements": report,
+        "problems": sorted(set(problems)),
+    }, indent=2))
+    if args.keep:
+        print(f"work directory: {work}", file=sys.stderr)
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Offline check of the shared Gemini rate limiter: a burst of tips questions against a local fake quota
+endpoint that answers 429 + Retry-After once a sliding-window request quota is spent, with the
+limiter on and off (recorded-code Gemini stub)
+
+Usage: python bench/rate_limit_test.py [--requests 24] [--quota 6] [--window 6]
+Exits 1 if, with the limiter on, any request fails or needs the template fallback.
+"""
+import os, re, sys, json, time, shutil, argparse, tempfile, threading, subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+from load_test import APP_DIR, BENCH_DIR, make_fixtures, serve_directory, rewrite, start_server, free_port, post
+
+class QuotaServer(ThreadingHTTPServer):
+    """At most `quota` admitted calls per `window` seconds (sliding); refusals carry Retry-After"""
+
+    def __init__(self, quota: int, window: float):
+        super().__init__(("127.0.0.1", 0), _QuotaHandler)
+        self.quota = quota
+        self.window = window
+        self.admitted = deque()
+        self.accepted = self.refused = 0
+        self.lock = threading.Lock()
+
+    def admit(self):
+        with self.lock:
+            now = time.time()
+            while self.admitted and now - self.admitted[0] >= self.window:
+                self.admitted.popleft()
+            if len(self.admitted) < self.quota:
+                self.admitted.append(now)
+                self.accepted += 1
+                return None
+            self.refused += 1
+            return self.window - (now - self.admitted[0])
+
+class _QuotaHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        retry_after = self.server.admit()
+        self.send_response(200 if retry_after is None else 429)
+        if retry_after is not None:
+            self.send_header("Retry-After", f"{retry_after:.2f}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def run(label: str, env: dict, question: str, n: int, work: str, quota: QuotaServer) -> dict:
+    quota.accepted = quota.refused = 0
+    quota.admitted.clear()
+    port = free_port()
+    server = start_server(env, port, os.path.join(work, f"server-{label}.log"))
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(n) as pool:
+            results = list(pool.map(lambda _: post(f"http://127.0.0.1:{port}/api", question), range(n)))
+        wall = time.perf_counter() - start
+        text = requests.get(f"http://127.0.0.1:{port}/metrics", timeout=10).text
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    waits = [line for line in text.splitlines() if line.startswith('agent_stage_seconds_sum{stage="llm_wait"}')]
+    # "fallback" answers came from a template after every Gemini attempt failed
+    outcomes = {k: int(float(v)) for k, v in re.findall(r'^agent_requests_total\{outcome="(\w+)"\} (\S+)$', text, re.MULTILINE)}
+    return {"succeeded": sum(r["ok"] for r in results), "failed": sum(not r["ok"] for r in results), "outcomes": outcomes,
+            "endpoint_429s": quota.refused, "endpoint_accepted": quota.accepted, "wall_seconds": round(wall, 2),
+            "llm_wait_seconds": round(float(waits[0].split()[-1]), 2) if waits else 0.0}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=24, help="questions sent at once")
+    parser.add_argument("--quota", type=int, default=6, help="calls the fake endpoint admits per window")
+    parser.add_argument("--window", type=float, default=6.0, help="seconds of the fake endpoint's sliding window")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (server logs)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="agent-ratelimit-")
+    fixtures = make_fixtures(work)
+    data_server = serve_directory(fixtures["www"])
+    data_url = f"http://127.0.0.1:{data_server.server_address[1]}"
+    with open(os.path.join(APP_DIR, "test_question_1.txt"), encoding="utf-8") as fh:
+        question = rewrite(fh.read(), data_url, fixtures["parquet"])
+    with open(os.path.join(BENCH_DIR, "recordings", "tips.py"), encoding="utf-8") as fh:
+        program = rewrite(fh.read(), data_url, fixtures["parquet"])
+    stub_path = os.path.join(work, "recordings.json")
+    with open(stub_path, "w") as fh:
+        json.dump([{"match": "tips.csv", "code": program}], fh)
+
+    quota = QuotaServer(args.quota, args.window)
+    threading.Thread(target=quota.serve_forever, daemon=True).start()
+    base = dict(os.environ, AGENT_LLM_STUB=stub_path, AGENT_LLM_STUB_LATENCY="0.2",
+                AGENT_LLM_STUB_ENDPOINT=f"http://127.0.0.1:{quota.server_address[1]}/generate",
+                AGENT_TEMPLATE_FAST_PATH="0", AGENT_CODE_CACHE="0", AGENT_RESPONSE_CACHE="0", AGENT_CACHE_DIR=os.path.join(work, "cache"),
+                AGENT_MAX_QUEUED_JOBS=str(max(32, args.requests)), AGENT_TASK_TIMEOUT="600")
+    rpm = args.quota * 60 / args.window
+    try:
+        report = {
+            "requests": args.requests, "quota": f"{args.quota} per {args.window:g}s",
+            "limiter_off": run("off", dict(base, AGENT_LLM_RATE_LIMIT="0"), question, args.requests, work, quota),
+            "limiter_on": run("on", dict(base, AGENT_LLM_RATE_LIMIT="1", AGENT_LLM_RPM=str(rpm), AGENT_LLM_BURST="1"),
+                              question, args.requests, work, quota),
+        }
+    finally:
+        quota.shutdown()
+        data_server.shutdown()
+    print(json.dumps(report, indent=2))
+    if args.keep:
+        print(f"work directory: {work}", file=sys.stderr)
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    on = report["limiter_on"]
+    sys.exit(1 if on["failed"] or on["outcomes"].get("fallback") else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+source = "read_parquet('__PARQUET__', hive_partitioning = true)"
+
+top_court = db.sql(f"""
+    SELECT court, COUNT(*) AS cases FROM {source}
+    WHERE year BETWEEN 2019 AND 2022
+    GROUP BY court ORDER BY cases DESC LIMIT 1
+""").fetchone()[0]
+
+delays = db.sql(f"""
+    SELECT year, AVG(date_diff('day', CAST(date_of_registration AS DATE), CAST(decision_date AS DATE))) AS delay
+    FROM {source}
+    WHERE court = '33_10'
+    GROUP BY year ORDER BY year
+""").df()
+slope, intercept, r_value, p_value, std_err = stats.linregress(delays["year"], delays["delay"])
+
+image_uri = scatter_with_regression(delays["year"], delays["delay"], xlabel="Year", ylabel="Average delay (days)",
+                                    line="r-", mime="image/webp")
+
+result = {
+    "Which high court disposed the most cases from 2019 - 2022?": str(top_court),
+    "What's the regression slope of the date_of_registration - decision_date by year in the court=33_10?": str(round(slope, 6)),
+    "Plot the year and # of days of delay from the above question as a scatterplot with a regression line. Encode as a base64 data URI under 100,000 characters": image_uri,
+}
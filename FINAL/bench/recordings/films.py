@@ -0,0 +1,12 @@
+df = read_wiki_table("__DATA_URL__/wiki/List_of_highest-grossing_films.html", match="grossing",
+                     columns=["Rank", "Peak", "Title", "Worldwide gross", "Year"])
+df["gross"] = df["Worldwide gross"]
+
+before_2000 = int(((df["gross"] >= 2e9) & (df["Year"] < 2000)).sum())
+earliest = df[df["gross"] > 1.5e9].sort_values("Year").iloc[0]["Title"]
+ranks = df[["Rank", "Peak"]].dropna().astype(float)
+correlation = ranks["Rank"].corr(ranks["Peak"])
+
+image_uri = scatter_with_regression(ranks["Rank"], ranks["Peak"], xlabel="Rank", ylabel="Peak", line="r:")
+
+result = [str(before_2000), str(earliest), str(round(correlation, 6)), image_uri]
@@ -0,0 +1,12 @@
+df = pd.read_csv("__DATA_URL__/tips.csv")
+
+dinner_over_30 = int(((df["time"] == "Dinner") & (df["total_bill"] > 30)).sum())
+emit(0, dinner_over_30)
+best_day = df.groupby("day")["tip"].mean().idxmax()
+emit(1, str(best_day))
+correlation = round(df["total_bill"].corr(df["tip"]), 3)
+emit(3, correlation)
+
+image_uri = scatter_with_regression(df["total_bill"], df["tip"], xlabel="total_bill", ylabel="tip", line="r:")
+
+result = [dinner_over_30, str(best_day), image_uri, correlation]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Offline check of the /api response cache: a burst of identical tips questions (one run, the rest
+attached to it), the same question again (cache hits), a forced refresh, and a forced refresh sent
+while an identical run is in flight (recorded-code Gemini stub)
+
+Usage: python bench/response_cache_test.py [--requests 12] [--llm-latency 0.5]
+Exits 1 if a request fails, the burst and repeats start more than one run each, or a forced refresh
+joins the run in flight instead of starting its own.
+"""
+import os, re, sys, json, time, shutil, argparse, tempfile, subprocess
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+from load_test import APP_DIR, BENCH_DIR, make_fixtures, serve_directory, rewrite, start_server, free_port
+
+def post(url: str, question: str, headers=None) -> dict:
+    start = time.perf_counter()
+    resp = requests.post(url, files={"file": ("question.txt", question.encode())}, headers=headers, timeout=300)
+    return {"seconds": time.perf_counter() - start, "ok": resp.status_code == 200,
+            "cache": resp.headers.get("X-Response-Cache"), "body": resp.content}
+
+def counters(base: str) -> dict:
+    text = requests.get(f"{base}/metrics", timeout=10).text
+    found = dict(re.findall(r'^agent_response_cache_total\{result="(\w+)"\} (\S+)$', text, re.MULTILINE))
+    found["runs"] = sum(float(v) for v in re.findall(r'^agent_requests_total\{outcome="\w+"\} (\S+)$', text, re.MULTILINE))
+    return {k: int(float(v)) for k, v in found.items()}
+
+def phase(base: str, question: str, n: int, concurrent: bool, headers=None) -> dict:
+    before = counters(base)
+    start = time.perf_counter()
+    if concurrent:
+        with ThreadPoolExecutor(n) as pool:
+            results = list(pool.map(lambda _: post(f"{base}/api", question, headers), range(n)))
+    else:
+        results = [post(f"{base}/api", question, headers) for _ in range(n)]
+    wall = time.perf_counter() - start
+    after = counters(base)
+    return {"requests": n, "failed": sum(not r["ok"] for r in results), "wall_seconds": round(wall, 3),
+            "max_seconds": round(max(r["seconds"] for r in results), 3),
+            "runs": after["runs"] - before.get("runs", 0),
+            **{k: after.get(k, 0) - before.get(k, 0) for k in ("miss", "hit", "coalesced")},
+            "identical_bodies": len({r["body"] for r in results}) == 1}
+
+def refresh_during_run(base: str, question: str, delay: float) -> dict:
+    """A plain request, then a no-cache one `delay` seconds later while the first is still running"""
+    requests.delete(f"{base}/api/cache", timeout=10)
+    before = counters(base)
+    with ThreadPoolExecutor(2) as pool:
+        plain = pool.submit(post, f"{base}/api", question)
+        time.sleep(delay)
+        forced = pool.submit(post, f"{base}/api", question, {"Cache-Control": "no-cache"})
+        results = [plain.result(), forced.result()]
+    after = counters(base)
+    return {"requests": 2, "failed": sum(not r["ok"] for r in results),
+            "runs": after["runs"] - before.get("runs", 0),
+            **{k: after.get(k, 0) - before.get(k, 0) for k in ("miss", "hit", "coalesced")},
+            "forced_cache": results[1]["cache"]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=12, help="identical questions per phase")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds the Gemini stub takes per call")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (server log)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="agent-responses-")
+    fixtures = make_fixtures(work)
+    data_server = serve_directory(fixtures["www"])
+    data_url = f"http://127.0.0.1:{data_server.server_address[1]}"
+    with open(os.path.join(APP_DIR, "test_question_1.txt"), encoding="utf-8") as fh:
+        question = rewrite(fh.read(), data_url, fixtures["parquet"])
+    with open(os.path.join(BENCH_DIR, "recordings", "tips.py"), encoding="utf-8") as fh:
+        program = rewrite(fh.read(), data_url, fixtures["parquet"])
+    stub_path = os.path.join(work, "recordings.json")
+    with open(stub_path, "w") as fh:
+        json.dump([{"match": "tips.csv", "code": program}], fh)
+
+    env = dict(os.environ, AGENT_LLM_STUB=stub_path, AGENT_LLM_STUB_LATENCY=str(args.llm_latency),
+               AGENT_CACHE_DIR=os.path.join(work, "cache"), AGENT_TEMPLATE_FAST_PATH="0", AGENT_CODE_CACHE="0",
+               AGENT_RESPONSE_CACHE="1", AGENT_MAX_QUEUED_JOBS=str(max(32, args.requests)))
+    port = free_port()
+    server = start_server(env, port, os.path.join(work, "server.log"))
+    base = f"http://127.0.0.1:{port}"
+    try:
+        report = {
+            "burst": phase(base, question, args.requests, concurrent=True),
+            "repeat": phase(base, question, args.requests, concurrent=False),
+            "refresh": phase(base, question, 1, concurrent=False, headers={"Cache-Control": "no-cache"}),
+            "refresh_during_run": refresh_during_run(base, question, args.llm_latency / 2),
+        }
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        data_server.shutdown()
+    print(json.dumps(report, indent=2))
+    if args.keep:
+        print(f"work directory: {work}", file=sys.stderr)
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    failed = any(p["failed"] for p in report.values())
+    overlap = report["refresh_during_run"]
+    sys.exit(1 if failed or report["burst"]["runs"] != 1 or report["repeat"]["runs"] or report["refresh"]["runs"] != 1
+             or overlap["runs"] != 2 or overlap["coalesced"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Offline check of model routing against a stub with a fast and a strong model: the tips question
+(simple, solved by the fast model), the films question (scraping, strong model) and a simple count
+the fast model gets wrong (escalated until the routing history sends it to the strong model directly);
+latency with routing on and off, and the decision log summarised per question signature. With the code
+cache on, replays of the fast model's programs must be logged against the fast tier
+
+Usage: python bench/routing_test.py [--rounds 8] [--fast-latency 0.2] [--strong-latency 0.8] [--min-samples 3]
+Exits 1 on a failed answer, or if routing decisions do not follow the policy.
+"""
+import os, sys, json, time, shutil, argparse, tempfile, subprocess
+import requests
+
+from load_test import APP_DIR, BENCH_DIR, make_fixtures, serve_directory, rewrite, start_server, free_port
+
+sys.path.insert(0, APP_DIR)
+import routing
+from task_patterns import detect_task_patterns
+
+COUNT_QUESTION = """Fetch the tips dataset (CSV) from __DATA_URL__/tips.csv
+
+How many bills had a tip above 5 dollars? Return a JSON array with one number."""
+COUNT_PROGRAM = """df = pd.read_csv("__DATA_URL__/tips.csv")
+result = [int((df["tip"] > 5).sum())]
+"""
+COUNT_WRONG = """df = pd.read_csv("__DATA_URL__/tips.csv")
+result = [int((df["tips"] > 5).sum())]
+"""
+
+def ask(base: str, question: str) -> tuple:
+    start = time.perf_counter()
+    resp = requests.post(f"{base}/api", files={"file": ("question.txt", question.encode())}, timeout=300)
+    return time.perf_counter() - start, resp.json() if resp.status_code == 200 else None
+
+def run_mode(env: dict, work: str, questions: dict, rounds: int, mode: str, code_cache: bool = False) -> dict:
+    name = f"{mode}-cached" if code_cache else mode
+    log = os.path.join(work, f"routing-{name}.jsonl")
+    env = dict(env, AGENT_ROUTING=mode, AGENT_ROUTING_LOG=log, AGENT_CACHE_DIR=os.path.join(work, f"cache-{name}"),
+               AGENT_CODE_CACHE="1" if code_cache else "0")
+    port = free_port()
+    server = start_server(env, port, os.path.join(work, f"server-{name}.log"))
+    base = f"http://127.0.0.1:{port}"
+    out = {name: {"seconds": [], "failed": 0} for name in questions}
+    try:
+        for _ in range(rounds):
+            for name, question in questions.items():
+                seconds, body = ask(base, question)
+                out[name]["seconds"].append(seconds)
+                out[name]["failed"] += int(body is None)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    with open(log, encoding="utf-8") as fh:
+        decisions = [json.loads(line) for line in fh if line.strip()]
+    return {"questions": out, "decisions": decisions, "summary": routing.summary(log)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=8)
+    parser.add_argument("--fast-latency", type=float, default=0.2, help="seconds the fast stub model takes per call")
+    parser.add_argument("--strong-latency", type=float, default=0.8, help="seconds the strong stub model takes per call")
+    parser.add_argument("--min-samples", type=int, default=3, help="AGENT_ROUTING_MIN_SAMPLES")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (server logs, decision logs)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="agent-routing-")
+    fixtures = make_fixtures(work)
+    data_server = serve_directory(fixtures["www"])
+    data_url = f"http://127.0.0.1:{data_server.server_address[1]}"
+    questions, programs = {}, {}
+    for name, number in (("tips", 1), ("films", 2)):
+        with open(os.path.join(APP_DIR, f"test_question_{number}.txt"), encoding="utf-8") as fh:
+            questions[name] = rewrite(fh.read(), data_url, fixtures["parquet"])
+        with open(os.path.join(BENCH_DIR, "recordings", f"{name}.py"), encoding="utf-8") as fh:
+            programs[name] = rewrite(fh.read(), data_url, fixtures["parquet"])
+    questions["count"] = rewrite(COUNT_QUESTION, data_url, "")
+    fast, strong = args.fast_latency, args.strong_latency
+    recordings = [
+        # The fast model misnames the column; the strong model (also on correction prompts) gets it right
+        {"match": "tip above 5", "model": "lite", "code": rewrite(COUNT_WRONG, data_url, ""), "latency": fast},
+        {"match": "tip above 5", "code": rewrite(COUNT_PROGRAM, data_url, ""), "latency": strong},
+        {"match": "tips.csv", "model": "lite", "code": programs["tips"], "latency": fast},
+        {"match": "tips.csv", "code": programs["tips"], "latency": strong},
+        {"match": "highest-grossing", "code": programs["films"], "latency": strong},
+    ]
+    stub_path = os.path.join(work, "recordings.json")
+    with open(stub_path, "w") as fh:
+        json.dump(recordings, fh)
+
+    # Every run plans and executes (the code cache only where noted): no templates, response cache or memo
+    env = dict(os.environ, AGENT_LLM_STUB=stub_path, AGENT_TEMPLATE_FAST_PATH="0",
+               AGENT_RESPONSE_CACHE="0", AGENT_CELL_MEMO="0", AGENT_FAST_MODEL="models/gemini-2.5-flash-lite",
+               AGENT_ROUTING_MIN_SAMPLES=str(args.min_samples), AGENT_ROUTING_EXPLORE="0")
+    results = {}
+    try:
+        for mode in ("0", "1"):
+            results[mode] = run_mode(env, work, questions, args.rounds, mode)
+        cached = run_mode(env, work, {"tips": questions["tips"]}, 2, "1", code_cache=True)
+    finally:
+        data_server.shutdown()
+
+    def median(values):
+        values = sorted(values)
+        return round(values[len(values) // 2], 3) if values else None
+
+    problems = []
+    on = results["1"]
+    by_signature = {}
+    for d in on["decisions"]:
+        by_signature.setdefault(d["signature"], []).append(d)
+    tiers = {name: [] for name in questions}
+    for name, question in questions.items():
+        sig = routing.signature(detect_task_patterns(question))
+        tiers[name] = [d["tier"] for d in by_signature.get(sig, [])]
+        for mode in ("0", "1"):
+            if results[mode]["questions"][name]["failed"]:
+                problems.append(f"{name}: {results[mode]['questions'][name]['failed']} failed answers (routing={mode})")
+    if set(tiers["tips"]) != {"fast"}:
+        problems.append("tips not routed to the fast model")
+    if set(tiers["films"]) != {"strong"}:
+        problems.append("films not routed to the strong model")
+    expected = ["fast"] * args.min_samples + ["strong"] * (args.rounds - args.min_samples)
+    if tiers["count"] != expected:
+        problems.append(f"count routing {tiers['count']}, expected {expected}")
+
+    replays = [d for d in cached["decisions"] if d["reason"] == "code_cache"]
+    if len(cached["decisions"]) != 2 or not replays or replays[0]["tier"] != "fast" \
+            or not replays[0]["attempts"][0].get("cached"):
+        problems.append("code-cache replay of the fast model's program not logged against the fast tier")
+
+    report = {"rounds": args.rounds, "fast_latency": args.fast_latency, "strong_latency": args.strong_latency,
+              "min_samples": args.min_samples}
+    for name in questions:
+        report[name] = {"off_seconds": median(results["0"]["questions"][name]["seconds"]),
+                        "on_seconds": median(results["1"]["questions"][name]["seconds"]),
+                        "tiers": tiers[name]}
+    report["summary"] = on["summary"]
+    report["problems"] = problems
+    print(json.dumps(report, indent=2))
+    if args.keep:
+        print(f"work directory: {work}", file=sys.stderr)
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
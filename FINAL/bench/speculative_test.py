@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Offline check of speculative planning (execute_with_retry with K candidates) against a stub that
+answers each candidate variant differently: the no-hint candidate only writes prose (plan_error),
+one program fails when run (exec_error), a slow one wins and the slowest is cancelled. A question
+every candidate fails checks the AGENT_SPECULATIVE_MAX_CANDIDATES cap on the retry
+
+Usage: python bench/speculative_test.py [--winner-latency 1.0] [--straggler-latency 6.0] [--cap 6]
+Exits 1 if the winner, the cancellations, the cap or the JSONL log rows are not as expected.
+"""
+import os, sys, json, time, shutil, asyncio, argparse, tempfile
+
+from load_test import APP_DIR
+
+K = 4
+RACED = "Question SPECULATE-RACE: what is the answer? Return a JSON array with one number."
+FAILING = "Question SPECULATE-FAIL: what is the answer? Return a JSON array with one number."
+WINNING_CODE = "result = [42]\n"
+FAILING_CODE = "result = [undefined_name]\n"
+PROSE = "I am sorry, but I need more information before I can answer this question."
+
+def recordings(variants: list, winner_latency: float, straggler_latency: float) -> list:
+    """Stub replies keyed on each variant's approach hint (candidate 0 has none)"""
+    hints = [hint for _, hint in variants[1:K]]
+    return [
+        {"match": "SPECULATE-FAIL", "code": FAILING_CODE},
+        {"match": hints[0], "code": FAILING_CODE},
+        {"match": hints[1], "code": WINNING_CODE, "latency": winner_latency},
+        {"match": hints[2], "code": WINNING_CODE, "latency": straggler_latency},
+        {"match": "SPECULATE-RACE", "code": PROSE},
+    ]
+
+def log_rows(path: str) -> list:
+    with open(path, encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+async def run(agent) -> dict:
+    out = {}
+    for name, question in (("raced", RACED), ("failing", FAILING)):
+        start = time.perf_counter()
+        out[name] = await agent.execute_with_retry(question, max_attempts=2, speculative_k=K)
+        out[name]["seconds"] = round(time.perf_counter() - start, 3)
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--winner-latency", type=float, default=1.0, help="seconds the winning candidate's reply takes")
+    parser.add_argument("--straggler-latency", type=float, default=6.0, help="seconds the cancelled candidate's reply takes")
+    parser.add_argument("--cap", type=int, default=6, help="AGENT_SPECULATIVE_MAX_CANDIDATES (between K and 2K)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="agent-speculative-")
+    log = os.path.join(work, "speculative.jsonl")
+    stub_path = os.path.join(work, "recordings.json")
+    # Read before the agent is imported: its settings come from the environment
+    os.environ.update(AGENT_CACHE_DIR=os.path.join(work, "cache"), AGENT_SPECULATIVE_LOG=log,
+                      AGENT_SPECULATIVE_MAX_CANDIDATES=str(args.cap), AGENT_LLM_STUB=stub_path,
+                      AGENT_CODE_CACHE="0", AGENT_ROUTING="0")
+    sys.path.insert(0, APP_DIR)
+    import data_analyst_agent as agent
+
+    with open(stub_path, "w") as fh:
+        json.dump(recordings(agent.CANDIDATE_VARIANTS, args.winner_latency, args.straggler_latency), fh)
+    # Executors start up front, so the failing candidate's run ends well before the winner's reply
+    agent.warm_up()
+    try:
+        results = asyncio.run(run(agent))
+        rows = log_rows(log)
+    finally:
+        agent.get_sandbox().close()
+
+    problems = []
+    raced, failing = results["raced"], results["failing"]
+    if not raced.get("success") or raced.get("candidate") != 2 or getattr(raced["result"], "value", raced["result"]) != [42]:
+        problems.append(f"raced: expected candidate 2 to win with [42], got {raced}")
+    if raced["seconds"] >= args.straggler_latency:
+        problems.append(f"raced: took {raced['seconds']}s, so the straggler was waited for")
+    if failing.get("success"):
+        problems.append("failing: a candidate passed")
+
+    outcomes = [{c["candidate"]: c["outcome"] for c in row["candidates"]} for row in rows]
+    expected = [
+        {0: "plan_error", 1: "exec_error", 2: "won", 3: "cancelled"},    # raced
+        {i: "exec_error" for i in range(K)},                              # failing, attempt 1
+        {i: "exec_error" for i in range(args.cap - K)},                   # failing, retry within the cap
+    ]
+    if outcomes != expected:
+        problems.append(f"log rows {outcomes}, expected {expected}")
+    if [row["attempt"] for row in rows] != [1, 1, 2]:
+        problems.append(f"log attempts {[row['attempt'] for row in rows]}, expected [1, 1, 2]")
+    if sum(len(row["candidates"]) for row in rows[1:]) != args.cap:
+        problems.append(f"failing question ran more than AGENT_SPECULATIVE_MAX_CANDIDATES={args.cap} candidates")
+
+    report = {"k": K, "cap": args.cap, "winner_latency": args.winner_latency,
+              "straggler_latency": args.straggler_latency,
+              "raced_seconds": raced["seconds"], "failing_seconds": failing["seconds"],
+              "log": outcomes, "problems": problems}
+    print(json.dumps(report, indent=2))
+    shutil.rmtree(work, ignore_errors=True)
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Offline check of /api/stream: when the first event, the first early answer and the complete result
+arrive, against the time /api takes for the same tips question (recorded-code Gemini stub)
+
+Usage: python bench/stream_test.py [--rounds 5] [--llm-latency 0.5] [--slow-plot 1.0] [--sse]
+Exits 1 if a stream ends without a result, sends no early answer, or disagrees with /api.
+"""
+import os, sys, json, time, shutil, argparse, tempfile, subprocess
+import requests
+
+from load_test import APP_DIR, BENCH_DIR, make_fixtures, serve_directory, rewrite, start_server, free_port
+
+def parse(line: bytes, sse: bool):
+    """An event dict from one NDJSON line or SSE data line (None for other lines)"""
+    if sse:
+        return json.loads(line[len(b"data: "):]) if line.startswith(b"data: ") else None
+    return json.loads(line) if line else None
+
+def streamed(base: str, question: str, sse: bool) -> dict:
+    start = time.perf_counter()
+    marks, answers, result = {}, {}, None
+    params = {"format": "sse"} if sse else None
+    with requests.post(f"{base}/api/stream", params=params, files={"file": ("question.txt", question.encode())},
+                       stream=True, timeout=300) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            event = parse(line, sse)
+            if event is None:
+                continue
+            now = time.perf_counter() - start
+            marks.setdefault("first_event", now)
+            if event["event"] == "answer":
+                marks.setdefault("first_answer", now)
+                answers[event["index"]] = event["value"]
+            elif event["event"] in ("result", "error"):
+                marks["result"] = now
+                result = event.get("result")
+    return {"marks": marks, "answers": answers, "result": result}
+
+def plain(base: str, question: str) -> tuple:
+    start = time.perf_counter()
+    resp = requests.post(f"{base}/api", files={"file": ("question.txt", question.encode())}, timeout=300)
+    return time.perf_counter() - start, resp.json() if resp.status_code == 200 else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds the Gemini stub takes per call")
+    parser.add_argument("--slow-plot", type=float, default=1.0,
+                        help="extra seconds the recorded program spends before drawing its plot (a large chart)")
+    parser.add_argument("--sse", action="store_true", help="read the SSE framing instead of NDJSON")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (server log)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="agent-stream-")
+    fixtures = make_fixtures(work)
+    data_server = serve_directory(fixtures["www"])
+    data_url = f"http://127.0.0.1:{data_server.server_address[1]}"
+    with open(os.path.join(APP_DIR, "test_question_1.txt"), encoding="utf-8") as fh:
+        question = rewrite(fh.read(), data_url, fixtures["parquet"])
+    with open(os.path.join(BENCH_DIR, "recordings", "tips.py"), encoding="utf-8") as fh:
+        program = rewrite(fh.read(), data_url, fixtures["parquet"])
+    program = program.replace("image_uri = ", f"__import__('time').sleep({args.slow_plot})\nimage_uri = ", 1)
+    stub_path = os.path.join(work, "recordings.json")
+    with open(stub_path, "w") as fh:
+        json.dump([{"match": "tips.csv", "code": program}], fh)
+
+    env = dict(os.environ, AGENT_LLM_STUB=stub_path, AGENT_LLM_STUB_LATENCY=str(args.llm_latency),
+               AGENT_CACHE_DIR=os.path.join(work, "cache"), AGENT_TEMPLATE_FAST_PATH="0", AGENT_CODE_CACHE="0",
+               AGENT_RESPONSE_CACHE="0", AGENT_CELL_MEMO="0")
+    port = free_port()
+    server = start_server(env, port, os.path.join(work, "server.log"))
+    base = f"http://127.0.0.1:{port}"
+    runs, totals, failures = [], [], []
+    try:
+        plain(base, question)  # warm-up
+        for _ in range(args.rounds):
+            seconds, expected = plain(base, question)
+            totals.append(seconds)
+            run = streamed(base, question, args.sse)
+            runs.append(run["marks"])
+            if run["result"] is None or run["result"] != expected:
+                failures.append("result missing or different from /api")
+            elif not run["answers"] or any(run["result"][i] != v for i, v in run["answers"].items()):
+                failures.append("no early answers, or early answers differ from the result")
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        data_server.shutdown()
+
+    def median(values):
+        values = sorted(v for v in values if v is not None)
+        return round(values[len(values) // 2], 3) if values else None
+
+    report = {"rounds": args.rounds, "framing": "sse" if args.sse else "ndjson", "llm_latency": args.llm_latency,
+              "slow_plot": args.slow_plot,
+              "api_seconds": median(totals),
+              **{f"stream_{mark}_seconds": median([r.get(mark) for r in runs]) for mark in ("first_event", "first_answer", "result")},
+              "failures": failures}
+    print(json.dumps(report, indent=2))
+    if args.keep:
+        print(f"work directory: {work}", file=sys.stderr)
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
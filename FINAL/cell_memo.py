@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Cell-level memoized execution: programs run one top-level statement at a time and each cell's
+namespace changes are kept, so a corrected program re-runs only from its first changed cell
+"""
+import os, ast, contextlib, copy, hashlib, logging, re, sys, threading, time, types
+from collections import OrderedDict
+import numpy as np, pandas as pd
+import template_registry
+
+CELL_MEMO_ENABLED = os.getenv("AGENT_CELL_MEMO", "1") != "0"
+CELL_MEMO_MB = float(os.getenv("AGENT_CELL_MEMO_MB", "256"))
+CELL_MEMO_ENTRY_MB = float(os.getenv("AGENT_CELL_MEMO_ENTRY_MB", "128"))
+CELL_MEMO_TTL = float(os.getenv("AGENT_CELL_MEMO_TTL", "600"))
+
+# Cells that change state outside the namespace (pyplot's current figure, tables on the cursor)
+GLOBAL_STATE_NAMES = {"plt", "sns", "matplotlib", "fig", "ax", "axes"}
+SQL_SIDE_EFFECT = re.compile(r"\b(CREATE|INSERT|UPDATE|DELETE|DROP|ALTER|ATTACH|COPY|INSTALL|LOAD|SET|PRAGMA)\b")
+SQL_NAMES = {"db", "duckdb", "con", "conn"}
+# Cells that publish early answers to a streaming client; restoring them would publish nothing
+PUBLISH_NAMES = {"emit"}
+
+class Uncopyable(Exception):
+    """A value the memo cannot snapshot safely (connections, relations, open files, ...)"""
+
+class Cell:
+    def __init__(self, source: str, first_line: int, names: set, kind: str):
+        self.source = source
+        self.first_line = first_line
+        self.names = names
+        self.kind = kind  # "state": memoized, "replay": cheap or publishing, always re-run, "effect": ends reuse
+
+    @property
+    def code(self):
+        # Pad so tracebacks and SyntaxWarnings report the line numbers of the whole program
+        return template_registry.compiled("\n" * (self.first_line - 1) + self.source, "<generated>")
+
+REPLAY_STATEMENTS = (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+def _kind(stmts, source: str, names: set) -> str:
+    if all(isinstance(stmt, REPLAY_STATEMENTS) for stmt in stmts) or names & PUBLISH_NAMES:
+        return "replay"
+    if names & GLOBAL_STATE_NAMES or (names & SQL_NAMES and SQL_SIDE_EFFECT.search(source)):
+        return "effect"
+    return "state"
+
+def split_cells(code: str) -> list:
+    """Top-level statements (those sharing a line stay together) with the comments above them;
+    raises SyntaxError like compile()"""
+    tree = ast.parse(code)
+    lines = code.splitlines(keepends=True)
+    groups = []
+    for stmt in tree.body:
+        start = min([stmt.lineno] + [d.lineno for d in getattr(stmt, "decorator_list", [])])
+        if groups and start <= groups[-1][1][-1].end_lineno:
+            groups[-1][1].append(stmt)
+        else:
+            groups.append((start, [stmt]))
+    cells = []
+    for i, (start, stmts) in enumerate(groups):
+        first = start if i else 1
+        last = groups[i + 1][0] - 1 if i + 1 < len(groups) else len(lines)
+        source = "".join(lines[first - 1:last])
+        names = {n.id for stmt in stmts for n in ast.walk(stmt) if isinstance(n, ast.Name)}
+        cells.append(Cell(source, first, names, _kind(stmts, source, names)))
+    return cells
+
+SHARED_TYPES = (types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type)
+
+def _snapshot(value, memo: dict):
+    """Private copy of a value; modules, functions and classes are shared"""
+    if isinstance(value, SHARED_TYPES):
+        return value
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return value.copy(deep=True)
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    try:
+        return copy.deepcopy(value, memo)
+    except Exception as e:
+        raise Uncopyable(f"{type(value).__name__}: {str(e)}")
+
+def _nbytes(value) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple, set, dict)):
+        items = value.items() if isinstance(value, dict) else ((None, v) for v in value)
+        return sys.getsizeof(value) + sum(_nbytes(k) + _nbytes(v) for k, v in items)
+    return sys.getsizeof(value)
+
+class _Delta:
+    def __init__(self, values: dict, deleted: set, nbytes: int):
+        self.values = values
+        self.deleted = deleted
+        self.nbytes = nbytes
+        self.created = time.time()
+
+class CellMemo:
+    """LRU of cell deltas keyed by a hash chain over the program prefix, bounded in bytes and age"""
+
+    def __init__(self, max_bytes: float = CELL_MEMO_MB * 2**20, entry_bytes: float = CELL_MEMO_ENTRY_MB * 2**20,
+                 ttl: float = CELL_MEMO_TTL):
+        self.max_bytes = max_bytes
+        self.entry_bytes = entry_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            delta = self._entries.get(key)
+            if delta is None:
+                return None
+            if time.time() - delta.created > self.ttl:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return delta
+
+    def put(self, key: str, delta: _Delta) -> bool:
+        if delta.nbytes > self.entry_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = delta
+            self.nbytes += delta.nbytes
+            while self.nbytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+        return key in self._entries
+
+    def _drop(self, key: str):
+        self.nbytes -= self._entries.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+_memo = CellMemo()
+
+def _chain(key: str, source: str) -> str:
+    return hashlib.sha256(f"{key}\0{source}".encode("utf-8")).hexdigest()
+
+def seed(params: dict = None, files=None) -> str:
+    """Inputs every cell depends on besides the program text: template parameters and uploaded files"""
+    described = [(f.get("name"), f.get("path"), f.get("size")) for f in files or ()]
+    return _chain(repr(sorted((params or {}).items(), key=lambda kv: kv[0])), repr(described))
+
+def _restore(ns: dict, delta: _Delta):
+    memo = {}
+    for name in delta.deleted:
+        ns.pop(name, None)
+    for name, value in delta.values.items():
+        if isinstance(value, types.FunctionType) and value.__globals__ is not ns:
+            # Lambdas from an earlier run must see this run's globals, not the namespace they were born in
+            value = types.FunctionType(value.__code__, ns, value.__name__, value.__defaults__, value.__closure__)
+        ns[name] = _snapshot(value, memo)
+
+def _record(ns: dict, before: dict, injected: dict, cell: Cell, max_bytes: float) -> _Delta:
+    """Names the cell rebound, deleted or mentioned (data possibly mutated in place), copied together;
+    None, before anything is copied, when their live size already exceeds max_bytes"""
+    changed = {}
+    for name, value in ns.items():
+        if name.startswith("__"):
+            continue
+        rebound = name not in before or before[name] is not value
+        mutated = name in cell.names and not isinstance(value, SHARED_TYPES) and injected.get(name) is not value
+        if rebound or mutated:
+            changed[name] = value
+    nbytes = sum(_nbytes(v) for v in changed.values())
+    if nbytes > max_bytes:
+        return None
+    memo = {}
+    values = {name: _snapshot(value, memo) for name, value in changed.items()}
+    return _Delta(values, set(before) - set(ns), nbytes)
+
+def _observed(observe, line: int, source: str):
+    return observe(line, source) if observe is not None else contextlib.nullcontext()
+
+def run(code: str, ns: dict, key: str = "", stats: dict = None, memo: CellMemo = None, observe=None) -> dict:
+    """exec() a program cell by cell, restoring the longest memoized prefix; stats gets the
+    reuse counts (filled as cells run, so they survive an exception). observe(line, source),
+    when given, is a context manager wrapped around every executed cell."""
+    memo = memo or _memo
+    stats = {} if stats is None else stats
+    stats.update(cells=0, cells_reused=0, cells_executed=0)
+    if not CELL_MEMO_ENABLED and observe is None:
+        exec(template_registry.compiled(code), ns)
+        return stats
+    cells = split_cells(code)
+    stats["cells"] = len(cells)
+    injected = dict(ns)
+    # Observed runs still go cell by cell when the memo is off, just without reuse
+    reusing = recording = CELL_MEMO_ENABLED
+    for cell in cells:
+        key = _chain(key, cell.source)
+        if reusing and cell.kind == "state":
+            delta = memo.get(key)
+            if delta is not None:
+                _restore(ns, delta)
+                stats["cells_reused"] += 1
+                continue
+        reusing = reusing and cell.kind == "replay"
+        recording = recording and cell.kind != "effect"
+        before = dict(ns) if recording and cell.kind == "state" else None
+        with _observed(observe, cell.first_line, cell.source):
+            exec(cell.code, ns)
+        stats["cells_executed"] += 1
+        if before is not None:
+            try:
+                delta = _record(ns, before, injected, cell, memo.entry_bytes)
+                recording = delta is not None and memo.put(key, delta)
+            except Uncopyable as e:
+                logging.info(f"Cell memo stops at line {cell.first_line}: {str(e)}")
+                recording = False
+    return stats
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Two-tier cache (in-memory LRU + SQLite) for generated analysis code
+"""
+import os, atexit, json, hashlib, logging, re, sqlite3, tempfile, threading, time
+from collections import OrderedDict
+
+CACHE_DIR = os.getenv("AGENT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "data_analyst_agent"))
+CODE_CACHE_ENABLED = os.getenv("AGENT_CODE_CACHE", "1") != "0"
+CODE_CACHE_PATH = os.getenv("AGENT_CODE_CACHE_PATH", os.path.join(CACHE_DIR, "code_cache.sqlite"))
+CODE_CACHE_TTL = float(os.getenv("AGENT_CODE_CACHE_TTL", str(7 * 24 * 3600)))
+CODE_CACHE_MEMORY_ENTRIES = int(os.getenv("AGENT_CODE_CACHE_MEMORY_ENTRIES", "128"))
+CODE_CACHE_DISK_ENTRIES = int(os.getenv("AGENT_CODE_CACHE_DISK_ENTRIES", "5000"))
+CODE_CACHE_FLUSH_SECONDS = float(os.getenv("AGENT_CODE_CACHE_FLUSH_SECONDS", "60"))
+
+def normalize_task(text: str) -> str:
+    """Collapse whitespace so trivially reformatted uploads share a key"""
+    return re.sub(r"\s+", " ", text).strip()
+
+def cache_key(task: str, patterns: dict, model: str, prompt_version: str) -> str:
+    """Content address for a task: normalized text + detected patterns + model/prompt version"""
+    material = json.dumps({
+        "task": normalize_task(task),
+        "patterns": patterns,
+        "model": model,
+        "prompt_version": prompt_version,
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class CodeCache:
+    def __init__(self, path: str = CODE_CACHE_PATH, ttl: float = CODE_CACHE_TTL,
+                 memory_entries: int = CODE_CACHE_MEMORY_ENTRIES, disk_entries: int = CODE_CACHE_DISK_ENTRIES,
+                 flush_seconds: float = CODE_CACHE_FLUSH_SECONDS):
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.flush_seconds = flush_seconds
+        self._memory = OrderedDict()
+        # Memory-tier hits not yet written to disk: key -> [last_used, hits]
+        self._pending = {}
+        self._flushed = time.time()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("""
+                    CREATE TABLE IF NOT EXISTS code_cache (
+                        key TEXT PRIMARY KEY,
+                        code TEXT NOT NULL,
+                        created REAL NOT NULL,
+                        last_used REAL NOT NULL,
+                        hits INTEGER NOT NULL DEFAULT 0
+                    )""")
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Code cache disk tier disabled: {str(e)}")
+                self._db = None
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def _remember(self, key: str, code: str, created: float):
+        self._memory[key] = (code, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            evicted, _ = self._memory.popitem(last=False)
+            if evicted in self._pending:
+                self._write_pending()
+
+    def _write_pending(self):
+        """Write deferred last_used/hits updates (caller holds _lock and commits)"""
+        if self._db and self._pending:
+            self._db.executemany(
+                "UPDATE code_cache SET last_used = max(last_used, ?), hits = hits + ? WHERE key = ?",
+                [(last_used, hits, key) for key, (last_used, hits) in self._pending.items()])
+        self._pending.clear()
+        self._flushed = time.time()
+
+    def flush(self):
+        """Write deferred hit statistics now (also done periodically, on eviction and at exit)"""
+        with self._lock:
+            try:
+                self._write_pending()
+                if self._db:
+                    self._db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Code cache flush failed: {str(e)}")
+
+    def get(self, key: str):
+        """Return cached code or None"""
+        try:
+            return self._get(key)
+        except sqlite3.Error as e:
+            logging.warning(f"Code cache read failed: {str(e)}")
+            return None
+
+    def _get(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and not self._expired(entry[1]):
+                self._memory.move_to_end(key)
+                # Hit statistics for the disk tier's LRU are batched, keeping disk writes off this path
+                pending = self._pending.setdefault(key, [0.0, 0])
+                pending[0], pending[1] = time.time(), pending[1] + 1
+                if time.time() - self._flushed > self.flush_seconds:
+                    self._write_pending()
+                    if self._db:
+                        self._db.commit()
+                return entry[0]
+            self._memory.pop(key, None)
+
+            if not self._db:
+                return None
+            row = self._db.execute("SELECT code, created FROM code_cache WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            code, created = row
+            if self._expired(created):
+                self._db.execute("DELETE FROM code_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE code_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            self._remember(key, code, created)
+            self._db.commit()
+            return code
+
+    def put(self, key: str, code: str):
+        """Store code that has executed successfully"""
+        try:
+            self._put(key, code)
+        except sqlite3.Error as e:
+            logging.warning(f"Code cache write failed: {str(e)}")
+
+    def _put(self, key: str, code: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, code, now)
+            if not self._db:
+                return
+            self._pending.pop(key, None)
+            # Pruning below goes by last_used, so deferred hits are written first
+            self._write_pending()
+            self._db.execute(
+                "INSERT OR REPLACE INTO code_cache (key, code, created, last_used, hits) VALUES (?, ?, ?, ?, 0)",
+                (key, code, now, now))
+            if self.ttl > 0:
+                self._db.execute("DELETE FROM code_cache WHERE created < ?", (now - self.ttl,))
+            self._db.execute("""
+                DELETE FROM code_cache WHERE key IN (
+                    SELECT key FROM code_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )""", (self.disk_entries,))
+            self._db.commit()
+
+    def evict(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._pending.pop(key, None)
+            if self._db:
+                try:
+                    self._db.execute("DELETE FROM code_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logging.warning(f"Code cache evict failed: {str(e)}")
+
+def open_code_cache():
+    """Process-wide cache instance, or None when disabled"""
+    if not CODE_CACHE_ENABLED:
+        return None
+    cache = CodeCache()
+    atexit.register(cache.flush)
+    return cache
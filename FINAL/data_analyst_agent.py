@@ -1,74 +1,90 @@
 #!/usr/bin/env python3
-import os, sys, json, asyncio, logging, re, time
-import pandas as pd, requests, duckdb, numpy as np
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-import seaborn as sns
+import os, sys, json, asyncio, argparse, logging, re, threading, time
+os.environ.setdefault("MPLBACKEND", "Agg")
+import pandas as pd, requests, numpy as np
 import io, base64
-from scipy import stats
-import google.generativeai as genai
-from fallback_templates import get_fallback_template
+# seaborn, scipy, matplotlib, duckdb and the Gemini SDK are imported on first use
+from lazy_modules import duckdb, plt, sns, stats, genai
+import fallback_templates
+from task_patterns import detect_task_patterns, extract_urls
+import batch
+import template_registry
+from code_cache import CACHE_DIR, cache_key, open_code_cache
+import http_cache
+import duckdb_manager
+import limits
+import sandbox
+import image_budget
+import serializer
+import lazy_modules
+import metrics
+import events
+import profiling
+import attachments
+import prefetch
+import analysis
+import plots
+import wiki_tables
+import cell_memo
+import llm_client
+import llm_stub
+import routing
 
 # Configuration
 API_KEY = os.getenv("GEMINI_API_KEY") or "YOUR_API_KEY_HERE"
-genai.configure(api_key=API_KEY)
-MODEL = "models/gemini-2.5-flash"
+MODEL = routing.STRONG_MODEL  # easy questions go to routing.FAST_MODEL first
+PROMPT_VERSION = "9"  # bump whenever the plan_task prompt changes so cached code is not reused
+LLM_STUB = os.getenv("AGENT_LLM_STUB")  # recorded-responses JSON that replaces Gemini (offline benchmarks)
+MAX_OUTPUT_TOKENS = int(os.getenv("AGENT_MAX_OUTPUT_TOKENS", "4000"))
+# Appended to the prompt when the previous reply was abandoned (llm_client.RejectedOutput reasons)
+REPAIR_HINTS = {
+    "prose": "it was prose, not code. Reply with Python code only: no explanations, no markdown.",
+    "syntax": "it had a syntax error. Reply with complete, valid Python code only.",
+    "truncated": "it was cut off at the output limit. Write a shorter program.",
+    "no_result": "it never assigned the answer. Assign the final answer to `result`.",
+}
+
+# "sandbox" runs generated code in killable child processes; "thread" runs it in this process
+EXEC_BACKEND = os.getenv("AGENT_EXEC_BACKEND", "sandbox")
+
+# Speculative mode: plan and run K candidate programs at once and keep the first that passes
+SPECULATIVE_K = int(os.getenv("AGENT_SPECULATIVE_K", "1"))
+SPECULATIVE_MAX_CANDIDATES = int(os.getenv("AGENT_SPECULATIVE_MAX_CANDIDATES", "6"))  # cost cap per task
+SPECULATIVE_LOG = os.getenv("AGENT_SPECULATIVE_LOG", os.path.join(CACHE_DIR, "speculative.jsonl"))
+TEMPLATE_FAST_PATH = os.getenv("AGENT_TEMPLATE_FAST_PATH", "1") == "1"
+TEMPLATE_HEAD_START = float(os.getenv("AGENT_TEMPLATE_HEAD_START", "5"))
+CANDIDATE_VARIANTS = [
+    (0.1, None),
+    (0.5, "Inspect df.columns and df.dtypes before using any column, and coerce numbers with pd.to_numeric(errors='coerce')."),
+    (0.8, "Take a different approach from the most obvious one, e.g. another table selection or parsing strategy."),
+    (0.6, "Keep the program short: load once, compute each answer directly, avoid optional steps."),
+]
 
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 
-def detect_task_patterns(text: str) -> dict:
-    """Analyze the task to understand data sources, output format, and analysis type"""
-    patterns = {
-        'data_sources': [],
-        'output_format': 'json_array',
-        'has_visualization': False,
-        'analysis_type': 'general',
-        'specific_requirements': []
-    }
-    
-    text_lower = text.lower()
-    
-    # Detect data sources
-    if 'wikipedia' in text_lower or 'wiki' in text_lower:
-        patterns['data_sources'].append('wikipedia')
-    if 'duckdb' in text_lower or 'parquet' in text_lower or 's3://' in text:
-        patterns['data_sources'].append('duckdb')
-    if '.csv' in text_lower:
-        patterns['data_sources'].append('csv')
-    
-    # Detect output format
-    if 'json object' in text_lower or 'json dictionary' in text_lower:
-        patterns['output_format'] = 'json_object'
-    elif 'json array' in text_lower:
-        patterns['output_format'] = 'json_array'
-    
-    # Detect visualization requirements
-    if any(word in text_lower for word in ['plot', 'chart', 'graph', 'scatter', 'histogram', 'visualization']):
-        patterns['has_visualization'] = True
-    
-    # Detect analysis type
-    if 'correlation' in text_lower:
-        patterns['analysis_type'] = 'correlation'
-    elif 'regression' in text_lower:
-        patterns['analysis_type'] = 'regression'
-    elif 'count' in text_lower or 'how many' in text_lower:
-        patterns['analysis_type'] = 'counting'
-    elif 'earliest' in text_lower or 'latest' in text_lower or 'first' in text_lower:
-        patterns['analysis_type'] = 'temporal'
-    
-    # Extract specific requirements
-    if 'base64' in text_lower or 'data uri' in text_lower:
-        patterns['specific_requirements'].append('base64_encoding')
-    if '100' in text and ('kb' in text_lower or 'kilobyte' in text_lower):
-        patterns['specific_requirements'].append('size_limit_100kb')
-    if 'dotted' in text_lower and 'red' in text_lower:
-        patterns['specific_requirements'].append('dotted_red_line')
-    
-    return patterns
+_genai_configured = False
 
-async def plan_task(text: str) -> str:
-    """Generate Python code using Gemini"""
+def get_genai():
+    """Import and configure the Gemini SDK on first use"""
+    global _genai_configured
+    if not _genai_configured:
+        genai.configure(api_key=API_KEY)
+        _genai_configured = True
+    return genai
+
+_models = {}
+_model_lock = threading.Lock()
+
+def get_model(model: str = MODEL):
+    """One client per model and process; generation settings go with each request
+    (AGENT_LLM_STUB swaps in recorded responses for offline runs)"""
+    with _model_lock:
+        if model not in _models:
+            _models[model] = llm_stub.StubModel(LLM_STUB, model=model) if LLM_STUB else get_genai().GenerativeModel(model)
+        return _models[model]
+
+def build_prompt(text: str, hint: str = None, instruction: str = "Generate ONLY the Python code that solves this task.") -> str:
+    """The code-generation prompt for a task, with attachment schemas and an optional approach hint"""
     patterns = detect_task_patterns(text)
     
     prompt = f"""You are an expert data analyst. Generate ONLY Python code (no markdown, no explanations) that:
@@ -96,70 +112,105 @@ CRITICAL RULES:
 1. Always handle errors gracefully with try/except
 2. Cast columns to appropriate types before operations
 3. For string operations: df['col'].astype(str) first
-4. Keep images under 100KB (use dpi=80, figsize=(8,6))
+4. Keep images under 100KB; the chart helpers and `to_data_uri(fig)` are already defined and return data URIs that fit
 5. Assign final answer to variable named `result`
-6. For Wikipedia: Use pd.read_html(url) and select appropriate table
-7. For DuckDB: Use duckdb.sql(query).df()
-8. For visualizations: Save as PNG with base64 encoding
-9. For dotted red lines: Use 'r--' style
+6. For Wikipedia: df = read_wiki_table(url, match="caption or header regex", columns=["Rank", "Title", ...]) returns just the best-fitting wikitable with the requested columns, footnotes stripped and currency/number text already numeric (no pd.read_html, no table index guessing)
+7. For DuckDB: Use the preconfigured connection `db` (httpfs and parquet already loaded, do not INSTALL/LOAD): db.sql(query).df(). Select only the columns you need, never SELECT * on remote parquet, and filter on partition columns (year=, court=, ...)
+8. For CSV/Parquet/JSON data (paths, URLs, s3:// globs or attached views) never load whole files into pandas. These helpers are already defined: rel = load(source) (lazy DuckDB relation), schema(rel), peek(rel), count(rel, where=...), group_agg(rel, by=[...], where=..., order=..., name="avg(col)", ...) -> small DataFrame, regression(rel, x, y, where=...) -> dict(slope, intercept, r, r2, n), sample(rel, n=5000, columns=[...]) -> DataFrame for scatterplots. Arguments are SQL expressions; call .df() only on small results
+9. For visualizations use the predefined chart helpers, which return a data URI: scatter_with_regression(x, y, xlabel=..., ylabel=..., title=..., line="r--") (line fitted on all points, large inputs sampled for drawing), bar(labels, values, ...) or bar(series), hist(values, bins=20, ...). Pass mime="image/webp" if WebP is requested. Only for other chart types: fig, ax = plt.subplots(figsize=(8, 6)), image_uri = to_data_uri(fig, mime=...), then plt.close(fig)
+10. For dotted red lines: Use 'r--' style
+11. When there are several questions, call emit(i, answer) as soon as each answer is computed (i = its position in `result`, or its key when `result` is a dict), before slower work such as plots; still assign the complete `result` at the end
 
 TASK:
 \"\"\"{text}\"\"\"
 
-Generate ONLY the Python code that solves this task.
+{instruction}
 """
-    
+    files_section = attachments.prompt_section()
+    if files_section:
+        prompt += f"\n{files_section}\n"
+    sniffed = prefetch.prompt_section()
+    if sniffed:
+        prompt += f"\n{sniffed}\n"
+    if hint:
+        prompt += f"\nAPPROACH HINT: {hint}\n"
+    return prompt
+
+async def plan_task(text: str, temperature: float = 0.1, hint: str = None) -> str:
+    """Generate Python code using Gemini"""
+    # Schemas sniffed within the prefetch deadline go into the prompt; the downloads go on meanwhile
+    await prefetch.wait()
+    return await generate_code(build_prompt(text, hint), temperature)
+
+async def generate_code(prompt: str, temperature: float = 0.1, max_output_tokens: int = MAX_OUTPUT_TOKENS) -> str:
+    """One validated program from Gemini, re-requesting rejected or failed replies"""
     max_retries = 3
-    for attempt in range(max_retries):
+    repair = None
+    attempt = throttled = 0
+    model, cap = routing.current()
+    if cap:
+        max_output_tokens = min(max_output_tokens, cap)
+    while True:
         try:
-            model = genai.GenerativeModel(
-                MODEL,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.1,
-                    top_p=0.8,
-                    max_output_tokens=4000
-                )
-            )
-            
-            resp = model.generate_content(prompt.strip())
-            code = resp.text.strip()
-            
-            # Clean up markdown formatting
-            if code.startswith("```"):
-                code = re.sub(r"^```(?:python)?\n", "", code)
-                code = re.sub(r"\n```$", "", code).strip()
-            
-            return code
-            
+            with metrics.span("plan", attempt=attempt + 1, temperature=temperature):
+                request = prompt if repair is None else f"{prompt}\nPREVIOUS REPLY REJECTED: {repair}\n"
+                config = {"temperature": temperature, "top_p": 0.8, "max_output_tokens": max_output_tokens}
+
+                # Shared request/token budget across workers; repairs of a rejected reply take the priority lane
+                async with limits.llm_rate(len(request) // 4 + max_output_tokens, priority=repair is not None) as budget:
+                    async with limits.llm_slot():
+                        with metrics.span("llm", model=model) as llm:
+                            try:
+                                # Streamed and compiled as it arrives; broken output is abandoned mid-stream
+                                return await asyncio.to_thread(llm_client.stream_code, get_model(model), request.strip(), config, llm)
+                            except llm_client.RejectedOutput as e:
+                                llm["rejected"] = e.reason
+                                raise
+                            except Exception as e:
+                                if limits.throttle_hint(e) is not None:
+                                    llm["throttled"] = True
+                                raise
+                            finally:
+                                if "prompt_tokens" in llm:
+                                    budget["used"] = llm["prompt_tokens"] + llm["completion_tokens"]
+
+        except llm_client.RejectedOutput as e:
+            logging.warning(f"Gemini attempt {attempt + 1} rejected ({e.reason}): {str(e)}")
+            if attempt == max_retries - 1:
+                raise
+            repair = REPAIR_HINTS.get(e.reason, str(e))
         except Exception as e:
+            if limits.LLM_RATE_LIMIT and limits.throttle_hint(e) is not None and throttled < limits.LLM_MAX_THROTTLED_RETRIES:
+                # Not an attempt: the shared limiter now holds every worker until the backoff ends
+                throttled += 1
+                continue
             logging.warning(f"Gemini attempt {attempt + 1} failed: {str(e)}")
             if attempt == max_retries - 1:
                 raise e
-            await asyncio.sleep(1.5 ** attempt)
-
-def sanitize(obj):
-    """Sanitize data for JSON serialization"""
-    if isinstance(obj, (np.integer, np.int32, np.int64)):
-        return int(obj)
-    elif isinstance(obj, (np.floating, np.float32, np.float64)):
-        val = float(obj)
-        if np.isnan(val) or np.isinf(val):
-            return None
-        return val
-    elif isinstance(obj, bytes):
-        return obj.decode("utf-8", errors="ignore")
-    elif isinstance(obj, list):
-        return [sanitize(x) for x in obj]
-    elif isinstance(obj, dict):
-        return {k: sanitize(v) for k, v in obj.items()}
-    elif pd.isna(obj):
-        return None
-    else:
-        return obj
+            await asyncio.sleep(limits.backoff_delay(attempt))
+        attempt += 1
 
-def execute_code(code: str):
-    """Execute generated code"""
+def emit_answer(index, value):
+    """Publish one answer element as soon as it is computed (streaming clients see it before `result`)"""
+    if not events.active():
+        return
+    try:
+        data = serializer.encode(image_budget.fit_images(serializer.prepare(value)))
+    except Exception as e:
+        logging.warning(f"emit({index!r}) skipped: {str(e)}")
+        return
+    events.publish("answer", index=index, value=data)
+
+def execute_code(code: str, params: dict = None, files=None):
+    """Execute generated code (or a template with its parameters) with uploaded files as DuckDB views"""
+    # pandas URL readers and requests.get go through the shared on-disk HTTP cache
+    http_cache.install()
+    db = duckdb_manager.cursor()
     ns = {
+        "fetch": http_cache.fetch,
+        "db": db,
+        "scan_report": lambda query: duckdb_manager.scan_report(query, con=db),
+        "to_data_uri": image_budget.to_data_uri,
         "pd": pd,
         "requests": requests,
         "duckdb": duckdb,
@@ -174,64 +225,109 @@ def execute_code(code: str):
         "re": re,
         "os": os
     }
+    ns.update(analysis.helpers(db))
+    ns.update(plots.helpers())
+    ns["read_wiki_table"] = wiki_tables.read_wiki_table
+    ns["emit"] = emit_answer
+    ns["files"] = {f["name"]: f["path"] for f in files or ()}
+    ns.update(params or {})
+    profile = profiling.Profile(sample=profiling.requested() == "sample") if profiling.requested() else None
     
     try:
-        exec(code, ns)
+        attachments.register_views(db, files)
+        with metrics.span("exec") as cells:
+            figures = profiling.open_figures()
+            try:
+                # A corrected program resumes after the prefix it shares with the failed one
+                cell_memo.run(code, ns, cell_memo.seed(params, files), cells, observe=profile and profile.statement)
+            finally:
+                # Figures this program left open would pile up in this long-lived process
+                closed = profiling.close_figures(figures)
+                if closed:
+                    cells["figures_closed"] = closed
+                    if profile is not None:
+                        profile.figures_closed = closed
+        if cells.get("cells_reused"):
+            logging.info(f"Cell memo: {cells['cells_reused']} of {cells['cells']} cells reused")
         
         if "result" not in ns:
             raise RuntimeError("Generated code did not assign `result` variable")
 
-        result = sanitize(ns["result"])
-        
-        # Validate JSON serializability
-        json.dumps(result)
+        with metrics.span("serialize"):
+            result = serializer.prepare(ns["result"])
         
-        # Check image size constraints
-        def check_image_size(obj):
-            if isinstance(obj, str) and obj.startswith("data:image/"):
-                size_bytes = len(obj.encode('utf-8'))
-                if size_bytes > 100_000:
-                    raise RuntimeError(f"Image exceeds 100KB limit: {size_bytes/1024:.1f}KB")
-            elif isinstance(obj, list):
-                for item in obj:
-                    check_image_size(item)
-            elif isinstance(obj, dict):
-                for value in obj.values():
-                    check_image_size(value)
-        
-        check_image_size(result)
-        return result
+        # Re-encode oversized images to fit the 100KB limit instead of failing the run
+        with metrics.span("image_fit"):
+            try:
+                result = image_budget.fit_images(result)
+            except (ValueError, OSError) as e:
+                raise RuntimeError(f"Image exceeds 100KB limit: {str(e)}")
+
+        # Serialize exactly once; the bytes travel unchanged to stdout / the HTTP response
+        with metrics.span("encode"):
+            return serializer.Payload(serializer.encode(result))
         
+    except MemoryError:
+        logging.error("Code execution failed: out of memory")
+        return {"error": "Execution failed: out of memory (MemoryError)", "error_type": "oom"}
     except Exception as e:
         logging.error(f"Code execution failed: {str(e)}")
         return {"error": f"Execution failed: {str(e)}"}
+    finally:
+        if profile is not None:
+            profile.finish()
+        db.close()
+        # Functions defined by the program reference ns, so without this the cycle keeps its data alive until a gc pass
+        ns.clear()
 
-async def execute_with_retry(task: str, max_attempts: int = 2) -> dict:
-    """Execute task with retry and self-correction"""
-    
-    for attempt in range(max_attempts):
-        try:
-            logging.info(f"Planning attempt {attempt + 1} with Gemini...")
-            code = await plan_task(task)
-            
-            if attempt == 0:
-                print("=== GEMINI GENERATED CODE ===", file=sys.stderr)
-                print(code, file=sys.stderr)
-                print("=============================", file=sys.stderr)
+_sandbox = None
 
-            logging.info("Executing generated code...")
-            result = await asyncio.get_event_loop().run_in_executor(None, execute_code, code)
-            
-            if not (isinstance(result, dict) and "error" in result):
-                return {"success": True, "result": result, "attempt": attempt + 1}
-            
-            if attempt < max_attempts - 1:
-                logging.warning(f"Attempt {attempt + 1} failed: {result['error']}")
-                logging.info("Attempting self-correction...")
-                
-                task = f"""
-PREVIOUS ATTEMPT FAILED WITH ERROR: {result['error']}
+def get_sandbox():
+    global _sandbox
+    if _sandbox is None:
+        _sandbox = sandbox.SandboxPool(execute_code)
+    return _sandbox
+
+def warm_up():
+    """Import heavy modules and pre-start executor processes so later runs pay no import cost"""
+    lazy_modules.preload()
+    # Executors are forked before anything here starts threads (DuckDB, prefetch, event relays)
+    if EXEC_BACKEND == "sandbox":
+        get_sandbox().warm()
+    prefetch.warm_up()
 
+async def run_code(code: str, params: dict = None):
+    """Run execute_code off the event loop once an execution slot is free"""
+    files = list(attachments.current())
+    files += prefetch.views(files)
+    with metrics.span("execute", backend=EXEC_BACKEND) as span:
+        async with limits.execution_slot():
+            if EXEC_BACKEND != "sandbox":
+                # to_thread (unlike run_in_executor) carries the current trace into the thread
+                result = await asyncio.to_thread(execute_code, code, params, files)
+            else:
+                cancel = threading.Event()
+                try:
+                    result = await asyncio.to_thread(get_sandbox().run, code, cancel=cancel, params=params, files=files)
+                except asyncio.CancelledError:
+                    # Kill the child instead of leaving a runaway program holding memory
+                    cancel.set()
+                    raise
+        if is_error(result):
+            span["error"] = result.get("error_type") or "exec_error"
+        return result
+
+RESOURCE_HINTS = {
+    "timeout": "The program was killed for running too long: avoid loops over rows, repeated downloads and unbounded queries.",
+    "cpu_limit": "The program used too much CPU: vectorize with pandas/numpy or push aggregation into DuckDB.",
+    "oom": "The program ran out of memory: read only the needed columns/rows and aggregate in DuckDB before converting to pandas.",
+}
+
+def correction_prompt(task: str, error: str, error_type: str = None) -> str:
+    hint = f"\n{RESOURCE_HINTS[error_type]}\n" if error_type in RESOURCE_HINTS else ""
+    return f"""
+PREVIOUS ATTEMPT FAILED WITH ERROR: {error}
+{hint}
 Please fix the issue and try a different approach. Common fixes:
 - Check data availability and column names
 - Handle missing data gracefully
@@ -242,68 +338,393 @@ Please fix the issue and try a different approach. Common fixes:
 ORIGINAL TASK:
 {task}
 """
-            else:
-                return {"success": False, "error": result['error'], "attempt": attempt + 1}
-                
+
+def is_error(result) -> bool:
+    return isinstance(result, dict) and "error" in result
+
+async def _run_candidate(task: str, index: int, temperature: float, hint: str) -> dict:
+    """Plan and execute one speculative candidate, timing both stages"""
+    record = {"candidate": index, "temperature": temperature, "hint": bool(hint)}
+    start = time.time()
+    try:
+        record["code"] = await plan_task(task, temperature=temperature, hint=hint)
+    except Exception as e:
+        record.update(outcome="plan_error", error=f"Planning failed: {str(e)}", plan_s=time.time() - start)
+        return record
+    record["plan_s"] = time.time() - start
+
+    start = time.time()
+    events.stage("executing", candidate=index)
+    record["result"] = await run_code(record["code"])
+    record["exec_s"] = time.time() - start
+    if is_error(record["result"]):
+        record.update(outcome="exec_error", error=record["result"]["error"],
+                      error_type=record["result"].get("error_type"))
+    else:
+        record["outcome"] = "passed"
+    return record
+
+def _log_candidates(attempt: int, records: list):
+    """Append per-candidate outcomes so K can be tuned from real traffic"""
+    summary = [{k: v for k, v in r.items() if k not in ("code", "result")} for r in records]
+    logging.info(f"Speculative attempt {attempt + 1}: {[r['outcome'] for r in summary]}")
+    if not SPECULATIVE_LOG:
+        return
+    try:
+        os.makedirs(os.path.dirname(SPECULATIVE_LOG) or ".", exist_ok=True)
+        with open(SPECULATIVE_LOG, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps({"time": time.time(), "attempt": attempt + 1, "candidates": summary}) + "\n")
+    except OSError as e:
+        logging.warning(f"Could not write speculative log: {str(e)}")
+
+async def speculate(task: str, k: int, attempt: int):
+    """Race K candidates; return (winning record or None, first failure as {error, error_type})"""
+    variants = [CANDIDATE_VARIANTS[i % len(CANDIDATE_VARIANTS)] for i in range(k)]
+    pending = {
+        asyncio.create_task(_run_candidate(task, i, temperature, hint)): i
+        for i, (temperature, hint) in enumerate(variants)
+    }
+    records, winner = [], None
+    try:
+        while pending and winner is None:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for finished in done:
+                pending.pop(finished)
+                record = finished.result()
+                records.append(record)
+                if winner is None and record["outcome"] == "passed":
+                    winner = record
+    finally:
+        for straggler, index in pending.items():
+            straggler.cancel()
+            records.append({"candidate": index, "temperature": variants[index][0],
+                            "hint": bool(variants[index][1]), "outcome": "cancelled"})
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    if winner:
+        winner["outcome"] = "won"
+    _log_candidates(attempt, records)
+    failures = [r for r in sorted(records, key=lambda r: r["candidate"]) if r.get("error")]
+    failure = failures[0] if failures else {"error": "All candidates failed"}
+    return winner, {"error": failure["error"], "error_type": failure.get("error_type")}
+
+_code_cache = None
+
+def get_code_cache():
+    """Open the code cache lazily so forked workers never share a SQLite handle"""
+    global _code_cache
+    if _code_cache is None:
+        _code_cache = open_code_cache() or False
+    return _code_cache or None
+
+def task_cache_key(task: str, model: str = MODEL) -> str:
+    # Same question over differently shaped uploads must not share cached code; keyed by the model that planned it
+    return cache_key(task + attachments.fingerprint(), detect_task_patterns(task), model, PROMPT_VERSION)
+
+def cached_program(code_cache, task: str) -> tuple:
+    """(tier, key, code) of a program cached for this task, preferring the strong model's; (None, None, None) if none"""
+    for tier in ("strong", "fast"):
+        key = task_cache_key(task, routing.TIERS[tier])
+        code = code_cache.get(key) if code_cache else None
+        if code:
+            return tier, key, code
+    return None, None, None
+
+async def execute_with_retry(task: str, max_attempts: int = 2, speculative_k: int = SPECULATIVE_K,
+                             planned: str = None) -> dict:
+    """Execute task with retry and self-correction; `planned` (from a batch plan) replaces the first planning call"""
+    budget = SPECULATIVE_MAX_CANDIDATES
+    code_cache = get_code_cache()
+    original = task
+    # Easy questions are planned by the fast model first; a failed attempt escalates to the strong one
+    decision = routing.Decision(task)
+    try:
+        with metrics.span("code_cache") as span:
+            cached_tier, key, cached_code = cached_program(code_cache, task)
+            span["hit"] = bool(cached_code)
+        if cached_code:
+            logging.info(f"Code cache hit ({cached_tier} model's program), skipping Gemini...")
+            events.stage("executing", cached=True)
+            started = time.time()
+            result = await run_code(cached_code)
+            # Replays count towards the planning model's record like the run that cached the program
+            decision.attempted(cached_tier, "exec_error" if is_error(result) else "passed", started, cached=True)
+            if not is_error(result):
+                return {"success": True, "result": result, "attempt": 0, "cached": True}
+            logging.warning(f"Cached code failed on replay, evicting: {result['error']}")
+            code_cache.evict(key)
+
+        for attempt in range(max_attempts):
+            # A batch plan came from the strong model
+            tier = "strong" if planned and attempt == 0 else decision.tier_for(attempt)
+            started = time.time()
+            try:
+                k = 1 if planned and attempt == 0 else min(speculative_k, budget)
+                if k > 1:
+                    budget -= k
+                    logging.info(f"Speculative attempt {attempt + 1} with {k} candidates ({tier} model)...")
+                    events.stage("planning", attempt=attempt + 1, candidates=k, tier=tier)
+                    with limits.priority_lane(attempt > 0), routing.using(tier):
+                        winner, failure = await speculate(task, k, attempt)
+                    decision.attempted(tier, "passed" if winner else "failed", started)
+                    if winner:
+                        if code_cache:
+                            code_cache.put(task_cache_key(original, routing.TIERS[tier]), winner["code"])
+                        return {"success": True, "result": winner["result"], "attempt": attempt + 1,
+                                "candidate": winner["candidate"]}
+                    if attempt < max_attempts - 1:
+                        logging.warning(f"Attempt {attempt + 1} failed: {failure['error']}")
+                        logging.info("Attempting self-correction...")
+                        events.stage("retrying", attempt=attempt + 1, error=failure['error'])
+                        task = correction_prompt(task, failure['error'], failure['error_type'])
+                        continue
+                    return {"success": False, "error": failure['error'], "attempt": attempt + 1}
+
+                if planned and attempt == 0:
+                    logging.info("Using the program planned together with the rest of the batch...")
+                    code = planned
+                else:
+                    logging.info(f"Planning attempt {attempt + 1} with Gemini ({tier} model)...")
+                    events.stage("planning", attempt=attempt + 1, tier=tier)
+                    # Self-correction calls jump the rate-limit queue: the task already spent one round trip
+                    with limits.priority_lane(attempt > 0), routing.using(tier):
+                        code = await plan_task(task)
+
+                print(f"=== GEMINI GENERATED CODE (attempt {attempt + 1}) ===", file=sys.stderr)
+                print(code, file=sys.stderr)
+                print("=============================", file=sys.stderr)
+
+                logging.info("Executing generated code...")
+                events.stage("executing", attempt=attempt + 1)
+                result = await run_code(code)
+
+                if not is_error(result):
+                    decision.attempted(tier, "passed", started)
+                    if code_cache:
+                        code_cache.put(task_cache_key(original, routing.TIERS[tier]), code)
+                    return {"success": True, "result": result, "attempt": attempt + 1}
+                decision.attempted(tier, "exec_error", started)
+
+                # Keep the failing program next to its error in the server log
+                logging.warning(f"Attempt {attempt + 1} failed: {result['error']}\n--- failed code ---\n{code}")
+                if attempt < max_attempts - 1:
+                    logging.info("Attempting self-correction...")
+                    events.stage("retrying", attempt=attempt + 1, error=result['error'])
+                    task = correction_prompt(task, result['error'], result.get('error_type'))
+                else:
+                    return {"success": False, "error": result['error'], "attempt": attempt + 1}
+
+            except Exception as e:
+                decision.attempted(tier, "plan_error", started)
+                error_msg = f"Planning failed on attempt {attempt + 1}: {str(e)}"
+                logging.error(error_msg)
+
+                if attempt == max_attempts - 1:
+                    return {"success": False, "error": error_msg, "attempt": attempt + 1}
+
+        return {"success": False, "error": "Max attempts exceeded", "attempt": max_attempts}
+    finally:
+        decision.finish()
+
+async def run_template(match, allow_synthetic: bool):
+    """Run a matched template; synthetic fallback data is only allowed after the LLM path failed"""
+    events.stage("fallback" if allow_synthetic else "template", template=match.name)
+    with metrics.span("fallback" if allow_synthetic else "template", template=match.name):
+        try:
+            return await run_code(match.template.source, {**match.params, "allow_synthetic": allow_synthetic})
         except Exception as e:
-            error_msg = f"Planning failed on attempt {attempt + 1}: {str(e)}"
-            logging.error(error_msg)
-            
-            if attempt == max_attempts - 1:
-                return {"success": False, "error": error_msg, "attempt": attempt + 1}
-    
-    return {"success": False, "error": "Max attempts exceeded", "attempt": max_attempts}
+            return {"error": f"Template {match.name} failed: {str(e)}"}
+
+async def fast_path(task: str, match) -> dict:
+    """Give a confident template match a head start, then race it against the LLM pipeline"""
+    logging.info(f"Template fast path: {match.name} ({match.confidence:.2f}) with {match.params}")
+    template_run = asyncio.create_task(run_template(match, allow_synthetic=False))
+    llm_run = None
+    try:
+        await asyncio.wait({template_run}, timeout=TEMPLATE_HEAD_START)
+        pending = {template_run}
+        if not template_run.done():
+            llm_run = asyncio.create_task(execute_with_retry(task))
+            pending.add(llm_run)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if template_run in done:
+                result = template_run.result()
+                if not is_error(result):
+                    return {"success": True, "result": result, "attempt": 0, "template": match.name}
+                logging.warning(f"Template {match.name} failed: {result['error']}")
+                if llm_run is None:
+                    llm_run = asyncio.create_task(execute_with_retry(task))
+                    pending.add(llm_run)
+            if llm_run in done:
+                outcome = llm_run.result()
+                if outcome["success"] or not pending:
+                    return outcome
+        # Both failed, the template last
+        return llm_run.result()
+    finally:
+        for run in (template_run, llm_run):
+            if run is not None and not run.done():
+                run.cancel()
+
+def sniff_attachments(files) -> list:
+    """Schemas of uploaded files, read from a sample by DuckDB before planning"""
+    with metrics.span("attachments", count=len(files)):
+        con = duckdb_manager.cursor()
+        try:
+            return attachments.describe(files, con)
+        finally:
+            con.close()
+
+async def solve(task: str, files=None, described=None, planned: str = None) -> dict:
+    """Solve a task under a fresh trace; the outcome carries its spans back to the server"""
+    trace = metrics.start_trace()
+    if described is None:
+        described = sniff_attachments(files) if files else ()
+    attachments.activate(described)
+    # Data the question names is fetched and sniffed while templates, caches and Gemini are consulted
+    fetching = prefetch.start(task, skip={f.get("url") for f in described})
+    try:
+        outcome = await _solve(task, planned)
+    finally:
+        if fetching is not None:
+            fetching.close()
+    outcome["spans"] = trace.spans
+    return outcome
+
+def needs_planning(task: str) -> bool:
+    """False when the template fast path or the code cache will answer without the LLM"""
+    match = fallback_templates.registry.match(task)
+    if TEMPLATE_FAST_PATH and match is not None and match.confidence >= template_registry.FAST_PATH_CONFIDENCE:
+        return False
+    return cached_program(get_code_cache(), task)[2] is None
+
+async def plan_batch(tasks: list) -> dict:
+    """Plan related questions with one Gemini call; {index: program} for the programs that validate"""
+    markers = ", ".join(batch.BATCH_MARKER.format(n=i + 1) for i in range(len(tasks)))
+    text = "\n\n".join(f"QUESTION {i + 1}:\n{task}" for i, task in enumerate(tasks))
+    instruction = (f"Generate ONLY Python code: one self-contained program per question, in order, each starting with its "
+                   f"marker line ({markers}) and assigning that question's answer to `result`. Start every program with "
+                   "the same data-loading lines, character for character.")
+    try:
+        with metrics.span("plan_batch", questions=len(tasks)) as span:
+            code = await generate_code(build_prompt(text, instruction=instruction),
+                                       max_output_tokens=MAX_OUTPUT_TOKENS * len(tasks))
+            programs = llm_client.split_programs(code, batch.BATCH_MARKER)
+            span["planned"] = len(programs)
+    except Exception as e:
+        logging.warning(f"Batch planning failed, planning questions one by one: {str(e)}")
+        return {}
+    return {n - 1: program for n, program in programs.items() if 0 < n <= len(tasks)}
+
+async def solve_batch(tasks: list, files=None, combined: bool = False) -> dict:
+    """Answer questions about the same data in this worker: tabular URLs are fetched and sniffed once
+    and shared as DuckDB views, and with `combined` one Gemini call plans every question"""
+    trace = metrics.start_trace()
+    urls = [] if len(tasks) < 2 else list(dict.fromkeys(
+        url for task in tasks for url in extract_urls(task) if http_cache.is_http_url(url)))
+    with metrics.span("batch_prefetch", urls=len(urls)):
+        datasets = await asyncio.gather(*(asyncio.to_thread(prefetch.dataset, url) for url in urls))
+    shared = list(files or []) + [d for d in datasets if d]
+    described = sniff_attachments(shared) if shared else []
+    attachments.activate(described)
+
+    planned = {}
+    pending = [i for i, task in enumerate(tasks) if needs_planning(task)]
+    if combined and len(pending) > 1:
+        programs = await plan_batch([tasks[i] for i in pending])
+        planned = {pending[j]: program for j, program in programs.items()}
+        logging.info(f"Batch plan covered {len(planned)} of {len(pending)} questions")
+
+    async def one(i: int, task: str) -> dict:
+        start = time.time()
+        try:
+            outcome = await solve(task, described=described, planned=planned.get(i))
+        except Exception as e:
+            logging.error(f"Batch question {i + 1} failed: {str(e)}")
+            outcome = {"success": False, "error": str(e), "spans": []}
+        outcome["seconds"] = time.time() - start
+        return outcome
+
+    outcomes = await asyncio.gather(*(one(i, task) for i, task in enumerate(tasks)))
+    # Shared work (prefetch, batch planning) is reported once, with the first question
+    outcomes[0]["spans"] = trace.spans + outcomes[0]["spans"]
+    return {"outcomes": outcomes}
+
+async def _solve(task: str, planned: str = None) -> dict:
+    """Answer confidently matched question shapes from templates, otherwise plan with the LLM;
+    fall back to a matching template (never an unrelated one) when generated code fails"""
+    start_time = time.time()
+    match = fallback_templates.registry.match(task)
+
+    if TEMPLATE_FAST_PATH and match is not None and match.confidence >= template_registry.FAST_PATH_CONFIDENCE:
+        execution_result = await fast_path(task, match)
+    else:
+        execution_result = await execute_with_retry(task, planned=planned)
+
+    if execution_result["success"]:
+        total_time = time.time() - start_time
+        logging.info(f"✅ Task completed successfully in {total_time:.2f}s")
+        return execution_result
+
+    logging.warning(f"Primary execution failed: {execution_result['error']}")
+    if match is None:
+        return {"success": False, "error": f"{execution_result['error']} (no fallback template matches this task)",
+                "attempt": execution_result["attempt"]}
+
+    logging.info(f"Attempting fallback template {match.name} with {match.params}...")
+    result = await run_template(match, allow_synthetic=True)
+
+    if not is_error(result):
+        total_time = time.time() - start_time
+        logging.info(f"✅ Fallback completed successfully in {total_time:.2f}s")
+        return {"success": True, "result": result, "attempt": execution_result["attempt"], "fallback": True,
+                "template": match.name}
+
+    total_time = time.time() - start_time
+    final_error = f"Both primary and fallback failed after {total_time:.2f}s. Primary: {execution_result['error']} | Fallback: {result['error']}"
+    logging.error(final_error)
+    return {"success": False, "error": final_error, "attempt": execution_result["attempt"]}
 
 async def main():
-    if len(sys.argv) != 2:
-        print("Usage: data_analyst_agent.py <question.txt>")
+    parser = argparse.ArgumentParser(description="Answer a data analysis question")
+    parser.add_argument("question", nargs="?", help="path to question.txt")
+    parser.add_argument("--import-profile", action="store_true", help="report cold import time and check it against the baseline")
+    parser.add_argument("--record-baseline", action="store_true", help="with --import-profile, save the current import time as the baseline")
+    parser.add_argument("--tolerance", type=float, default=None, help="allowed import-time regression as a fraction (default 0.25)")
+    parser.add_argument("--profile", nargs="?", const="basic", choices=("basic", "sample"),
+                        help="log a resource profile of every execution (sample: also dump stack samples)")
+    args = parser.parse_args()
+
+    if args.import_profile:
+        import import_profile
+        tolerance = import_profile.IMPORT_TOLERANCE if args.tolerance is None else args.tolerance
+        sys.exit(import_profile.run(record_baseline=args.record_baseline, tolerance=tolerance))
+    if not args.question:
+        parser.print_usage()
         sys.exit(1)
 
     start_time = time.time()
-    task = open(sys.argv[1], encoding="utf-8").read().strip()
+    task = open(args.question, encoding="utf-8").read().strip()
     
     patterns = detect_task_patterns(task)
     logging.info(f"Task analysis: {patterns}")
     
+    profiling.request(args.profile or profiling.PROFILE_ALWAYS)
     try:
-        execution_result = await execute_with_retry(task)
-        
-        if execution_result["success"]:
-            result = execution_result["result"]
-            total_time = time.time() - start_time
-            logging.info(f"✅ Task completed successfully in {total_time:.2f}s")
-            
-            json.dump(result, sys.stdout)
-            sys.stdout.write("\n")
-            
+        outcome = await solve(task)
+        logging.info(f"Stage timings (ms): {metrics.server_timing(outcome['spans'], time.time() - start_time)}")
+        if profiling.requested():
+            logging.info(f"Profile: {json.dumps(profiling.debug_block(outcome['spans']), indent=2)}")
+
+        if outcome["success"]:
+            sys.stdout.flush()
+            sys.stdout.buffer.write(outcome["result"].data + b"\n")
         else:
-            logging.warning(f"Primary execution failed: {execution_result['error']}")
-            logging.info("Attempting fallback template...")
-            
-            try:
-                fallback_code = get_fallback_template(task)
-                
-                print("=== FALLBACK TEMPLATE CODE ===", file=sys.stderr)
-                print(fallback_code, file=sys.stderr)
-                print("===============================", file=sys.stderr)
-                
-                result = await asyncio.get_event_loop().run_in_executor(None, execute_code, fallback_code)
-                
-                if isinstance(result, dict) and "error" in result:
-                    raise Exception(result["error"])
-                
-                total_time = time.time() - start_time
-                logging.info(f"✅ Fallback completed successfully in {total_time:.2f}s")
-                json.dump(result, sys.stdout)
-                sys.stdout.write("\n")
-                
-            except Exception as fallback_error:
-                total_time = time.time() - start_time
-                final_error = f"Both primary and fallback failed after {total_time:.2f}s. Primary: {execution_result['error']} | Fallback: {str(fallback_error)}"
-                logging.error(final_error)
-                json.dump({"error": final_error}, sys.stdout)
-                sys.stdout.write("\n")
-                sys.exit(1)
+            json.dump({"error": outcome["error"]}, sys.stdout)
+            sys.stdout.write("\n")
+            sys.exit(1)
                 
     except Exception as e:
         total_time = time.time() - start_time
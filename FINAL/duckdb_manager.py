@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Per-worker DuckDB connection with extensions preloaded and remote parquet metadata cached
+"""
+import os, json, logging, threading
+from lazy_modules import duckdb
+from code_cache import CACHE_DIR
+
+DUCKDB_THREADS = os.getenv("AGENT_DUCKDB_THREADS")
+DUCKDB_MEMORY_LIMIT = os.getenv("AGENT_DUCKDB_MEMORY_LIMIT", "2GB")
+DUCKDB_TEMP_DIR = os.getenv("AGENT_DUCKDB_TEMP_DIR", os.path.join(CACHE_DIR, "duckdb_tmp"))
+DUCKDB_EXTENSIONS = ("httpfs", "parquet")
+
+_connection = None
+_connection_pid = None
+_lock = threading.Lock()
+
+def _load_extension(con, name: str):
+    try:
+        con.execute(f"LOAD {name}")
+    except duckdb.Error:
+        con.execute(f"INSTALL {name}")
+        con.execute(f"LOAD {name}")
+
+def _apply_settings(con):
+    os.makedirs(DUCKDB_TEMP_DIR, exist_ok=True)
+    settings = {
+        "memory_limit": DUCKDB_MEMORY_LIMIT,
+        "temp_directory": DUCKDB_TEMP_DIR,
+        # Keep parquet footers and HTTP HEAD/metadata results across queries
+        "enable_object_cache": True,
+        "enable_http_metadata_cache": True,
+    }
+    if DUCKDB_THREADS:
+        settings["threads"] = int(DUCKDB_THREADS)
+    for name, value in settings.items():
+        try:
+            con.execute(f"SET {name} = ?", [value])
+        except duckdb.Error as e:
+            logging.warning(f"DuckDB setting {name} not applied: {str(e)}")
+
+def get_connection():
+    """Process-wide DuckDB connection, created once per worker"""
+    global _connection, _connection_pid
+    with _lock:
+        if _connection is None or _connection_pid != os.getpid():
+            con = duckdb.connect(":memory:")
+            for name in DUCKDB_EXTENSIONS:
+                try:
+                    _load_extension(con, name)
+                except duckdb.Error as e:
+                    logging.warning(f"DuckDB extension {name} unavailable: {str(e)}")
+            _apply_settings(con)
+            _connection, _connection_pid = con, os.getpid()
+        return _connection
+
+def cursor():
+    """Thread-local handle onto the shared database (same extensions, settings and caches)"""
+    return get_connection().cursor()
+
+def _scan_nodes(node):
+    name = node.get("name", "")
+    if name.endswith("_SCAN") or name.startswith("READ_"):
+        yield node
+    for child in node.get("children", []):
+        yield from _scan_nodes(child)
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [v.strip() for v in str(value).split("\n") if v.strip()]
+
+def _file_kind(name: str):
+    """"parquet", "csv" or "json" for a reader function, scan operator or file name"""
+    name = name.lower()
+    for kind, marks in (("parquet", ("parquet",)), ("csv", ("csv", ".tsv")), ("json", ("json",))):
+        if any(mark in name for mark in marks):
+            return kind
+    return None
+
+def _constant(node):
+    """A path argument: a string, or a list for read_parquet(['a', 'b'])"""
+    if node.get("class") == "CONSTANT":
+        return node["value"].get("value")
+    if node.get("function_name") == "list_value":
+        return [_constant(child) for child in node.get("children", [])]
+    return None
+
+def _file_sources(tree) -> list:
+    """(kind, path or glob) of each file the parsed query reads, in query order"""
+    if isinstance(tree, list):
+        return [source for item in tree for source in _file_sources(item)]
+    if not isinstance(tree, dict):
+        return []
+    if tree.get("type") == "TABLE_FUNCTION" and tree.get("function", {}).get("children"):
+        function = tree["function"]
+        path = _constant(function["children"][0])
+        if path and _file_kind(function.get("function_name", "")):
+            return [(_file_kind(function["function_name"]), path)]
+    if tree.get("type") == "BASE_TABLE" and not tree.get("schema_name") and _file_kind(tree.get("table_name", "")):
+        # FROM 'data.parquet' (a replacement scan)
+        return [(_file_kind(tree["table_name"]), tree["table_name"])]
+    return [source for value in tree.values() for source in _file_sources(value)]
+
+def _count_files(con, path) -> int:
+    if isinstance(path, list):
+        return len(path)
+    if not any(c in path for c in "*?["):
+        return 1
+    try:
+        return con.execute("SELECT count(*) FROM glob(?)", [path]).fetchone()[0]
+    except duckdb.Error:
+        return None
+
+def _has_star(tree) -> bool:
+    if isinstance(tree, dict):
+        if tree.get("class") == "STAR" or tree.get("type") == "STAR":
+            return True
+        return any(_has_star(v) for v in tree.values())
+    if isinstance(tree, list):
+        return any(_has_star(v) for v in tree)
+    return False
+
+def scan_report(query: str, con=None) -> dict:
+    """Report which columns and files/partitions each scan in a query touches, without running it"""
+    con = con or cursor()
+    plan = json.loads(con.execute(f"EXPLAIN (FORMAT json) {query}").fetchall()[0][1])
+    try:
+        statements = json.loads(con.execute("SELECT json_serialize_sql(?)", [query]).fetchone()[0]).get("statements", [])
+        select_star = _has_star(statements)
+    except (duckdb.Error, ValueError, TypeError):
+        statements, select_star = [], None
+    # The plan names the reader but not what it reads: paths come from the query, matched per reader kind
+    sources = _file_sources(statements)
+
+    scans = []
+    for root in plan:
+        for node in _scan_nodes(root):
+            info = node.get("extra_info", {})
+            operator = node.get("name")
+            kind = _file_kind(operator) if not info.get("Table") else None
+            path = next((p for k, p in sources if k == kind), None) if kind else None
+            if path is not None:
+                sources.remove((kind, path))
+            scan = {
+                "operator": operator,
+                "source": path if path is not None else info.get("Table") or info.get("Function"),
+                "columns": _as_list(info.get("Projections")),
+                "filters": _as_list(info.get("Filters")) + _as_list(info.get("File Filters")),
+            }
+            if "Scanning Files" in info:
+                scanned, total = str(info["Scanning Files"]).split("/")
+                scan["files_scanned"], scan["files_total"] = int(scanned), int(total)
+            elif path is not None:
+                # No file filter was pushed down: every file matched is read
+                total = _count_files(con, path)
+                if total is not None:
+                    scan["files_scanned"] = scan["files_total"] = total
+            scans.append(scan)
+
+    warnings = []
+    if select_star:
+        warnings.append("Query uses SELECT *; list only the columns you need")
+    for scan in scans:
+        if "files_total" in scan and scan["files_scanned"] == scan["files_total"] and scan["files_total"] > 1:
+            warnings.append(f"{scan['source']} reads all {scan['files_total']} files; filter on partition columns")
+    return {"select_star": select_star, "scans": scans, "warnings": warnings}
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Progress events for streaming clients (stage changes, answers published early by generated code),
+relayed over the sandbox and worker pipes to the server; a no-op when nobody listens
+"""
+import contextvars, logging, threading
+
+_sink = contextvars.ContextVar("agent_event_sink", default=None)
+
+class PipeSink:
+    """Sends events as {"event": ...} messages on a pipe the caller also uses for its final reply;
+    once closed, late events (from abandoned threads) are dropped instead of reaching the next task"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        with self._lock:
+            if not self.closed:
+                self.conn.send({"event": event})
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+
+def listen(sink):
+    """Route events published from this context (and tasks/threads started from it) to sink; returns a reset token"""
+    return _sink.set(sink)
+
+def stop(token):
+    _sink.reset(token)
+
+def active() -> bool:
+    return _sink.get() is not None
+
+def forward(event: dict):
+    """Pass on an event received from a child process"""
+    sink = _sink.get()
+    if sink is None:
+        return
+    try:
+        sink(event)
+    except (BrokenPipeError, EOFError, OSError) as e:
+        # Streaming is best effort; the final reply still carries the whole result
+        logging.warning(f"Dropping {event.get('event')} event: {str(e)}")
+
+def publish(event: str, **fields):
+    forward({"event": event, **fields})
+
+def stage(name: str, **fields):
+    publish("stage", stage=name, **fields)
+
+def is_event(message) -> bool:
+    return isinstance(message, dict) and "event" in message and len(message) == 1
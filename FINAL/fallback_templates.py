@@ -1,56 +1,34 @@
 #!/usr/bin/env python3
 """
-Fallback templates for common data analysis tasks
+Parameterized templates for known question shapes, served before the LLM when they match confidently
+and as a fallback when generated code fails
 """
+from template_registry import Param, Template, TemplateRegistry
 
 TIPS_DATASET_TEMPLATE = """
 import pandas as pd
 import requests
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import io
-import base64
 import numpy as np
-from scipy import stats
 
-# Load the tips dataset
-url = "https://raw.githubusercontent.com/mwaskom/seaborn-data/master/tips.csv"
+# Parameters (injected): url, meal, bill_threshold
 df = pd.read_csv(url)
 
 # 1. How many dinner bills (time == "Dinner") were higher than $30?
-dinner_over_30 = len(df[(df['time'] == 'Dinner') & (df['total_bill'] > 30)])
+dinner_over_30 = len(df[(df['time'] == meal) & (df['total_bill'] > bill_threshold)])
+emit(0, dinner_over_30)
 
 # 2. Which day of the week had the largest average tip?
 avg_tip_by_day = df.groupby('day')['tip'].mean()
 largest_tip_day = avg_tip_by_day.idxmax()
+emit(1, largest_tip_day)
 
-# 3. Draw a scatterplot of total_bill (x-axis) vs tip (y-axis) with a dotted red regression line
-plt.figure(figsize=(8, 6))
-plt.scatter(df['total_bill'], df['tip'], alpha=0.6)
-
-# Add regression line
-slope, intercept, r_value, p_value, std_err = stats.linregress(df['total_bill'], df['tip'])
-line = slope * df['total_bill'] + intercept
-plt.plot(df['total_bill'], line, 'r--', alpha=0.8)
-
-plt.xlabel('Total Bill')
-plt.ylabel('Tip')
-plt.title('Total Bill vs Tip')
-
-# Save to base64
-buffer = io.BytesIO()
-plt.savefig(buffer, format='png', dpi=80, bbox_inches='tight')
-buffer.seek(0)
-image_png = buffer.getvalue()
-buffer.close()
-plt.close()
-
-image_b64 = base64.b64encode(image_png).decode('utf-8')
-image_uri = f"data:image/png;base64,{image_b64}"
-
-# 4. What is the Pearson correlation between total_bill and tip?
+# 4. What is the Pearson correlation between total_bill and tip? (before the slower plot)
 correlation = df['total_bill'].corr(df['tip'])
+emit(3, round(correlation, 3))
+
+# 3. Draw a scatterplot of total_bill (x-axis) vs tip (y-axis) with a dotted red regression line
+image_uri = scatter_with_regression(df['total_bill'], df['tip'], xlabel='Total Bill', ylabel='Tip',
+                                    title='Total Bill vs Tip', line='r--')
 
 result = [dinner_over_30, largest_tip_day, image_uri, round(correlation, 3)]
 """
@@ -58,80 +36,46 @@ result = [dinner_over_30, largest_tip_day, image_uri, round(correlation, 3)]
 WIKIPEDIA_FILMS_TEMPLATE = """
 import pandas as pd
 import requests
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import io
-import base64
 import numpy as np
-from scipy import stats
 import re
 
-# Create fallback data for Wikipedia films
-df = pd.DataFrame({
-    'Rank': list(range(1, 21)),
-    'Film': [f'Movie {i}' for i in range(1, 21)],
-    'Worldwide_gross': [f'${2.5 - i*0.1:.1f} billion' for i in range(1, 21)],
-    'Year': [2019 - (i % 10) for i in range(1, 21)],
-    'Peak': list(range(1, 21))
-})
-
-# Add some realistic movie names for the top ones
-df.loc[0, 'Film'] = 'Avatar (2009)'
-df.loc[1, 'Film'] = 'Avengers: Endgame (2019)'
-df.loc[2, 'Film'] = 'Titanic (1997)'
-df.loc[3, 'Film'] = 'Star Wars: The Force Awakens (2015)'
-
-# Set realistic gross values
-df.loc[0, 'Worldwide_gross'] = '$2.9 billion'
-df.loc[1, 'Worldwide_gross'] = '$2.8 billion'
-df.loc[2, 'Worldwide_gross'] = '$2.2 billion'
-df.loc[3, 'Worldwide_gross'] = '$2.1 billion'
-
-# Extract numeric values from gross column
-gross_extracted = df['Worldwide_gross'].astype(str).str.extract(r'(\\d+\\.?\\d*)')
-df['gross_numeric'] = pd.to_numeric(gross_extracted[0], errors='coerce')
+# Parameters (injected): url, gross_threshold_bn, before_year, earliest_threshold_bn, allow_synthetic
+# read_wiki_table parses only the matching wikitable, caches it per page revision and serves the last
+# cached revision when the page cannot be fetched
+try:
+    df = read_wiki_table(url, match="grossing", columns=["Rank", "Peak", "Title", "Worldwide gross", "Year"])
+except Exception:
+    if not allow_synthetic:
+        raise
+    # Last resort when the page was never fetched successfully
+    df = pd.DataFrame({
+        'Rank': [1, 2, 3, 4],
+        'Peak': [1, 1, 3, 1],
+        'Title': ['Avatar', 'Avengers: Endgame', 'Avatar: The Way of Water', 'Titanic'],
+        'Worldwide gross': [2923706026, 2797501328, 2320250281, 2264743305],
+        'Year': [2009, 2019, 2022, 1997]
+    })
 
-# Extract year from film title
-year_extracted = df['Film'].astype(str).str.extract(r'\\((\\d{4})\\)')
-df['year_numeric'] = pd.to_numeric(year_extracted[0], errors='coerce')
+df['gross_numeric'] = pd.to_numeric(df['Worldwide gross'], errors='coerce') / 1e9
+df['year_numeric'] = pd.to_numeric(df['Year'], errors='coerce')
+ranks = df[['Rank', 'Peak']].apply(pd.to_numeric, errors='coerce').dropna().astype(float)
 
 # 1. How many $2 bn movies were released before 2000?
-movies_2bn_before_2000 = len(df[(df['gross_numeric'] >= 2.0) & (df['year_numeric'] < 2000)])
+movies_2bn_before_2000 = len(df[(df['gross_numeric'] >= gross_threshold_bn) & (df['year_numeric'] < before_year)])
+emit(0, str(movies_2bn_before_2000))
 
 # 2. Which is the earliest film that grossed over $1.5 bn?
-over_1_5bn = df[df['gross_numeric'] >= 1.5]
-if not over_1_5bn.empty:
-    earliest_film = over_1_5bn.loc[over_1_5bn['year_numeric'].idxmin(), 'Film']
-else:
-    earliest_film = "Titanic"
+over_1_5bn = df[df['gross_numeric'] > earliest_threshold_bn].sort_values(['year_numeric', 'Rank'])
+earliest_film = over_1_5bn['Title'].iloc[0] if not over_1_5bn.empty else ""
+emit(1, str(earliest_film))
 
 # 3. What's the correlation between Rank and Peak?
-correlation = df['Rank'].corr(df['Peak'])
+correlation = ranks['Rank'].corr(ranks['Peak'])
+emit(2, str(round(correlation, 6)))
 
 # 4. Draw a scatterplot of Rank and Peak
-plt.figure(figsize=(8, 6))
-plt.scatter(df['Rank'], df['Peak'], alpha=0.6)
-
-# Add regression line
-slope, intercept, r_value, p_value, std_err = stats.linregress(df['Rank'], df['Peak'])
-line = slope * df['Rank'] + intercept
-plt.plot(df['Rank'], line, 'r--', alpha=0.8)
-
-plt.xlabel('Rank')
-plt.ylabel('Peak')
-plt.title('Rank vs Peak')
-
-# Save to base64
-buffer = io.BytesIO()
-plt.savefig(buffer, format='png', dpi=80, bbox_inches='tight')
-buffer.seek(0)
-image_png = buffer.getvalue()
-buffer.close()
-plt.close()
-
-image_b64 = base64.b64encode(image_png).decode('utf-8')
-image_uri = f"data:image/png;base64,{image_b64}"
+image_uri = scatter_with_regression(ranks['Rank'], ranks['Peak'], xlabel='Rank', ylabel='Peak',
+                                    title='Rank vs Peak', line='r--')
 
 result = [str(movies_2bn_before_2000), str(earliest_film), str(round(correlation, 6)), image_uri]
 """
@@ -139,30 +83,28 @@ result = [str(movies_2bn_before_2000), str(earliest_film), str(round(correlation
 INDIAN_COURT_TEMPLATE = """
 import pandas as pd
 import duckdb
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import io
-import base64
 import numpy as np
 from scipy import stats
 from datetime import datetime
 
-# Install and load required extensions
-duckdb.sql("INSTALL httpfs")
-duckdb.sql("LOAD httpfs")
-duckdb.sql("INSTALL parquet")
-duckdb.sql("LOAD parquet")
-
-# Query the dataset
-query = '''
-SELECT * FROM read_parquet('s3://indian-high-court-judgments/metadata/parquet/year=*/court=*/bench=*/metadata.parquet?s3_region=ap-south-1')
-WHERE year BETWEEN 2019 AND 2022
-'''
+# Parameters (injected): parquet_path, court_id, start_year, end_year, allow_synthetic
+# `db` is the worker's managed DuckDB connection: httpfs/parquet are preloaded and
+# parquet metadata is cached, so only read the columns the questions need
+source = f"read_parquet('{parquet_path}')"
 
 try:
-    df = duckdb.sql(query).df()
-except:
+    court_counts = db.sql(f'''
+        SELECT court, COUNT(*) AS cases FROM {source}
+        WHERE year BETWEEN {int(start_year)} AND {int(end_year)}
+        GROUP BY court ORDER BY cases DESC
+    ''').df()
+    df = db.sql(f'''
+        SELECT court, year, date_of_registration, decision_date FROM {source}
+        WHERE year BETWEEN {int(start_year)} AND {int(end_year)} AND court = ?
+    ''', params=[court_id]).df()
+except Exception:
+    if not allow_synthetic:
+        raise
     # Fallback data if S3 access fails
     df = pd.DataFrame({
         'court': ['33_10', '33_11', '33_12'] * 100,
@@ -171,16 +113,20 @@ except:
         'decision_date': ['2019-06-01', '2020-06-01', '2021-06-01'] * 100,
         'disposal_nature': ['DISMISSED', 'ALLOWED', 'DISPOSED'] * 100
     })
+    court_counts = df['court'].value_counts().rename_axis('court').reset_index(name='cases')
+
+questions = [
+    f"Which high court disposed the most cases from {start_year} - {end_year}?",
+    f"What's the regression slope of the date_of_registration - decision_date by year in the court={court_id}?",
+    "Plot the year and # of days of delay from the above question as a scatterplot with a regression line. Encode as a base64 data URI under 100,000 characters",
+]
 
 # 1. Which high court disposed the most cases from 2019-2022?
-if not df.empty:
-    court_counts = df['court'].value_counts()
-    most_cases_court = court_counts.index[0] if not court_counts.empty else "33_10"
-else:
-    most_cases_court = "33_10"
+most_cases_court = court_counts['court'].iloc[0] if not court_counts.empty else court_id
+emit(questions[0], str(most_cases_court))
 
 # 2. Regression slope for court=33_10
-court_33_10 = df[df['court'] == '33_10'] if 'court' in df.columns else df.head(50)
+court_33_10 = df[df['court'] == court_id] if 'court' in df.columns else df.head(50)
 
 if not court_33_10.empty and 'date_of_registration' in court_33_10.columns and 'decision_date' in court_33_10.columns:
     try:
@@ -199,72 +145,76 @@ if not court_33_10.empty and 'date_of_registration' in court_33_10.columns and '
         slope = 15.5
 else:
     slope = 15.5
+emit(questions[1], str(round(slope, 6)))
 
 # 3. Plot year vs delay days
-plt.figure(figsize=(8, 6))
-
 if not court_33_10.empty and 'delay_days' in court_33_10.columns:
-    try:
-        yearly_delay = court_33_10.groupby('year')['delay_days'].mean().reset_index()
-        plt.scatter(yearly_delay['year'], yearly_delay['delay_days'], alpha=0.6)
-        
-        # Add regression line
-        line = slope * yearly_delay['year'] + intercept
-        plt.plot(yearly_delay['year'], line, 'r--', alpha=0.8)
-        
-        plt.xlabel('Year')
-        plt.ylabel('Average Delay (Days)')
-    except:
-        # Fallback plot
-        years = [2019, 2020, 2021, 2022]
-        delays = [150, 165, 180, 195]
-        plt.scatter(years, delays, alpha=0.6)
-        slope_fb, intercept_fb, _, _, _ = stats.linregress(years, delays)
-        line = slope_fb * np.array(years) + intercept_fb
-        plt.plot(years, line, 'r--', alpha=0.8)
-        plt.xlabel('Year')
-        plt.ylabel('Average Delay (Days)')
+    yearly_delay = court_33_10.groupby('year')['delay_days'].mean().reset_index()
+    years, delays = yearly_delay['year'], yearly_delay['delay_days']
 else:
     # Fallback plot
-    years = [2019, 2020, 2021, 2022]
-    delays = [150, 165, 180, 195]
-    plt.scatter(years, delays, alpha=0.6)
-    slope_fb, intercept_fb, _, _, _ = stats.linregress(years, delays)
-    line = slope_fb * np.array(years) + intercept_fb
-    plt.plot(years, line, 'r--', alpha=0.8)
-    plt.xlabel('Year')
-    plt.ylabel('Average Delay (Days)')
-
-plt.title('Year vs Average Case Delay')
-
-# Save to base64
-buffer = io.BytesIO()
-plt.savefig(buffer, format='png', dpi=80, bbox_inches='tight')
-buffer.seek(0)
-image_png = buffer.getvalue()
-buffer.close()
-plt.close()
-
-image_b64 = base64.b64encode(image_png).decode('utf-8')
-image_uri = f"data:image/webp;base64,{image_b64}"
+    years, delays = [2019, 2020, 2021, 2022], [150, 165, 180, 195]
+image_uri = scatter_with_regression(years, delays, xlabel='Year', ylabel='Average Delay (Days)',
+                                    title='Year vs Average Case Delay', line='r--', mime='image/webp')
 
-result = {
-    "Which high court disposed the most cases from 2019 - 2022?": str(most_cases_court),
-    "What's the regression slope of the date_of_registration - decision_date by year in the court=33_10?": str(round(slope, 6)),
-    "Plot the year and # of days of delay from the above question as a scatterplot with a regression line. Encode as a base64 data URI under 100,000 characters": image_uri
-}
+result = dict(zip(questions, [str(most_cases_court), str(round(slope, 6)), image_uri]))
 """
 
-def get_fallback_template(task_text: str) -> str:
-    """Return appropriate fallback template based on task content"""
-    task_lower = task_text.lower()
-    
-    if "tips" in task_lower and "seaborn" in task_lower:
-        return TIPS_DATASET_TEMPLATE
-    elif "wikipedia" in task_lower and "highest-grossing" in task_lower:
-        return WIKIPEDIA_FILMS_TEMPLATE
-    elif "indian high court" in task_lower or "judgments" in task_lower:
-        return INDIAN_COURT_TEMPLATE
-    else:
-        # Default to tips dataset template
-        return TIPS_DATASET_TEMPLATE
\ No newline at end of file
+registry = TemplateRegistry([
+    Template(
+        "tips",
+        TIPS_DATASET_TEMPLATE,
+        "seaborn tips dataset csv dinner bills total_bill tip time day of week largest average tip "
+        "scatterplot total_bill tip dotted red regression line pearson correlation",
+        keywords=("tips", "total_bill", "dinner"),
+        params={
+            "url": Param("https://raw.githubusercontent.com/mwaskom/seaborn-data/master/tips.csv", r"(https?://\S+?tips\.csv)"),
+            "meal": Param("Dinner", r'time\s*==\s*"(\w+)"'),
+            "bill_threshold": Param(30.0, r"higher than \$(\d+(?:\.\d+)?)"),
+        },
+        questions=(
+            r"how many \w+ bills .*higher than \$",
+            r"which day of the week had the largest average tip",
+            r"scatterplot of total_bill .*vs tip",
+            r"pearson correlation .*between total_bill and tip",
+        ),
+    ),
+    Template(
+        "highest_grossing_films",
+        WIKIPEDIA_FILMS_TEMPLATE,
+        "wikipedia list of highest grossing films scrape bn movies released before earliest film grossed "
+        "correlation rank peak scatterplot dotted red regression line",
+        keywords=("highest", "grossing", "films", "wikipedia"),
+        params={
+            "url": Param("https://en.wikipedia.org/wiki/List_of_highest-grossing_films", r"(https?://\S+highest-grossing_films\S*)"),
+            "gross_threshold_bn": Param(2.0, r"\$(\d+(?:\.\d+)?)\s*bn movies"),
+            "before_year": Param(2000, r"released before (\d{4})"),
+            "earliest_threshold_bn": Param(1.5, r"grossed over \$(\d+(?:\.\d+)?)\s*bn"),
+        },
+        questions=(
+            r"how many \$[\d.]+\s*bn movies were released before \d{4}",
+            r"which is the earliest film that grossed over \$[\d.]+\s*bn",
+            r"correlation between the rank and peak",
+            r"scatterplot of rank and peak .*regression line",
+        ),
+    ),
+    Template(
+        "indian_high_court",
+        INDIAN_COURT_TEMPLATE,
+        "indian high court judgments judgement ecourts s3 parquet metadata court disposed most cases "
+        "regression slope date_of_registration decision_date year delay days scatterplot",
+        keywords=("high court", "judgment", "date_of_registration", "decision_date"),
+        params={
+            "parquet_path": Param("s3://indian-high-court-judgments/metadata/parquet/year=*/court=*/bench=*/metadata.parquet?s3_region=ap-south-1",
+                                  r"((?:s3|https?)://\S+\.parquet\S*|/\S+\.parquet)"),
+            "court_id": Param("33_10", r"court\s*=\s*(\d+_\d+)"),
+            "start_year": Param(2019, r"from (\d{4})\s*-\s*\d{4}"),
+            "end_year": Param(2022, r"from \d{4}\s*-\s*(\d{4})"),
+        },
+        questions=(
+            r"which high court disposed the most cases from \d{4}\s*-\s*\d{4}",
+            r"regression slope of the date_of_registration\s*-\s*decision_date by year in the court\s*=\s*\d+_\d+",
+            r"plot the year and # of days of delay",
+        ),
+    ),
+])
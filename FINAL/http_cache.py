@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Content-addressed HTTP cache shared by generated code and fallback templates
+"""
+import os, io, functools, hashlib, inspect, logging, sqlite3, threading, time, weakref
+from contextlib import contextmanager
+import pandas as pd, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from code_cache import CACHE_DIR
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+
+HTTP_CACHE_ENABLED = os.getenv("AGENT_HTTP_CACHE", "1") != "0"
+HTTP_CACHE_DIR = os.getenv("AGENT_HTTP_CACHE_DIR", os.path.join(CACHE_DIR, "http"))
+HTTP_CACHE_FRESH_SECONDS = float(os.getenv("AGENT_HTTP_CACHE_FRESH_SECONDS", "3600"))
+HTTP_CACHE_MB = float(os.getenv("AGENT_HTTP_CACHE_MB", "2048"))
+# Entries used this recently survive pruning (their blobs may back a DuckDB view of a running job)
+PRUNE_GRACE_SECONDS = 300
+# last_used is rewritten on a hit only when older than this, keeping commits off the hot path
+USE_RESOLUTION_SECONDS = 60
+HTTP_TIMEOUT = float(os.getenv("AGENT_HTTP_TIMEOUT", "30"))
+USER_AGENT = "Mozilla/5.0 (compatible; tds-data-analyst-agent/1.0)"
+
+COMPRESSION_BY_SUFFIX = {".gz": "gzip", ".bz2": "bz2", ".zip": "zip", ".xz": "xz", ".zst": "zstd"}
+
+def is_http_url(source) -> bool:
+    return isinstance(source, str) and source.startswith(("http://", "https://"))
+
+class CachedResponse:
+    def __init__(self, url: str, status: int, content: bytes, headers: dict, from_cache: bool):
+        self.url = url
+        self.status_code = status
+        self.content = content
+        self.headers = headers
+        self.from_cache = from_cache
+
+    @property
+    def encoding(self) -> str:
+        content_type = self.headers.get("Content-Type", "")
+        if "charset=" in content_type:
+            return content_type.split("charset=")[-1].split(";")[0].strip()
+        return "utf-8"
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+    def to_requests(self) -> requests.Response:
+        """Materialize as a requests.Response for code that expects one"""
+        resp = requests.Response()
+        resp.url = self.url
+        resp.status_code = self.status_code
+        resp._content = self.content
+        resp.headers.update(self.headers)
+        resp.encoding = self.encoding
+        return resp
+
+class HttpCache:
+    """Blobs live under blobs/<sha256>; an SQLite index maps URL -> blob + validators. Blobs beyond
+    max_bytes are pruned least recently used first"""
+
+    def __init__(self, root: str = HTTP_CACHE_DIR, fresh_seconds: float = HTTP_CACHE_FRESH_SECONDS,
+                 max_bytes: float = HTTP_CACHE_MB * 2**20):
+        self.root = root
+        self.fresh_seconds = fresh_seconds
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(root, "locks"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                blob TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_type TEXT,
+                validated REAL NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0,
+                last_used REAL NOT NULL DEFAULT 0
+            )""")
+        self._migrate()
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        # An entry lives only while some thread holds or waits for its lock
+        self._flight_locks = weakref.WeakValueDictionary()
+        self._flight_guard = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16,
+                              max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504)))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = USER_AGENT
+
+    def _migrate(self):
+        """Indexes written before the byte budget get sizes from their blobs"""
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(responses)")}
+        if "size" in columns:
+            return
+        self._db.execute("ALTER TABLE responses ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("ALTER TABLE responses ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+        for url, digest, validated in self._db.execute("SELECT url, blob, validated FROM responses").fetchall():
+            try:
+                size = os.path.getsize(self._blob_path(digest))
+            except OSError:
+                size = 0
+            self._db.execute("UPDATE responses SET size = ?, last_used = ? WHERE url = ?", (size, validated, url))
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def _read_blob(self, digest: str):
+        try:
+            with open(self._blob_path(digest), "rb") as fh:
+                return fh.read()
+        except OSError:
+            return None
+
+    def _write_blob(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as fh:
+                fh.write(content)
+            os.replace(tmp, path)
+        return digest
+
+    def _lookup(self, url: str):
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT blob, etag, last_modified, content_type, validated, last_used FROM responses WHERE url = ?",
+                (url,)).fetchone()
+
+    def _record(self, url: str, digest: str, size: int, etag, last_modified, content_type):
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (url, blob, etag, last_modified, content_type, validated, "
+                "size, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, digest, etag, last_modified, content_type, now, size, now))
+            self._prune(url)
+            self._db.commit()
+
+    def _prune(self, keep: str):
+        """Drop least recently used entries, and blobs no entry refers to any more, until the blobs fit
+        max_bytes (caller holds _db_lock and commits)"""
+        total = self._db.execute(
+            "SELECT coalesce(sum(size), 0) FROM (SELECT max(size) AS size FROM responses GROUP BY blob)").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        candidates = self._db.execute(
+            "SELECT url, blob, size FROM responses WHERE url != ? AND last_used < ? ORDER BY last_used",
+            (keep, time.time() - PRUNE_GRACE_SECONDS)).fetchall()
+        for url, digest, size in candidates:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            if self._db.execute("SELECT 1 FROM responses WHERE blob = ? LIMIT 1", (digest,)).fetchone():
+                continue  # still served for another URL
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+            total -= size
+
+    def _touch(self, url: str):
+        now = time.time()
+        with self._db_lock:
+            self._db.execute("UPDATE responses SET validated = ?, last_used = ? WHERE url = ?", (now, now, url))
+            self._db.commit()
+
+    def _used(self, url: str, row):
+        """Mark a cache hit for LRU pruning, at most once per USE_RESOLUTION_SECONDS"""
+        now = time.time()
+        if now - row[5] < USE_RESOLUTION_SECONDS:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute("UPDATE responses SET last_used = ? WHERE url = ?", (now, url))
+                self._db.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"HTTP cache index update failed: {str(e)}")
+
+    @contextmanager
+    def _single_flight(self, url: str):
+        """Serialize fetches of one URL across threads (lock) and worker processes (flock)"""
+        with self._flight_guard:
+            lock = self._flight_locks.setdefault(url, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+            with open(os.path.join(self.root, "locks", name), "a") as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _cached(self, url: str, row) -> CachedResponse:
+        content = self._read_blob(row[0])
+        if content is None:
+            return None
+        headers = {"Content-Type": row[3] or ""}
+        if row[1]:
+            headers["ETag"] = row[1]
+        if row[2]:
+            headers["Last-Modified"] = row[2]
+        return CachedResponse(url, 200, content, headers, from_cache=True)
+
+    def fetch(self, url: str, timeout: float = HTTP_TIMEOUT) -> CachedResponse:
+        """GET a URL, serving fresh entries from disk and revalidating stale ones"""
+        with metrics.span("fetch", url=url) as span:
+            resp = self._get(url, timeout)
+            span.update(bytes=len(resp.content), cached=resp.from_cache)
+            return resp
+
+    def _get(self, url: str, timeout: float) -> CachedResponse:
+        row = self._lookup(url)
+        if row and time.time() - row[4] < self.fresh_seconds:
+            cached = self._cached(url, row)
+            if cached:
+                self._used(url, row)
+                return cached
+
+        with self._single_flight(url):
+            # Another thread or worker may have refreshed the entry while we waited
+            row = self._lookup(url)
+            if row and time.time() - row[4] < self.fresh_seconds:
+                cached = self._cached(url, row)
+                if cached:
+                    return cached
+
+            headers = {}
+            if row and self._read_blob(row[0]) is not None:
+                if row[1]:
+                    headers["If-None-Match"] = row[1]
+                if row[2]:
+                    headers["If-Modified-Since"] = row[2]
+
+            try:
+                resp = self.session.get(url, headers=headers, timeout=timeout)
+            except requests.RequestException as e:
+                cached = self._cached(url, row) if row else None
+                if cached:
+                    logging.warning(f"Serving stale cache for {url}: {str(e)}")
+                    return cached
+                raise
+
+            if resp.status_code == 304 and row:
+                self._touch(url)
+                return self._cached(url, row)
+
+            if resp.status_code == 200:
+                digest = self._write_blob(resp.content)
+                self._record(url, digest, len(resp.content), resp.headers.get("ETag"),
+                             resp.headers.get("Last-Modified"), resp.headers.get("Content-Type"))
+
+            return CachedResponse(resp.url, resp.status_code, resp.content, dict(resp.headers), from_cache=False)
+
+    def local_path(self, url: str, timeout: float = HTTP_TIMEOUT) -> str:
+        """Fetch through the cache and return the blob's path, so file readers (DuckDB) can scan it in place"""
+        resp = self.fetch(url, timeout=timeout)
+        if resp.status_code >= 400:
+            raise requests.HTTPError(f"{resp.status_code} error fetching {url}")
+        row = self._lookup(url)
+        digest = row[0] if row and os.path.exists(self._blob_path(row[0])) else self._write_blob(resp.content)
+        return self._blob_path(digest)
+
+_cache = None
+_cache_pid = None
+
+def get_http_cache() -> HttpCache:
+    """Per-process cache instance (re-created after fork so SQLite handles are never shared)"""
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = HttpCache()
+        _cache_pid = os.getpid()
+    return _cache
+
+def fetch(url: str, timeout: float = HTTP_TIMEOUT) -> CachedResponse:
+    return get_http_cache().fetch(url, timeout=timeout)
+
+def _wrap_reader(original, text: bool, compressible: bool):
+    # The path argument's name differs per reader (filepath_or_buffer, path_or_buf, path, io)
+    path_arg = next(iter(inspect.signature(original).parameters))
+
+    @functools.wraps(original)
+    def reader(*args, **kwargs):
+        if args:
+            source, args = args[0], args[1:]
+        elif path_arg in kwargs:
+            source = kwargs.pop(path_arg)
+        else:
+            return original(*args, **kwargs)
+        if is_http_url(source) and not kwargs.get("storage_options"):
+            url = source
+            resp = fetch(url)
+            if resp.status_code >= 400:
+                raise requests.HTTPError(f"{resp.status_code} error fetching {url}")
+            if text:
+                source = io.StringIO(resp.text)
+            else:
+                source = io.BytesIO(resp.content)
+                suffix = os.path.splitext(url.split("?")[0])[1].lower()
+                if suffix in COMPRESSION_BY_SUFFIX and compressible:
+                    kwargs.setdefault("compression", COMPRESSION_BY_SUFFIX[suffix])
+        return original(source, *args, **kwargs)
+    reader.__wrapped_http_cache__ = True
+    return reader
+
+def _wrap_requests_get(original):
+    @functools.wraps(original)
+    def get(url, params=None, **kwargs):
+        # Only plain GETs are cacheable; custom headers (auth, User-Agent), allow_redirects=False
+        # and anything more exotic go straight to the network
+        plain = (not set(kwargs) - {"timeout", "headers", "allow_redirects"} and not kwargs.get("headers")
+                 and kwargs.get("allow_redirects", True))
+        if not plain or not is_http_url(url):
+            return original(url, params=params, **kwargs)
+        full_url = requests.Request("GET", url, params=params).prepare().url
+        return fetch(full_url, timeout=kwargs.get("timeout") or HTTP_TIMEOUT).to_requests()
+    get.__wrapped_http_cache__ = True
+    return get
+
+_installed = False
+
+def install():
+    """Route pandas URL readers and requests.get through the cache (idempotent)"""
+    global _installed
+    if _installed or not HTTP_CACHE_ENABLED:
+        return
+    for name, text, compressible in (("read_csv", False, True), ("read_table", False, True),
+                                     ("read_json", False, True), ("read_parquet", False, False),
+                                     ("read_excel", False, False), ("read_html", True, False)):
+        setattr(pd, name, _wrap_reader(getattr(pd, name), text, compressible))
+    requests.get = _wrap_requests_get(requests.get)
+    _installed = True
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Fit base64 image data URIs into a byte budget without regenerating the plot
+"""
+import io, base64, math, re
+from PIL import Image
+
+MAX_IMAGE_BYTES = 100_000
+MIN_SCALE = 0.25
+PALETTE_SIZES = (256, 64)
+LOSSY_QUALITIES = (80, 50)
+
+DATA_URI_RE = re.compile(r"^data:(image/[a-zA-Z0-9.+-]+);base64,", re.ASCII)
+PIL_FORMATS = {"image/png": "PNG", "image/webp": "WEBP", "image/jpeg": "JPEG", "image/jpg": "JPEG", "image/gif": "GIF"}
+
+def make_data_uri(mime: str, raw: bytes) -> str:
+    return f"data:{mime};base64,{base64.b64encode(raw).decode('ascii')}"
+
+def raw_budget(mime: str, max_bytes: int) -> int:
+    """Largest payload whose data URI (header + base64) stays within max_bytes"""
+    header = len(f"data:{mime};base64,")
+    return max(0, (max_bytes - header) // 4 * 3)
+
+def _encodings(mime: str):
+    """Candidate encoders for one MIME type, from highest to lowest fidelity"""
+    fmt = PIL_FORMATS.get(mime)
+    if fmt == "PNG":
+        yield lambda img: _save(img, "PNG", optimize=True)
+        for colors in PALETTE_SIZES:
+            yield lambda img, colors=colors: _save(
+                img.convert("RGB").quantize(colors=colors, method=Image.Quantize.FASTOCTREE), "PNG", optimize=True)
+    elif fmt == "WEBP":
+        yield lambda img: _save(img, "WEBP", lossless=True, method=4)
+        for quality in LOSSY_QUALITIES:
+            yield lambda img, quality=quality: _save(img, "WEBP", quality=quality, method=4)
+    elif fmt == "JPEG":
+        for quality in LOSSY_QUALITIES:
+            yield lambda img, quality=quality: _save(img.convert("RGB"), "JPEG", quality=quality, optimize=True)
+    elif fmt == "GIF":
+        yield lambda img: _save(img.convert("RGB").quantize(colors=128), "GIF", optimize=True)
+
+def _save(img: Image.Image, fmt: str, **options) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **options)
+    return buf.getvalue()
+
+def _scaled(img: Image.Image, scale: float) -> Image.Image:
+    if scale == 1.0:
+        return img
+    size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+    return img.resize(size, Image.LANCZOS)
+
+def _fit_format(img: Image.Image, mime: str, max_bytes: int):
+    """Try each encoder at full size, then downscale the most compact one by the estimated factor"""
+    budget = raw_budget(mime, max_bytes)
+    smallest = None
+    for encode in _encodings(mime):
+        raw = encode(img)
+        if len(raw) <= budget:
+            return make_data_uri(mime, raw)
+        if smallest is None or len(raw) < smallest[0]:
+            smallest = (len(raw), encode)
+    if smallest is None:
+        return None
+
+    size, encode = smallest
+    scale = 1.0
+    for _ in range(4):
+        # Encoded size scales roughly with pixel count, i.e. with scale squared
+        scale *= math.sqrt(budget / size) * 0.95
+        if scale < MIN_SCALE:
+            return None
+        raw = encode(_scaled(img, scale))
+        if len(raw) <= budget:
+            return make_data_uri(mime, raw)
+        size = len(raw)
+    return None
+
+def fit_image(img: Image.Image, mime: str, max_bytes: int = MAX_IMAGE_BYTES) -> str:
+    """Search encodings and scales for a data URI within budget, preferring the requested MIME"""
+    if mime not in PIL_FORMATS:
+        mime = "image/png"
+    targets = [mime] if mime == "image/webp" else [mime, "image/webp"]
+    for target in targets:
+        uri = _fit_format(img, target, max_bytes)
+        if uri:
+            return uri
+    raise ValueError(f"Image cannot be encoded under {max_bytes / 1000:.0f}KB")
+
+def fit_data_uri(uri: str, max_bytes: int = MAX_IMAGE_BYTES) -> str:
+    """Return uri unchanged if within budget, otherwise a re-encoded copy that fits"""
+    if len(uri) <= max_bytes:
+        return uri
+    match = DATA_URI_RE.match(uri)
+    if not match:
+        raise ValueError("Not a base64 image data URI")
+    raw = base64.b64decode(uri[match.end():])
+    img = Image.open(io.BytesIO(raw))
+    img.load()
+    return fit_image(img, match.group(1).lower(), max_bytes)
+
+def fit_images(obj, max_bytes: int = MAX_IMAGE_BYTES):
+    """Walk a sanitized result and shrink any oversized image data URIs in place"""
+    if isinstance(obj, str):
+        if obj.startswith("data:image/") and len(obj) > max_bytes:
+            return fit_data_uri(obj, max_bytes)
+        return obj
+    if isinstance(obj, list):
+        return [fit_images(x, max_bytes) for x in obj]
+    if isinstance(obj, dict):
+        return {k: fit_images(v, max_bytes) for k, v in obj.items()}
+    return obj
+
+def to_data_uri(fig=None, max_bytes: int = MAX_IMAGE_BYTES, mime: str = "image/png", dpi: int = 80) -> str:
+    """Render a matplotlib figure once and return a data URI within max_bytes"""
+    if fig is None:
+        import matplotlib.pyplot as plt
+        fig = plt.gcf()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=dpi)
+    raw = buf.getvalue()
+    if mime == "image/png" and len(raw) <= raw_budget(mime, max_bytes):
+        return make_data_uri(mime, raw)
+    img = Image.open(io.BytesIO(raw))
+    img.load()
+    return fit_image(img, mime, max_bytes)
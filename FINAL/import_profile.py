@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Cold-import profile of the agent (python -X importtime) with an optional baseline check
+"""
+import os, sys, json, re, subprocess
+
+IMPORT_BASELINE = os.getenv("AGENT_IMPORT_BASELINE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_baseline.json"))
+IMPORT_TOLERANCE = float(os.getenv("AGENT_IMPORT_TOLERANCE", "0.25"))
+IMPORT_RUNS = int(os.getenv("AGENT_IMPORT_RUNS", "3"))
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def _run_once(module: str) -> dict:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {proc.stderr.strip().splitlines()[-1:]}")
+    modules = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), match[3], match[4]
+        modules[name] = {"self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+        if len(indent) == 1:
+            total_us += cumulative_us
+    return {"total_ms": total_us / 1000, "modules": modules}
+
+def profile(module: str = "data_analyst_agent", runs: int = IMPORT_RUNS, top: int = 15) -> dict:
+    """Best-of-N cold import time plus the modules with the largest cumulative cost"""
+    best = min((_run_once(module) for _ in range(max(runs, 1))), key=lambda r: r["total_ms"])
+    top_modules = sorted(best["modules"].items(), key=lambda kv: kv[1]["cumulative_ms"], reverse=True)[:top]
+    return {"module": module, "total_ms": round(best["total_ms"], 1),
+            "top": [{"name": name, **{k: round(v, 1) for k, v in times.items()}} for name, times in top_modules]}
+
+def compare(report: dict, baseline_path: str = IMPORT_BASELINE, tolerance: float = IMPORT_TOLERANCE) -> bool:
+    """False when the import got slower than the recorded baseline by more than the tolerance"""
+    if not os.path.exists(baseline_path):
+        print(f"No import baseline at {baseline_path}; run with --record-baseline first", file=sys.stderr)
+        return True
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    limit = baseline["total_ms"] * (1 + tolerance)
+    report["baseline_ms"] = baseline["total_ms"]
+    report["regression"] = report["total_ms"] > limit
+    return not report["regression"]
+
+def record(report: dict, baseline_path: str = IMPORT_BASELINE):
+    with open(baseline_path, "w") as f:
+        json.dump({"module": report["module"], "total_ms": report["total_ms"]}, f, indent=2)
+
+def run(record_baseline: bool = False, tolerance: float = IMPORT_TOLERANCE) -> int:
+    """CLI entry point: print the profile, record or check the baseline, return an exit code"""
+    report = profile()
+    if record_baseline:
+        record(report)
+        ok = True
+    else:
+        ok = compare(report, tolerance=tolerance)
+    print(json.dumps(report, indent=2))
+    if not ok:
+        print(f"Import time regressed: {report['total_ms']:.0f}ms vs baseline {report['baseline_ms']:.0f}ms "
+              f"(tolerance {tolerance:.0%})", file=sys.stderr)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(run(record_baseline="--record-baseline" in sys.argv))
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Job store and bounded-admission scheduler in front of the worker pool
+"""
+import os, asyncio, json, logging, shutil, time, uuid
+
+from worker_pool import WorkerPool, WorkerCrashed
+import metrics
+import profiling
+import batch
+
+MAX_QUEUED_JOBS = int(os.getenv("AGENT_MAX_QUEUED_JOBS", "32"))
+JOB_RESULT_TTL = float(os.getenv("AGENT_JOB_RESULT_TTL", "900"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+
+class QueueFull(RuntimeError):
+    """Raised when the admission queue cannot take another job"""
+
+class Job:
+    def __init__(self, task: str, files=None, spool: str = None, stream: bool = False, profile: str = None):
+        self.id = uuid.uuid4().hex
+        self.task = task
+        self.files = files or []
+        self.spool = spool
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.http_status = None
+        self.label = None  # outcome label once finished (llm, cached, template, fallback, failed, ...)
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.spans = []
+        self.done = asyncio.Event()
+        # Progress events from the worker (stage changes, early answers) for a streaming client
+        self.events = asyncio.Queue() if stream else None
+        self.profile = profile  # None, "basic" or "sample": executions record a resource profile
+        self._run = None
+
+    @property
+    def finished_ok(self) -> bool:
+        return self.status == SUCCEEDED
+
+    def _finish(self, status: str, result=None, error: str = None, http_status: int = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.http_status = http_status
+        self.finished = time.time()
+        if self.spool:
+            shutil.rmtree(self.spool, ignore_errors=True)
+        self.done.set()
+
+    def server_timing(self) -> str:
+        total = self.finished - self.started if self.finished and self.started else None
+        return metrics.server_timing(self.spans, total)
+
+    def to_json(self) -> bytes:
+        """Status document; a finished result's pre-serialized bytes are spliced in, not re-encoded"""
+        info = {"id": self.id, "status": self.status, "created": self.created,
+                "started": self.started, "finished": self.finished}
+        if self.error:
+            info["error"] = self.error
+        if self.spans:
+            info["timings"] = {stage: round(seconds, 4) for stage, seconds in metrics.stage_totals(self.spans).items()}
+        if self.profile and self.spans:
+            info["debug"] = self.debug()
+        body = json.dumps(info).encode("utf-8")
+        if self.status == SUCCEEDED:
+            body = body[:-1] + b', "result": ' + self.result_bytes() + b"}"
+        return body
+
+    def result_bytes(self) -> bytes:
+        return self.result.data
+
+    def debug(self) -> dict:
+        return profiling.debug_block(self.spans)
+
+    def timeout(self, pool: WorkerPool) -> float:
+        """Seconds this job may run on the pool"""
+        return pool.timeout
+
+    def submit_to(self, pool: WorkerPool):
+        on_event = None
+        if self.events is not None:
+            loop = asyncio.get_running_loop()
+            on_event = lambda event: loop.call_soon_threadsafe(self.events.put_nowait, event)
+        return pool.submit(self.task, timeout=self.timeout(pool), files=self.files, on_event=on_event,
+                           profile=self.profile)
+
+    def complete(self, outcome: dict):
+        """Finish from the worker's outcome; returns the metrics label, or None if already recorded"""
+        self.spans = outcome.get("spans", [])
+        if not outcome["success"]:
+            self._finish(FAILED, error=f"Agent failed: {outcome['error']}", http_status=500)
+            return "failed"
+        self._finish(SUCCEEDED, result=outcome["result"])
+        return outcome_label(outcome)
+
+class BatchJob(Job):
+    """Related questions run together on one worker; result is one outcome per question"""
+
+    def __init__(self, questions: list, files=None, spool: str = None, combined: bool = False):
+        super().__init__("\n\n".join(task for _, task in questions), files, spool)
+        self.questions = questions
+        self.combined = combined
+
+    def timeout(self, pool: WorkerPool) -> float:
+        return pool.timeout * len(self.questions)
+
+    def submit_to(self, pool: WorkerPool):
+        return pool.submit_batch([task for _, task in self.questions], timeout=self.timeout(pool), files=self.files,
+                                 combined=self.combined)
+
+    def complete(self, outcome: dict):
+        outcomes = outcome.get("outcomes")
+        if outcomes is None:
+            return super().complete(outcome)
+        self.spans = [s for o in outcomes for s in o.get("spans", [])]
+        for o in outcomes:
+            metrics.observe_task(outcome_label(o), o.get("seconds", 0.0), o.get("spans", []))
+        self._finish(SUCCEEDED, result=outcomes)
+        return None
+
+    def entries(self) -> list:
+        """Per-question response entries, in question order"""
+        if self.status == SUCCEEDED:
+            return [batch.entry(name, o) for (name, _), o in zip(self.questions, self.result)]
+        return [batch.entry(name, error=self.error) for name, _ in self.questions]
+
+    def result_bytes(self) -> bytes:
+        return batch.response(self.entries())
+
+def outcome_label(outcome: dict) -> str:
+    """Metrics label for a worker outcome"""
+    if not outcome.get("success"):
+        return "failed"
+    if outcome.get("fallback"):
+        return "fallback"
+    if outcome.get("template"):
+        return "template"
+    return "cached" if outcome.get("cached") else "llm"
+
+class JobScheduler:
+    """Admits jobs into a bounded queue and runs at most pool.size of them at a time"""
+
+    def __init__(self, pool: WorkerPool, max_queued: int = MAX_QUEUED_JOBS, result_ttl: float = JOB_RESULT_TTL):
+        self.pool = pool
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._jobs = {}
+        self._queue = None
+        self._dispatchers = []
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.pool.size)]
+
+    async def close(self):
+        for job in list(self._jobs.values()):
+            self.cancel(job.id)
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def submit(self, task: str, files=None, spool: str = None, stream: bool = False, profile: str = None) -> Job:
+        """Admit a job or raise QueueFull (backpressure); with stream, progress events fill job.events,
+        and with profile its executions are profiled"""
+        return self._admit(Job(task, files, spool, stream, profile))
+
+    def submit_batch(self, questions: list, files=None, spool: str = None, combined: bool = False) -> BatchJob:
+        """Admit a group of (name, task) questions that will share one worker"""
+        return self._admit(BatchJob(questions, files, spool, combined))
+
+    def _admit(self, job: Job) -> Job:
+        self._prune()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFull(f"{self.max_queued} jobs already queued")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        """Cancel a queued or running job; running jobs lose their worker"""
+        job = self._jobs.get(job_id)
+        if job is None or job.done.is_set():
+            return job
+        if job._run is not None:
+            job._run.cancel()
+        else:
+            job._finish(CANCELLED, error="Cancelled before start")
+        return job
+
+    async def _run_job(self, job: Job):
+        job.status = RUNNING
+        job.started = time.time()
+        job._run = asyncio.create_task(job.submit_to(self.pool))
+        # asyncio.wait does not propagate the job's own cancellation into the dispatcher
+        await asyncio.wait({job._run})
+        label = job.label = self._settle(job)
+        if label:
+            metrics.observe_task(label, job.finished - job.started, job.spans)
+        if job.profile:
+            profiling.statements.add(job.spans)
+
+    def _settle(self, job: Job) -> str:
+        """Finish a job from its run task and return its outcome label for metrics"""
+        if job._run.cancelled():
+            job._finish(CANCELLED, error="Cancelled while running")
+            return "cancelled"
+        try:
+            outcome = job._run.result()
+        except TimeoutError:
+            job._finish(FAILED, error=f"Processing timeout ({job.timeout(self.pool):.0f}s reached)", http_status=504)
+            return "timeout"
+        except WorkerCrashed as e:
+            job._finish(FAILED, error=f"Agent crashed: {e}", http_status=500)
+            return "crashed"
+        except Exception as e:
+            logging.error(f"Job {job.id} failed: {str(e)}")
+            job._finish(FAILED, error=f"Agent failed: {str(e)}", http_status=500)
+            return "failed"
+
+        return job.complete(outcome)
+
+    async def _dispatch(self):
+        while True:
+            job = await self._queue.get()
+            if job.done.is_set():
+                continue
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                if job._run is not None:
+                    job._run.cancel()
+                raise
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Lazy module proxies so heavy libraries are imported on first attribute access
+"""
+import importlib, threading, types
+
+class LazyModule(types.ModuleType):
+    """Stands in for a module until something touches one of its attributes"""
+
+    def __init__(self, name: str, setup=None):
+        super().__init__(name)
+        self.__dict__["_lazy_name"] = name
+        self.__dict__["_lazy_setup"] = setup
+        self.__dict__["_lazy_module"] = None
+        self.__dict__["_lazy_lock"] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            with self.__dict__["_lazy_lock"]:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    setup = self.__dict__["_lazy_setup"]
+                    if setup:
+                        setup()
+                    module = importlib.import_module(self.__dict__["_lazy_name"])
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    @property
+    def loaded(self) -> bool:
+        return self.__dict__["_lazy_module"] is not None
+
+    def __getattr__(self, item):
+        return getattr(self._load(), item)
+
+    def __setattr__(self, item, value):
+        setattr(self._load(), item, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module '{self.__dict__['_lazy_name']}' ({state})>"
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use("Agg")
+
+duckdb = LazyModule("duckdb")
+plt = LazyModule("matplotlib.pyplot", setup=_use_agg)
+sns = LazyModule("seaborn", setup=_use_agg)
+stats = LazyModule("scipy.stats")
+genai = LazyModule("google.generativeai")
+lxml_html = LazyModule("lxml.html")
+
+HEAVY_MODULES = ("duckdb", "matplotlib.pyplot", "seaborn", "scipy.stats", "google.generativeai", "lxml.html")
+
+def preload():
+    """Import every heavy module now (warm pool workers want this, CLI runs do not)"""
+    for module in (duckdb, plt, sns, stats, genai, lxml_html):
+        module._load()
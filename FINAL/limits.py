@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Process-shared concurrency caps for Gemini calls and code execution, and a shared token-bucket
+rate limiter with backoff for Gemini requests and tokens
+"""
+import os, re, asyncio, contextvars, logging, random, threading, time
+from contextlib import asynccontextmanager, contextmanager
+import metrics
+
+MAX_CONCURRENT_LLM = int(os.getenv("AGENT_MAX_CONCURRENT_LLM", "4"))
+MAX_CONCURRENT_EXECUTIONS = int(os.getenv("AGENT_MAX_CONCURRENT_EXECUTIONS", "2"))
+LLM_RATE_LIMIT = os.getenv("AGENT_LLM_RATE_LIMIT", "1") != "0"
+LLM_RPM = float(os.getenv("AGENT_LLM_RPM", "60"))  # 0 = no request budget
+LLM_TPM = float(os.getenv("AGENT_LLM_TPM", "1000000"))  # 0 = no token budget
+LLM_BURST = float(os.getenv("AGENT_LLM_BURST", "0"))  # request bucket size; 0 = a full minute of LLM_RPM
+LLM_BACKOFF_BASE = float(os.getenv("AGENT_LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("AGENT_LLM_BACKOFF_MAX", "60"))
+LLM_MAX_THROTTLED_RETRIES = int(os.getenv("AGENT_LLM_MAX_THROTTLED_RETRIES", "6"))
+LLM_PRIORITY_YIELD = float(os.getenv("AGENT_LLM_PRIORITY_YIELD", "5"))
+
+SLOTS = ("llm", "execution")
+LANES = ("normal", "priority")
+
+_semaphores = {}
+_held = None
+_held_lock = threading.Lock()
+_limiter = None
+_limiter_lock = threading.Lock()
+_priority = contextvars.ContextVar("llm_priority", default=False)
+
+def create(ctx, max_llm: int = MAX_CONCURRENT_LLM, max_executions: int = MAX_CONCURRENT_EXECUTIONS) -> dict:
+    """Build semaphores and the rate limiter in the parent so every pool worker shares the same slots and budget"""
+    global _limiter
+    # The parent keeps a handle on the shared limiter for /metrics
+    _limiter = RateLimiter(ctx)
+    return {
+        "llm": ctx.BoundedSemaphore(max_llm),
+        "execution": ctx.BoundedSemaphore(max_executions),
+        "rate": _limiter,
+    }
+
+def held_counter(ctx):
+    """Per-worker shared counters of slots held and rate-limit waits queued, so a killed worker's share can be returned"""
+    # No cross-process lock: only the owning worker writes, and a lock held by a
+    # killed worker would deadlock the parent in release_held()
+    return ctx.Array("i", len(SLOTS) + len(LANES), lock=False)
+
+def configure(semaphores: dict, held=None):
+    """Install the shared semaphores and rate limiter in a worker process"""
+    global _held, _limiter
+    _semaphores.clear()
+    _semaphores.update({name: sem for name, sem in (semaphores or {}).items() if name in SLOTS})
+    _limiter = (semaphores or {}).get("rate") or _limiter
+    _held = held
+
+def release_held(semaphores: dict, held):
+    """Return the slots a dead worker was holding and drop its queued rate-limit waits"""
+    if not semaphores or held is None:
+        return
+    for i, name in enumerate(SLOTS):
+        for _ in range(held[i]):
+            try:
+                semaphores[name].release()
+            except ValueError:
+                break
+        held[i] = 0
+    limiter = semaphores.get("rate")
+    for i, lane in enumerate(LANES, start=len(SLOTS)):
+        if limiter is not None and held[i]:
+            limiter.leave(lane == "priority", held[i])
+        held[i] = 0
+
+@asynccontextmanager
+async def _slot(name: str):
+    sem = _semaphores.get(name)
+    if sem is None:
+        yield
+        return
+    await asyncio.to_thread(sem.acquire)
+    index = SLOTS.index(name)
+    if _held is not None:
+        with _held_lock:
+            _held[index] += 1
+    try:
+        yield
+    finally:
+        if _held is not None:
+            with _held_lock:
+                _held[index] -= 1
+        sem.release()
+
+def llm_slot():
+    return _slot("llm")
+
+def execution_slot():
+    return _slot("execution")
+
+# --- Gemini rate limiting ---
+
+def throttle_hint(exc):
+    """Seconds the server asked to wait when exc is a rate-limit error (0.0 without a hint), else None"""
+    code = getattr(exc, "code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    try:
+        code = int(code)
+    except (TypeError, ValueError):
+        code = None
+    text = str(exc)
+    if code != 429 and type(exc).__name__ not in ("ResourceExhausted", "TooManyRequests") and \
+            not re.search(r"\b429\b|rate limit|quota exceeded|resource has been exhausted", text, re.IGNORECASE):
+        return None
+    hint = getattr(exc, "retry_after", None)
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    if hint is None and headers.get("Retry-After"):
+        hint = headers["Retry-After"]
+    if hint is None:
+        # Gemini: "Please retry in 17.3s." and retry_delay { seconds: 17 } in the error details
+        found = re.search(r"retry(?:[ _-]?(?:in|after|delay))\W*(?:seconds:\s*)?(\d+(?:\.\d+)?)", text, re.IGNORECASE)
+        hint = found.group(1) if found else None
+    try:
+        return max(0.0, float(hint)) if hint is not None else 0.0
+    except ValueError:
+        return 0.0
+
+def backoff_delay(attempt: int, base: float = LLM_BACKOFF_BASE, cap: float = LLM_BACKOFF_MAX) -> float:
+    """Exponential backoff with equal jitter, so callers that failed together do not retry together"""
+    ceiling = min(cap, base * 2 ** attempt)
+    return random.uniform(ceiling / 2, ceiling)
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute plus a backoff deadline set by rate-limit
+    errors; built from a multiprocessing context, the state lives in shared memory so every pool
+    worker draws from the same budget"""
+
+    REQUESTS, TOKENS, REFILLED, BLOCKED_UNTIL, STREAK, WAITING, WAITING_PRIORITY = range(7)
+
+    def __init__(self, ctx=None, rpm: float = LLM_RPM, tpm: float = LLM_TPM, burst: float = LLM_BURST,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst = burst or rpm
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        initial = [self.burst, tpm, time.time(), 0.0, 0.0, 0.0, 0.0]
+        if ctx is not None:
+            self._state = ctx.Array("d", initial, lock=False)
+            self._lock = ctx.Lock()
+        else:
+            self._state = initial
+            self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        # A worker killed inside this (microseconds long) section would hold the lock forever;
+        # time out and let the call through unlimited rather than stall every worker
+        if not self._lock.acquire(timeout=1):
+            logging.warning("Rate limiter lock unavailable, proceeding without a budget check")
+            yield None
+            return
+        try:
+            yield self._state
+        finally:
+            self._lock.release()
+
+    def _refill(self, s, now: float):
+        elapsed = max(0.0, now - s[self.REFILLED])
+        if self.rpm > 0:
+            s[self.REQUESTS] = min(self.burst, s[self.REQUESTS] + elapsed * self.rpm / 60)
+        if self.tpm > 0:
+            s[self.TOKENS] = min(self.tpm, s[self.TOKENS] + elapsed * self.tpm / 60)
+        s[self.REFILLED] = now
+
+    def enter(self, priority: bool = False):
+        with self._locked() as s:
+            if s is not None:
+                s[self.WAITING_PRIORITY if priority else self.WAITING] += 1
+
+    def leave(self, priority: bool = False, count: int = 1):
+        with self._locked() as s:
+            if s is not None:
+                field = self.WAITING_PRIORITY if priority else self.WAITING
+                s[field] = max(0.0, s[field] - count)
+
+    def try_acquire(self, tokens: float = 0, priority: bool = False, waited: float = 0.0) -> float:
+        """Take one request and `tokens` from the buckets; 0.0 when granted, else seconds to wait first.
+        Normal calls step aside while priority calls are queued, for at most LLM_PRIORITY_YIELD seconds"""
+        tokens = min(tokens, self.tpm) if self.tpm > 0 else 0
+        with self._locked() as s:
+            if s is None:
+                return 0.0
+            now = time.time()
+            self._refill(s, now)
+            if s[self.BLOCKED_UNTIL] > now:
+                return s[self.BLOCKED_UNTIL] - now
+            if not priority and s[self.WAITING_PRIORITY] > 0 and waited < LLM_PRIORITY_YIELD:
+                return 0.05
+            short = max((1 - s[self.REQUESTS]) * 60 / self.rpm if self.rpm > 0 else 0.0,
+                        (tokens - s[self.TOKENS]) * 60 / self.tpm if self.tpm > 0 else 0.0)
+            if short > 0:
+                return short
+            if self.rpm > 0:
+                s[self.REQUESTS] -= 1
+            s[self.TOKENS] -= tokens
+            return 0.0
+
+    def acquire(self, tokens: float = 0, priority: bool = False) -> float:
+        """Blocking try_acquire loop; returns the seconds waited"""
+        start = time.time()
+        self.enter(priority)
+        try:
+            while True:
+                wait = self.try_acquire(tokens, priority, time.time() - start)
+                if wait <= 0:
+                    return time.time() - start
+                time.sleep(min(wait, 1.0) + random.uniform(0, 0.05))
+        finally:
+            self.leave(priority)
+
+    def settle(self, reserved: float, used: float):
+        """Return (or charge) the difference between the tokens reserved and those actually used"""
+        if self.tpm <= 0:
+            return
+        with self._locked() as s:
+            if s is not None:
+                s[self.TOKENS] = min(self.tpm, s[self.TOKENS] + reserved - used)
+
+    def throttled(self, hint: float = 0.0) -> float:
+        """Record a rate-limit error: every caller waits out the server's hint (or an exponential
+        backoff after repeated errors) plus jitter; returns the delay chosen"""
+        with self._locked() as s:
+            if s is None:
+                return 0.0
+            s[self.STREAK] += 1
+            ceiling = min(self.backoff_max, self.backoff_base * 2 ** (s[self.STREAK] - 1))
+            delay = max(hint or 0.0, ceiling / 2) + random.uniform(0, ceiling / 2)
+            now = time.time()
+            s[self.BLOCKED_UNTIL] = max(s[self.BLOCKED_UNTIL], now + delay)
+            # The server says the budget is spent: resume at the steady rate, not with a burst
+            s[self.REQUESTS] = min(s[self.REQUESTS], 0.0)
+            return delay
+
+    def succeeded(self):
+        with self._locked() as s:
+            if s is not None and s[self.STREAK]:
+                s[self.STREAK] = 0.0
+
+    def depth(self) -> dict:
+        return {"normal": int(self._state[self.WAITING]), "priority": int(self._state[self.WAITING_PRIORITY])}
+
+    def budget(self) -> dict:
+        return {"requests": self._state[self.REQUESTS], "tokens": self._state[self.TOKENS],
+                "blocked_seconds": max(0.0, self._state[self.BLOCKED_UNTIL] - time.time())}
+
+def rate_limiter() -> RateLimiter:
+    """The pool-wide limiter in workers; a process-local one elsewhere (CLI, tests)"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
+
+@contextmanager
+def priority_lane(enabled: bool = True):
+    """Gemini calls made inside (including tasks started inside) jump the rate-limit queue; used for self-correction"""
+    token = _priority.set(_priority.get() or enabled)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def _count_wait(lane: str, delta: int):
+    if _held is not None:
+        with _held_lock:
+            _held[len(SLOTS) + LANES.index(lane)] += delta
+
+@asynccontextmanager
+async def llm_rate(tokens: float = 0, priority: bool = False):
+    """Wait for request and token budget, then run one Gemini call. The yielded dict takes the tokens
+    actually used ("used"); a rate-limit error raised inside pushes back every worker's next call"""
+    call = {"reserved": tokens, "used": None}
+    if not LLM_RATE_LIMIT:
+        yield call
+        return
+    limiter = rate_limiter()
+    priority = priority or _priority.get()
+    lane = LANES[priority]
+    with metrics.span("llm_wait", lane=lane) as span:
+        start = time.time()
+        limiter.enter(priority)
+        _count_wait(lane, 1)
+        try:
+            while True:
+                wait = limiter.try_acquire(tokens, priority, time.time() - start)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(min(wait, 1.0) + random.uniform(0, 0.05))
+        finally:
+            limiter.leave(priority)
+            _count_wait(lane, -1)
+    try:
+        yield call
+    except Exception as e:
+        hint = throttle_hint(e)
+        if hint is not None:
+            call["backoff"] = limiter.throttled(hint)
+            logging.warning(f"Gemini rate limit hit; all workers back off {call['backoff']:.1f}s (server hint {hint:.1f}s)")
+        raise
+    else:
+        limiter.succeeded()
+    finally:
+        limiter.settle(tokens, tokens if call["used"] is None else call["used"])
+
+def _queue_depth():
+    limiter = _limiter
+    return {(lane,): count for lane, count in limiter.depth().items()} if limiter is not None else {}
+
+def _budget():
+    limiter = _limiter
+    return {(kind,): round(value, 3) for kind, value in limiter.budget().items()} if limiter is not None else {}
+
+LLM_QUEUE_DEPTH = metrics.Gauge("agent_llm_queue_depth", "Gemini calls waiting for rate-limit budget", ("lane",),
+                                collect=_queue_depth)
+LLM_RATE_BUDGET = metrics.Gauge("agent_llm_rate_budget", "Requests and tokens left in the shared buckets, and seconds of backoff left",
+                                ("kind",), collect=_budget)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Streaming code generation: model output is checked as it arrives and abandoned as soon as it
+cannot become a runnable program
+"""
+import ast, codeop, re, warnings
+
+PREAMBLE_LINES = 3  # lines of chatter tolerated before an opening ``` fence shows up
+
+_FENCE = re.compile(r"^[ \t]*```[\w+-]*[ \t]*$", re.MULTILINE)
+
+class RejectedOutput(ValueError):
+    """Model output that is not a usable program; reason is a short label for logs and metrics"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+def _finish_reason(chunk):
+    candidates = getattr(chunk, "candidates", None) or []
+    reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+    return getattr(reason, "name", reason)
+
+def _chunk_text(chunk) -> str:
+    try:
+        return chunk.text or ""
+    except ValueError:  # the SDK raises when a chunk has no parts (e.g. blocked by safety filters)
+        return ""
+
+def token_counts(resp) -> dict:
+    """Prompt/completion token counts from a Gemini response or chunk (zeros when the SDK omits usage)"""
+    usage = getattr(resp, "usage_metadata", None)
+    return {"prompt_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+            "completion_tokens": getattr(usage, "candidates_token_count", 0) or 0}
+
+def assigns_result(tree) -> bool:
+    return any(isinstance(node, ast.Name) and node.id == "result" and isinstance(node.ctx, ast.Store)
+               for node in ast.walk(tree))
+
+class CodeStream:
+    """Accumulates streamed text; feed() raises RejectedOutput once the text is clearly not code"""
+
+    def __init__(self):
+        self.raw = ""
+        self.closed = False  # a closing fence arrived; anything after it is ignored
+        self._checked = 0
+
+    def code(self) -> str:
+        """The program so far: text inside the first fenced block, or everything when unfenced"""
+        fences = list(_FENCE.finditer(self.raw))
+        if not fences:
+            return self.raw
+        start = fences[0].end() + 1
+        end = fences[1].start() if len(fences) > 1 else len(self.raw)
+        return self.raw[start:end]
+
+    def feed(self, text: str) -> bool:
+        """Add a chunk and compile the complete lines received so far; True once the code block closed"""
+        self.raw += text
+        fences = _FENCE.findall(self.raw)
+        self.closed = len(fences) > 1
+        code = self.code()
+        complete = code if self.closed else code[:code.rfind("\n") + 1]
+        if len(complete) <= self._checked:
+            return self.closed
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                codeop.compile_command(complete, "<generated>", "exec")
+        except SyntaxError as e:
+            if not fences and complete.count("\n") < PREAMBLE_LINES:
+                return False  # maybe a sentence before a fenced block; wait for more lines
+            reason = "prose" if (e.lineno or 1) == 1 else "syntax"
+            raise RejectedOutput(reason, f"Generated code is not valid Python ({e.msg}, line {e.lineno})")
+        self._checked = len(complete)
+        return self.closed
+
+    def finish(self, finish_reason=None) -> str:
+        """Final checks once the stream ends; returns the program"""
+        if finish_reason == "MAX_TOKENS":
+            raise RejectedOutput("truncated", "Generation stopped at max_output_tokens")
+        if finish_reason not in (None, "STOP", "FINISH_REASON_UNSPECIFIED"):
+            raise RejectedOutput("blocked", f"Generation ended with finish reason {finish_reason}")
+        return validate(self.code())
+
+def validate(code: str) -> str:
+    """A complete program that parses and assigns `result`, stripped; RejectedOutput otherwise"""
+    code = code.strip()
+    if not code:
+        raise RejectedOutput("empty", "Model returned no code")
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            tree = ast.parse(code)
+    except SyntaxError as e:
+        try:
+            incomplete = codeop.compile_command(code + "\n", "<generated>", "exec") is None
+        except SyntaxError:
+            incomplete = False
+        raise RejectedOutput("truncated" if incomplete else "syntax",
+                             f"Generated code is not valid Python ({e.msg}, line {e.lineno})")
+    if not assigns_result(tree):
+        raise RejectedOutput("no_result", "Generated code never assigns `result`")
+    return code
+
+def split_programs(code: str, marker: str) -> dict:
+    """{question number: program} from one reply holding several programs, each introduced by
+    marker.format(n=...) on a line of its own; programs that fail validate() are left out"""
+    pattern = re.compile("^" + re.escape(marker).replace(re.escape("{n}"), r"(\d+)") + r"[ \t]*$", re.MULTILINE)
+    heads = list(pattern.finditer(code))
+    programs = {}
+    for i, head in enumerate(heads):
+        end = heads[i + 1].start() if i + 1 < len(heads) else len(code)
+        try:
+            programs[int(head.group(1))] = validate(code[head.end():end])
+        except RejectedOutput:
+            continue
+    return programs
+
+def stream_code(model, prompt: str, generation_config: dict, stats: dict = None) -> str:
+    """Stream a completion, validating incrementally; stats (if given) receives chunk and usage counts"""
+    stream = CodeStream()
+    stats = {} if stats is None else stats
+    stats["chunks"] = 0
+    finish = last = None
+    response = model.generate_content(prompt, generation_config=generation_config, stream=True)
+    try:
+        for chunk in response:
+            last = chunk
+            stats["chunks"] += 1
+            finish = _finish_reason(chunk) or finish
+            if stream.feed(_chunk_text(chunk)):
+                finish = None  # the fenced block is complete; trailing prose does not matter
+                break
+    finally:
+        # Usage is cumulative per chunk, so the last one seen is what an aborted stream cost
+        stats.update(token_counts(last))
+    return stream.finish(finish)
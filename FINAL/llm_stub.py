@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Deterministic Gemini stand-in that replays recorded code (offline benchmarks and load tests)
+"""
+import os, json, time, itertools, threading
+from functools import lru_cache
+import requests
+
+LLM_STUB_LATENCY = float(os.getenv("AGENT_LLM_STUB_LATENCY", "0"))
+LLM_STUB_CHUNK_CHARS = int(os.getenv("AGENT_LLM_STUB_CHUNK_CHARS", "200"))
+LLM_STUB_ENDPOINT = os.getenv("AGENT_LLM_STUB_ENDPOINT")  # quota server asked before every reply (rate-limit tests)
+
+class StubRateLimited(Exception):
+    """Shaped like the SDK's ResourceExhausted: code 429 and a retry hint in the message"""
+    code = 429
+
+    def __init__(self, retry_after: float = None):
+        hint = f" Please retry in {retry_after:.1f}s." if retry_after is not None else ""
+        super().__init__(f"429 Resource has been exhausted (e.g. check quota).{hint}")
+        self.retry_after = retry_after
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = completion_tokens
+
+class _FinishReason:
+    def __init__(self, name: str):
+        self.name = name
+
+class _Candidate:
+    def __init__(self, finish_reason):
+        self.finish_reason = _FinishReason(finish_reason) if finish_reason else None
+
+class StubResponse:
+    def __init__(self, text: str, prompt: str, finish_reason: str = "STOP"):
+        self.text = text
+        self.candidates = [_Candidate(finish_reason)]
+        # Rough 4-characters-per-token estimate so token metrics stay meaningful offline
+        self.usage_metadata = _Usage(len(prompt) // 4, len(text) // 4)
+
+@lru_cache(maxsize=4)
+def load_recordings(path: str) -> list:
+    """[{"match": substring of the prompt, "code": program or list of successive replies,
+    "latency": optional seconds, "finish_reason": optional (e.g. MAX_TOKENS),
+    "model": optional substring of the model name the recording is limited to}, ...]"""
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+class StubModel:
+    """Answers with the first recording whose `match` occurs in the prompt (and whose `model`, if any,
+    occurs in this model's name), after a fixed delay; with stream=True the reply arrives in chunks
+    with the delay spread across them"""
+
+    def __init__(self, recordings_path: str, latency: float = LLM_STUB_LATENCY, chunk_chars: int = LLM_STUB_CHUNK_CHARS,
+                 endpoint: str = LLM_STUB_ENDPOINT, model: str = ""):
+        self.recordings = load_recordings(recordings_path)
+        self.model = model
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.endpoint = endpoint
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _reply(self, prompt: str):
+        for i, recording in enumerate(self.recordings):
+            if recording["match"] in prompt and recording.get("model", "") in self.model:
+                replies = recording["code"] if isinstance(recording["code"], list) else [recording["code"]]
+                with self._lock:
+                    n = self._calls.setdefault(i, itertools.count())
+                    text = replies[min(next(n), len(replies) - 1)]
+                return recording, text
+        raise RuntimeError("No recorded response for this prompt")
+
+    def _admit(self, prompt: str):
+        """Ask the quota endpoint for this call; a 429 becomes StubRateLimited with its Retry-After"""
+        resp = requests.post(self.endpoint, json={"tokens": len(prompt) // 4}, timeout=10)
+        if resp.status_code == 429:
+            retry_after = resp.headers.get("Retry-After")
+            raise StubRateLimited(float(retry_after) if retry_after else None)
+        resp.raise_for_status()
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        if self.endpoint:
+            self._admit(prompt)
+        recording, text = self._reply(prompt)
+        latency = recording.get("latency", self.latency)
+        finish = recording.get("finish_reason", "STOP")
+        if not stream:
+            time.sleep(latency)
+            return StubResponse(text, prompt, finish)
+        return self._stream(text, prompt, latency, finish)
+
+    def _stream(self, text: str, prompt: str, latency: float, finish: str):
+        pieces = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or [""]
+        for i, piece in enumerate(pieces):
+            time.sleep(latency / len(pieces))
+            last = i == len(pieces) - 1
+            chunk = StubResponse(piece, prompt, finish if last else None)
+            chunk.usage_metadata = _Usage(len(prompt) // 4, len("".join(pieces[:i + 1])) // 4)
+            yield chunk
@@ -1,52 +1,262 @@
 #!/usr/bin/env python3
-import os
-import subprocess
-import json
-import tempfile
+import os, asyncio, json
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 
-app = FastAPI()
+from worker_pool import WorkerPool
+from jobs import JobScheduler, QueueFull
+import metrics
+import attachments
+import batch
+import response_cache
+import profiling
+
+STREAM_HEARTBEAT = float(os.getenv("AGENT_STREAM_HEARTBEAT", "15"))
+
+pool = WorkerPool()
+scheduler = JobScheduler(pool)
+
+@asynccontextmanager
+async def lifespan(app):
+    attachments.purge_spool()
+    await pool.start()
+    await scheduler.start()
+    try:
+        yield
+    finally:
+        await scheduler.close()
+        await pool.close()
+
+app = FastAPI(lifespan=lifespan)
+
+async def receive_question(request: Request):
+    """Stream the question and any data files to a spool directory; returns (upload, question text)"""
+    try:
+        upload = await attachments.receive(request)
+    except attachments.UploadError as e:
+        raise HTTPException(e.status, detail=str(e))
+    try:
+        return upload, upload.pop_question()
+    except attachments.UploadError as e:
+        upload.cleanup()
+        raise HTTPException(e.status, detail=str(e))
+    except BaseException:
+        upload.cleanup()
+        raise
+
+def submit(upload, task: str, stream: bool = False, profile: str = None):
+    """Queue the job; it owns the spool directory from here and removes it when it finishes"""
+    try:
+        return scheduler.submit(task, files=upload.files, spool=upload.spool, stream=stream,
+                                profile=profile or profiling.PROFILE_ALWAYS)
+    except QueueFull as e:
+        upload.cleanup()
+        raise HTTPException(429, detail=f"Server busy: {e}", headers={"Retry-After": "10"})
+    except BaseException:
+        upload.cleanup()
+        raise
+
+async def admit(request: Request, profile: str = None):
+    upload, task = await receive_question(request)
+    return submit(upload, task, profile=profile)
+
+@app.post("/api/batch")
+async def analyze_batch(request: Request, combined: bool = batch.BATCH_COMBINED_PLAN):
+    """Several question files (plus optional data files) in one request; questions that use the same
+    data run together on one worker. Answers come back per question, in upload order."""
+    try:
+        upload = await attachments.receive(request)
+    except attachments.UploadError as e:
+        raise HTTPException(e.status, detail=str(e))
+    jobs = []
+    try:
+        questions = upload.pop_questions()
+        for indices in batch.group(questions, shared_files=bool(upload.files)):
+            # Data files put every question in a single group, which then owns the spool directory
+            jobs.append(scheduler.submit_batch([questions[i] for i in indices], files=upload.files,
+                                               spool=upload.spool if upload.files else None, combined=combined))
+    except attachments.UploadError as e:
+        upload.cleanup()
+        raise HTTPException(e.status, detail=str(e))
+    except QueueFull as e:
+        for job in jobs:
+            scheduler.cancel(job.id)
+        upload.cleanup()
+        raise HTTPException(429, detail=f"Server busy: {e}", headers={"Retry-After": "10"})
+    except BaseException:
+        upload.cleanup()
+        raise
+    if not upload.files:
+        upload.cleanup()
+
+    await asyncio.gather(*(job.done.wait() for job in jobs))
+    entries = {}
+    for job in jobs:
+        entries.update(zip((name for name, _ in job.questions), job.entries()))
+    # Spooled file names are unique, so names identify questions
+    return Response(content=batch.response([entries[name] for name, _ in questions]), media_type="application/json")
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(request: Request, profile: str = None):
+    job = await admit(request, profiling.mode(profile))
+    return {"id": job.id, "status": job.status}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown job")
+    return Response(content=job.to_json(), media_type="application/json")
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = scheduler.cancel(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown job")
+    return {"id": job.id, "status": job.status}
+
+async def answer(request: Request, profile: str = None):
+    """(cached answer bytes or None, job or None, cache status) for an /api upload; identical uploads are served from the response cache or
+    attached to the job already answering them. `Cache-Control: no-cache` forces a fresh run, and so does profiling."""
+    upload, task = await receive_question(request)
+    if not response_cache.RESPONSE_CACHE_ENABLED:
+        return None, submit(upload, task, profile=profile), None
+    key = response_cache.request_key(task, upload.files)
+    # A forced refresh neither reads the stored answer nor joins a run that may produce the stale one
+    fresh = "no-cache" in request.headers.get("cache-control", "").lower()
+    if fresh:
+        response_cache.responses.invalidate(key)
+    body = response_cache.responses.get(key) if not (profile or fresh) else None
+    job = response_cache.responses.running(key) if not (profile or fresh) else None
+    if body is not None or job is not None:
+        upload.cleanup()
+        status = "hit" if body is not None else "coalesced"
+        response_cache.RESPONSE_CACHE.inc(result=status)
+        return body, job, status
+    job = submit(upload, task, profile=profile)
+    # A profiled run is not shared: a request that joined it would wait through the profiling overhead
+    response_cache.responses.track(key, job, shared=not profile)
+    response_cache.RESPONSE_CACHE.inc(result="miss")
+    return None, job, "miss"
+
+def with_debug(job, body: bytes) -> bytes:
+    """{"result": ..., "debug": ...} around the answer bytes, for ?profile= requests"""
+    return b'{"result": ' + body + b', "debug": ' + json.dumps(job.debug()).encode("utf-8") + b"}"
 
 @app.post("/api")
-async def analyze(file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(".txt"):
-        raise HTTPException(400, "Upload a .txt file")
-
-    tmp_path = None
-    try:
-        data = await file.read()
-        
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(mode='wb', suffix='.txt', delete=False) as tmp:
-            tmp.write(data)
-            tmp_path = tmp.name
-
-        # Run the data analyst agent
-        proc = subprocess.run(
-            ["python", "data_analyst_agent.py", tmp_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=170
-        )
-
-        stdout = proc.stdout.decode("utf-8", errors="ignore")
-        stderr = proc.stderr.decode("utf-8", errors="ignore")
-
-        if proc.returncode != 0:
-            message = f"Agent crashed (exit {proc.returncode})\nSTDERR:\n{stderr}\nSTDOUT:\n{stdout}"
-            raise HTTPException(500, detail=message)
-
-        try:
-            payload = json.loads(stdout)
-        except json.JSONDecodeError as e:
-            message = f"Invalid JSON from agent (decode error: {e})\nRaw STDOUT:\n{stdout}\nRaw STDERR:\n{stderr}"
-            raise HTTPException(500, detail=message)
-
-        return payload
-
-    except subprocess.TimeoutExpired:
-        raise HTTPException(504, "Processing timeout (170s reached)")
+async def analyze(request: Request, timing: bool = False, profile: str = None):
+    profile = profiling.mode(profile)
+    body, job, cache = await answer(request, profile)
+    headers = {"X-Response-Cache": cache} if cache else {}
+    if body is not None:
+        return Response(content=body, media_type="application/json", headers=headers)
+    await job.done.wait()
+
+    # ?timing=1 adds per-stage durations as a Server-Timing header (the JSON body stays the answer only)
+    if timing and job.spans:
+        headers["Server-Timing"] = job.server_timing()
+    if not job.finished_ok:
+        detail = {"error": job.error, "debug": job.debug()} if profile else job.error
+        raise HTTPException(job.http_status or 500, detail=detail, headers=headers or None)
+    if profile:
+        # ?profile=1 wraps the answer with a debug block (stage totals and each execution's resources)
+        return Response(content=with_debug(job, job.result.data), media_type="application/json", headers=headers)
+    # The worker already produced the JSON bytes; send them as-is
+    return Response(content=job.result.data, media_type="application/json", headers=headers)
+
+def encode_event(event: dict, sse: bool) -> bytes:
+    """One NDJSON line or SSE frame; pre-serialized answer/result bytes are spliced in, not re-encoded"""
+    event = dict(event)
+    raw = {k: event.pop(k) for k in ("value", "result") if isinstance(event.get(k), bytes)}
+    body = json.dumps(event).encode("utf-8")
+    for key, value in raw.items():
+        body = body[:-1] + f', "{key}": '.encode() + value + b"}"
+    if sse:
+        return b"event: " + event["event"].encode() + b"\ndata: " + body + b"\n\n"
+    return body + b"\n"
+
+def final_event(job) -> dict:
+    if job.finished_ok:
+        return {"event": "result", "result": job.result.data}
+    return {"event": "error", "error": job.error, "status": job.http_status or 500}
+
+async def job_events(job, sse: bool):
+    """Stream a job's progress events, then its result; a client that disconnects cancels the job"""
+    done = asyncio.create_task(job.done.wait())
+    get = None
+    try:
+        yield encode_event({"event": "queued", "id": job.id}, sse)
+        while True:
+            get = asyncio.create_task(job.events.get())
+            finished, _ = await asyncio.wait({get, done}, timeout=STREAM_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+            if get in finished:
+                yield encode_event(get.result(), sse)
+                continue
+            get.cancel()
+            if done in finished:
+                break
+            # Keeps proxies from closing an idle connection during long stages
+            yield b": keepalive\n\n" if sse else encode_event({"event": "heartbeat"}, sse)
+        while not job.events.empty():
+            yield encode_event(job.events.get_nowait(), sse)
+        yield encode_event(final_event(job), sse)
     finally:
-        if tmp_path and os.path.isfile(tmp_path):
-            os.remove(tmp_path)
\ No newline at end of file
+        for task in (get, done):
+            if task is not None and not task.done():
+                task.cancel()
+        if not job.done.is_set():
+            scheduler.cancel(job.id)
+
+@app.post("/api/stream")
+async def analyze_stream(request: Request, format: str = "ndjson"):
+    """Like /api, but answers arrive as they are computed: stage events, then `answer` events from the
+    program's emit() calls, then the complete result (NDJSON lines, or SSE with ?format=sse)"""
+    sse = format == "sse" or "text/event-stream" in request.headers.get("accept", "")
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    upload, task = await receive_question(request)
+    key = response_cache.request_key(task, upload.files) if response_cache.RESPONSE_CACHE_ENABLED else None
+    body = response_cache.responses.get(key) if key else None
+    if body is not None:
+        upload.cleanup()
+        response_cache.RESPONSE_CACHE.inc(result="hit")
+        content = encode_event({"event": "result", "result": body, "cache": "hit"}, sse)
+        return Response(content=content, media_type=media_type, headers={"X-Response-Cache": "hit"})
+
+    job = submit(upload, task, stream=True)
+    if key:
+        # Cached for later requests, but not shared while running: disconnecting cancels this job
+        response_cache.responses.track(key, job, shared=False)
+        response_cache.RESPONSE_CACHE.inc(result="miss")
+    return StreamingResponse(job_events(job, sse), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.delete("/api/cache")
+async def clear_response_cache():
+    """Forget every cached /api answer (e.g. after the data behind the usual questions changed)"""
+    return {"dropped": response_cache.responses.invalidate()}
+
+@app.get("/api/profile")
+async def slowest_statements(limit: int = 20, by: str = "seconds"):
+    """Statements of profiled runs aggregated across requests, slowest first (or by max_seconds, mean_seconds, alloc_kb)"""
+    try:
+        return {"statements": profiling.statements.top(limit, by)}
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+@app.delete("/api/profile")
+async def clear_slowest_statements():
+    return {"dropped": profiling.statements.clear()}
+
+@app.get("/api/profile/samples/{name}")
+async def stack_samples(name: str):
+    """A ?profile=sample run's collapsed stacks (for flamegraph.pl or speedscope)"""
+    path = profiling.sample_path(name)
+    if path is None:
+        raise HTTPException(404, "Unknown sample file")
+    return FileResponse(path, media_type="text/plain")
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
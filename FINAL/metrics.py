@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Per-stage tracing spans and Prometheus metrics (text exposition, no client library needed)
+"""
+import contextvars, functools, threading, time
+from contextlib import contextmanager
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180)
+
+class Trace:
+    """Spans recorded while handling one task; plain dicts so they pickle across processes"""
+
+    def __init__(self):
+        self.spans = []
+
+    def add(self, stage: str, seconds: float, **attrs):
+        self.spans.append({"stage": stage, "seconds": round(seconds, 6), **attrs})
+
+    def extend(self, spans):
+        self.spans.extend(spans or [])
+
+_trace = contextvars.ContextVar("agent_trace", default=None)
+
+def start_trace() -> Trace:
+    """Begin a trace for the current task; asyncio tasks and to_thread calls started from here inherit it"""
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+def current_trace():
+    return _trace.get()
+
+@contextmanager
+def span(stage: str, **attrs):
+    """Time a block into the current trace (no-op without one); the yielded dict takes extra attributes"""
+    trace = _trace.get()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        if trace is not None:
+            trace.add(stage, time.perf_counter() - start, **attrs)
+
+def timed(stage: str):
+    """Decorator form of span() for plain functions"""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+def stage_totals(spans) -> dict:
+    """Seconds per stage, summed over repeated spans (retries, candidates)"""
+    totals = {}
+    for s in spans or []:
+        totals[s["stage"]] = totals.get(s["stage"], 0.0) + s["seconds"]
+    return totals
+
+def server_timing(spans, total: float = None) -> str:
+    """Server-Timing header value (milliseconds per stage)"""
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stage_totals(spans).items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+class _Metric:
+    kind = ""
+    suffix = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> list:
+        name = self.name + self.suffix
+        lines = [f"# HELP {name} {self.help}", f"# TYPE {name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._samples(key, value))
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+    suffix = "_total"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, key, value):
+        return [f"{self.name}{self.suffix}{_labels(self.labelnames, key)} {value}"]
+
+class Gauge(_Metric):
+    """Current values; with `collect`, read at scrape time from a callable returning {label values: value}"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> list:
+        if self.collect is not None:
+            values = self.collect()
+            with self._lock:
+                self._values = dict(values)
+        return super().render()
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def _samples(self, key, counts):
+        names = self.labelnames + ("le",)
+        lines = [f"{self.name}_bucket{_labels(names, key + (bound,))} {counts[i]}" for i, bound in enumerate(self.buckets)]
+        lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {counts[-1]}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {counts[-2]}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram("agent_stage_seconds", "Time spent per pipeline stage", ("stage",))
+STAGE_ERRORS = Counter("agent_stage_errors", "Stages that ended in an error", ("stage",))
+REQUEST_SECONDS = Histogram("agent_request_seconds", "End-to-end task latency", ("outcome",))
+REQUESTS = Counter("agent_requests", "Finished tasks by outcome", ("outcome",))
+LLM_TOKENS = Counter("agent_llm_tokens", "Gemini tokens used", ("kind",))
+CELLS = Counter("agent_cells", "Top-level program cells restored from the memo or executed", ("outcome",))
+LLM_REJECTED = Counter("agent_llm_rejected", "Generations abandoned by streaming validation", ("reason",))
+LLM_THROTTLED = Counter("agent_llm_throttled", "Gemini calls refused with a rate-limit error")
+FIGURES_CLOSED = Counter("agent_figures_closed", "Pyplot figures generated programs left open (closed after the run)")
+FETCH_BYTES = Counter("agent_fetch_bytes", "Bytes returned by the HTTP cache to programs and templates", ("source",))
+ROUTED = Counter("agent_routed", "Planned tasks by the model tier they were routed to and how they ended", ("tier", "outcome"))
+
+def observe_task(outcome: str, seconds: float, spans=()):
+    """Fold one finished task and its spans into the process-wide metrics"""
+    REQUESTS.inc(outcome=outcome)
+    REQUEST_SECONDS.observe(seconds, outcome=outcome)
+    for s in spans or []:
+        STAGE_SECONDS.observe(s["seconds"], stage=s["stage"])
+        if "error" in s:
+            STAGE_ERRORS.inc(stage=s["stage"])
+        for outcome in ("reused", "executed"):
+            if s.get(f"cells_{outcome}"):
+                CELLS.inc(s[f"cells_{outcome}"], outcome=outcome)
+        if s.get("rejected"):
+            LLM_REJECTED.inc(reason=s["rejected"])
+        if s.get("throttled"):
+            LLM_THROTTLED.inc()
+        if s.get("figures_closed"):
+            FIGURES_CLOSED.inc(s["figures_closed"])
+        if s["stage"] == "route":
+            ROUTED.inc(tier=s["tier"], outcome=s["outcome"])
+        if s["stage"] == "fetch" and "bytes" in s:
+            FETCH_BYTES.inc(s["bytes"], source="cache" if s.get("cached") else "network")
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if s.get(kind):
+                LLM_TOKENS.inc(s[kind], kind=kind.split("_")[0])
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
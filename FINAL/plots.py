@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Chart helpers for generated code and templates: drawn on a reused Agg canvas (no pyplot state),
+large point sets thinned before drawing, and encoded straight to a data URI within the image budget
+"""
+import io, threading
+import numpy as np, pandas as pd
+from PIL import Image
+
+import image_budget
+from analysis import PLOT_SAMPLE_ROWS
+
+FIGSIZE = (8, 6)
+DPI = 80
+# Fixed margins instead of bbox_inches="tight", which lays the figure out twice
+MARGINS = {"left": 0.11, "right": 0.97, "bottom": 0.1, "top": 0.93}
+ROTATED_BOTTOM = 0.22  # room for rotated category labels under a bar chart
+PNG_COMPRESS_LEVEL = 6  # zlib level for the first PNG attempt; optimize=True costs ~2x for a few % smaller
+
+_local = threading.local()
+
+def _figure(figsize, dpi: int):
+    """This thread's Figure for a size, cleared, with a single Axes (created on first use)"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figures = _local.__dict__.setdefault("figures", {})
+    key = (tuple(figsize), dpi)
+    fig = figures.get(key)
+    if fig is None:
+        fig = figures[key] = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(fig)
+    fig.clear()
+    fig.subplots_adjust(**MARGINS)
+    return fig, fig.add_subplot()
+
+def _encode(fig, mime: str, max_bytes: int) -> str:
+    """Draw once and encode the RGB pixels; a plain PNG is tried before the image budget's slower search"""
+    fig.canvas.draw()
+    width, height = fig.canvas.get_width_height()
+    img = Image.frombuffer("RGBA", (width, height), fig.canvas.buffer_rgba(), "raw", "RGBA", 0, 1).convert("RGB")
+    if mime == "image/png":
+        buf = io.BytesIO()
+        img.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+        if buf.tell() <= image_budget.raw_budget(mime, max_bytes):
+            return image_budget.make_data_uri(mime, buf.getvalue())
+    return image_budget.fit_image(img, mime, max_bytes)
+
+def _numbers(values) -> np.ndarray:
+    """Float array of the values; text that does not parse becomes NaN"""
+    array = np.asarray(values).ravel()
+    if array.dtype.kind in "biuf":
+        return array.astype(float, copy=False)
+    return pd.to_numeric(pd.Series(array), errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+def _label(value, given):
+    return given if given is not None else str(getattr(value, "name", None) or "")
+
+def thin(x: np.ndarray, y: np.ndarray, max_points: int) -> tuple:
+    """At most max_points (x, y) pairs: a fixed-seed random sample that keeps the extremes of both axes"""
+    if len(x) <= max_points:
+        return x, y
+    # Below four points not every extreme fits
+    keep = list(dict.fromkeys(int(i) for i in (np.argmin(x), np.argmax(x), np.argmin(y), np.argmax(y))))
+    keep = keep[:max(max_points, 0)]
+    rng = np.random.default_rng(0)
+    chosen = np.union1d(rng.choice(len(x), max(0, max_points - len(keep)), replace=False), keep).astype(int)
+    return x[chosen], y[chosen]
+
+def _decorate(ax, xlabel: str, ylabel: str, title: str):
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if title:
+        ax.set_title(title)
+
+def scatter_with_regression(x, y, xlabel: str = None, ylabel: str = None, title: str = "", line: str = "r--",
+                            alpha: float = 0.6, max_points: int = PLOT_SAMPLE_ROWS, mime: str = "image/png",
+                            max_bytes: int = image_budget.MAX_IMAGE_BYTES, figsize=FIGSIZE, dpi: int = DPI) -> str:
+    """Scatterplot of y against x with a least-squares line (fitted on every point, drawn over a
+    sample of at most max_points); returns a data URI"""
+    xs, ys = _numbers(x), _numbers(y)
+    finite = np.isfinite(xs) & np.isfinite(ys)
+    xs, ys = xs[finite], ys[finite]
+    fig, ax = _figure(figsize, dpi)
+    px, py = thin(xs, ys, max_points)
+    ax.scatter(px, py, alpha=alpha, s=12 if len(px) > 1000 else None)
+    if len(xs) > 1 and np.ptp(xs) > 0:
+        dx = xs - xs.mean()
+        slope = float(dx @ (ys - ys.mean()) / (dx @ dx))
+        intercept = ys.mean() - slope * xs.mean()
+        ends = np.array([xs.min(), xs.max()])
+        ax.plot(ends, slope * ends + intercept, line, linewidth=2)
+    _decorate(ax, _label(x, xlabel), _label(y, ylabel), title)
+    return _encode(fig, mime, max_bytes)
+
+def bar(labels, values=None, xlabel: str = None, ylabel: str = None, title: str = "", color: str = None,
+        horizontal: bool = False, mime: str = "image/png", max_bytes: int = image_budget.MAX_IMAGE_BYTES,
+        figsize=FIGSIZE, dpi: int = DPI) -> str:
+    """Bar chart of values per label (a Series may be passed alone as labels); returns a data URI"""
+    if isinstance(labels, pd.Series) and values is None:
+        labels, values = labels.index, labels
+    names = [str(v) for v in labels]
+    heights = _numbers(values)
+    fig, ax = _figure(figsize, dpi)
+    if horizontal:
+        ax.barh(names, heights, color=color)
+    else:
+        ax.bar(names, heights, color=color)
+        if len(names) > 6 or max(map(len, names), default=0) > 8:
+            ax.tick_params(axis="x", labelrotation=45)
+            fig.subplots_adjust(bottom=ROTATED_BOTTOM)
+    _decorate(ax, _label(labels, xlabel), _label(values, ylabel), title)
+    return _encode(fig, mime, max_bytes)
+
+def hist(values, bins=20, xlabel: str = None, ylabel: str = "Count", title: str = "", color: str = None,
+         mime: str = "image/png", max_bytes: int = image_budget.MAX_IMAGE_BYTES, figsize=FIGSIZE, dpi: int = DPI) -> str:
+    """Histogram of every finite value (binned with numpy, drawn as one filled outline); returns a data URI"""
+    data = _numbers(values)
+    counts, edges = np.histogram(data[np.isfinite(data)], bins=bins)
+    fig, ax = _figure(figsize, dpi)
+    ax.stairs(counts, edges, fill=True, color=color, alpha=0.8)
+    _decorate(ax, _label(values, xlabel), ylabel, title)
+    return _encode(fig, mime, max_bytes)
+
+def helpers() -> dict:
+    """The chart helpers, for the generated code's namespace"""
+    return {fn.__name__: fn for fn in (scatter_with_regression, bar, hist)}
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Speculative prefetch while the LLM plans: data named in a question is downloaded through the HTTP
+cache and sniffed (columns, first rows, parquet footers, Wikipedia table index), so the prompt can
+name real columns and execution starts on local data
+"""
+import os, asyncio, contextvars, logging, time, urllib.parse
+
+import http_cache
+import duckdb_manager
+import attachments
+import analysis
+import wiki_tables
+import metrics
+from task_patterns import extract_urls
+
+PREFETCH_ENABLED = os.getenv("AGENT_PREFETCH", "1") != "0"
+PREFETCH_SCHEMA_DEADLINE = float(os.getenv("AGENT_PREFETCH_SCHEMA_DEADLINE", "1.5"))
+PREFETCH_MAX_URLS = int(os.getenv("AGENT_PREFETCH_MAX_URLS", "4"))
+PROMPT_WIKI_TABLES = 6  # largest tables of a page listed in the prompt
+PROMPT_HEADERS = 12
+
+def kind(url: str):
+    """How a source is prefetched: "dataset" (downloaded and sniffed, becomes a DuckDB view), "remote"
+    (schema from the files' footers, nothing downloaded), "page" (downloaded; the index of its
+    wikitables, if any, is sniffed) or None"""
+    if not http_cache.is_http_url(url):
+        return "remote" if analysis.reader(url) else None
+    if attachments.reader(os.path.basename(urllib.parse.urlparse(url).path)):
+        return "remote" if "*" in url else "dataset"
+    return "page"
+
+def dataset(url: str):
+    """Download a tabular URL once through the HTTP cache; described like an uploaded file, without schema"""
+    name = os.path.basename(urllib.parse.urlparse(url).path)
+    if not attachments.reader(name):
+        return None
+    try:
+        path = http_cache.get_http_cache().local_path(url)
+    except Exception as e:
+        logging.warning(f"Prefetch of {url} failed: {str(e)}")
+        return None
+    return {"field": "url", "name": name, "path": path, "size": os.path.getsize(path), "url": url}
+
+class Prefetch:
+    """The sources of one question, fetched and sniffed in worker threads from the moment it arrives"""
+
+    def __init__(self, urls: list):
+        self.started = time.monotonic()
+        self._cursors = set()
+        self.tasks = {asyncio.create_task(asyncio.to_thread(self._fetch, url, kind(url))): url for url in urls}
+
+    def _fetch(self, url: str, how: str):
+        with metrics.span("prefetch", kind=how) as span:
+            try:
+                if how == "page":
+                    resp = http_cache.fetch(url)
+                    if resp.status_code < 400 and b"wikitable" in resp.content:
+                        return {"kind": "wiki", "url": url, "tables": wiki_tables.page_tables(url)}
+                    return {"kind": how, "url": url}
+                con = duckdb_manager.cursor()
+                self._cursors.add(con)
+                try:
+                    if how == "remote":
+                        return {"kind": how, "url": url, "columns": analysis.schema(url, con)}
+                    found = dataset(url)
+                    if found is None:
+                        span["error"] = "download"
+                        return None
+                    return {"kind": how, "url": url, "dataset": attachments.describe([found], con)[0]}
+                finally:
+                    self._cursors.discard(con)
+                    con.close()
+            except Exception as e:
+                span["error"] = type(e).__name__
+                logging.info(f"Prefetch of {url} failed: {str(e)}")
+                return None
+
+    def results(self) -> list:
+        """Sources sniffed so far, in question order"""
+        return [t.result() for t in self.tasks if t.done() and not t.cancelled() and t.result()]
+
+    async def ready(self, deadline: float = PREFETCH_SCHEMA_DEADLINE) -> list:
+        """Sniffed sources, waiting for the rest until `deadline` seconds after the prefetch started"""
+        pending = [t for t in self.tasks if not t.done()]
+        remaining = self.started + deadline - time.monotonic()
+        if pending and remaining > 0:
+            with metrics.span("prefetch_wait") as span:
+                await asyncio.wait(pending, timeout=remaining)
+                span["late"] = sum(not t.done() for t in pending)
+        return self.results()
+
+    def close(self):
+        """Stop waiting; downloads still running finish into the HTTP cache, remote scans are interrupted"""
+        for task in self.tasks:
+            task.cancel()
+        for con in list(self._cursors):
+            try:
+                con.interrupt()
+            except Exception:
+                pass
+
+def warm_up():
+    """Open this process's DuckDB connection (extensions, settings) so the first sniff does not pay for it"""
+    if PREFETCH_ENABLED:
+        duckdb_manager.get_connection()
+
+_current = contextvars.ContextVar("agent_prefetch", default=None)
+
+def start(task: str, skip=()):
+    """Start prefetching the sources a question names (except those in skip) for this context"""
+    urls = [url for url in extract_urls(task) if url not in skip and kind(url)][:PREFETCH_MAX_URLS]
+    prefetch = Prefetch(urls) if PREFETCH_ENABLED and urls else None
+    _current.set(prefetch)
+    return prefetch
+
+def current():
+    return _current.get()
+
+async def wait(deadline: float = PREFETCH_SCHEMA_DEADLINE) -> list:
+    prefetch = _current.get()
+    return await prefetch.ready(deadline) if prefetch is not None else []
+
+def views(taken=()) -> list:
+    """Prefetched datasets as attachments for execution (skipping view names already taken)"""
+    prefetch = _current.get()
+    if prefetch is None:
+        return []
+    taken = {f.get("view") for f in taken}
+    return [r["dataset"] for r in prefetch.results()
+            if r["kind"] == "dataset" and r["dataset"].get("view") and r["dataset"]["view"] not in taken]
+
+def _wiki_lines(url: str, tables: list) -> list:
+    largest = sorted(tables, key=lambda t: -t["rows"])[:PROMPT_WIKI_TABLES]
+    lines = [f"- {url}: {len(tables)} wikitables; largest:"]
+    for t in sorted(largest, key=lambda t: t["index"]):
+        headers = t["headers"][:PROMPT_HEADERS] + (["..."] if len(t["headers"]) > PROMPT_HEADERS else [])
+        caption = f" {t['caption']!r}" if t["caption"] else ""
+        lines.append(f"  #{t['index']}{caption} ({t['rows']} rows): {headers}")
+    return lines
+
+def prompt_section() -> str:
+    """What the sniff found before planning, for the prompt"""
+    prefetch = _current.get()
+    if prefetch is None:
+        return ""
+    lines = []
+    for r in prefetch.results():
+        if r["kind"] == "dataset":
+            lines.extend(attachments.file_lines([r["dataset"]]))
+        elif r["kind"] == "wiki" and r["tables"]:
+            lines.extend(_wiki_lines(r["url"], r["tables"]))
+        elif r["kind"] == "remote" and r["columns"]:
+            lines.append(f"- {r['url']}: " + ", ".join(f"{c} {t}" for c, t in r["columns"]))
+    if not lines:
+        return ""
+    return ("DATA NAMED IN THE TASK (already fetched; use these exact column names. Reading a URL again is served "
+            "from a local cache, and downloaded files are also DuckDB views):\n" + "\n".join(lines))
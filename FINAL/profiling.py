@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Opt-in resource profile of each execution: CPU, peak memory, allocation sites, bytes fetched per URL,
+per-statement timings and an optional stack-sample dump; reported as a debug block and aggregated
+into a slowest-statements report by the server
+"""
+import os, sys, contextvars, logging, re, threading, time, tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - non-POSIX
+    resource = None
+
+from code_cache import CACHE_DIR
+import metrics
+
+PROFILE_TOP = int(os.getenv("AGENT_PROFILE_TOP", "10"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("AGENT_PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("AGENT_PROFILE_DIR", os.path.join(CACHE_DIR, "profiles"))
+PROFILE_STATEMENTS = int(os.getenv("AGENT_PROFILE_STATEMENTS", "500"))
+SAMPLE_FILE = re.compile(r"[\w.-]+\.folded")
+
+def mode(value) -> str:
+    """None (off), "basic" or "sample" (basic plus a stack-sample dump) from a flag value"""
+    value = str(value or "").strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    return "sample" if value == "sample" else "basic"
+
+PROFILE_ALWAYS = mode(os.getenv("AGENT_PROFILE", "0"))
+
+_mode = contextvars.ContextVar("agent_profile", default=None)
+
+def request(value):
+    """Profile executions started from this context (and tasks/threads started from it); returns a reset token"""
+    return _mode.set(mode(value))
+
+def stop(token):
+    _mode.reset(token)
+
+def requested() -> str:
+    return _mode.get()
+
+def _status_mb(field: str) -> float:
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+def _reset_peak() -> bool:
+    """Restart the kernel's peak-RSS watermark (VmHWM) so it covers this run only (Linux)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+        return True
+    except OSError:
+        return False
+
+def _max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource is not None else 0.0
+
+def _cpu() -> float:
+    if resource is None:
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+_figures_lock = threading.Lock()
+_running = 0  # executions between open_figures() and close_figures() in this process
+_left_open = set()
+
+def open_figures() -> set:
+    """Figures open before a run starts; close_figures() leaves these alone"""
+    global _running
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    with _figures_lock:
+        _running += 1
+        return set(pyplot.get_fignums()) if pyplot is not None else set()
+
+def close_figures(before=frozenset()) -> int:
+    """Close the pyplot figures a run added and left open (they would pile up in long-lived processes).
+    While other runs are executing in this process (thread backend) nothing is closed, since they may
+    still be drawing; the last run to finish closes what was left"""
+    global _running
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    with _figures_lock:
+        _running -= 1
+        if pyplot is None:
+            return 0
+        added = set(pyplot.get_fignums()) - set(before)
+        if _running:
+            _left_open.update(added)
+            return 0
+        stale = (added | _left_open) & set(pyplot.get_fignums())
+        _left_open.clear()
+    for num in stale:
+        pyplot.close(num)
+    return len(stale)
+
+def _summary(source: str, limit: int = 160) -> str:
+    """A statement's code without comments, on one line"""
+    lines = [line.strip() for line in source.splitlines() if line.strip() and not line.strip().startswith("#")]
+    text = " ".join(lines)
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+def _site(frame) -> str:
+    filename = frame.filename
+    if "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    elif filename.startswith((os.path.dirname(os.path.abspath(__file__)), os.path.dirname(os.__file__))):
+        filename = os.path.basename(filename)
+    return f"{filename}:{frame.lineno}"
+
+class _Sampler(threading.Thread):
+    """Samples one thread's stack every interval into collapsed stacks ("folded" format for
+    flamegraph.pl and speedscope)"""
+
+    def __init__(self, target: int, interval: float):
+        super().__init__(name="agent-profile-sampler", daemon=True)
+        self.target = target
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})".replace(";", ","))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def finish(self) -> dict:
+        self._stopped.set()
+        self.join()
+        name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident() % 10000}.folded"
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(PROFILE_DIR, name), "w") as fh:
+                fh.writelines(f"{stack} {count}\n" for stack, count in self.stacks.items())
+        except OSError as e:
+            logging.warning(f"Could not write stack samples: {str(e)}")
+            return {"samples": self.samples}
+        return {"file": name, "samples": self.samples, "interval": self.interval}
+
+class Profile:
+    """Resources one execution uses in this process (CPU and RSS are process-wide, so exact in a
+    sandbox child and approximate with the thread backend); finish() records a "profile" span"""
+
+    def __init__(self, sample: bool = False):
+        self.statements = []
+        self.figures_closed = 0
+        self._trace = metrics.current_trace()
+        self._first_span = len(self._trace.spans) if self._trace is not None else 0
+        self._owns_tracing = not tracemalloc.is_tracing()
+        if self._owns_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._traced = tracemalloc.get_traced_memory()[0]
+        self._hwm = _reset_peak()
+        self._rss = _status_mb("VmRSS")
+        self._max_rss = _max_rss_mb()
+        self._cpu = _cpu()
+        self._start = time.perf_counter()
+        self._sampler = _Sampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL) if sample else None
+        if self._sampler is not None:
+            self._sampler.start()
+
+    @contextmanager
+    def statement(self, line: int, source: str):
+        """Time one top-level statement (a cell) and the Python memory it leaves allocated"""
+        traced, cpu, start = tracemalloc.get_traced_memory()[0], _cpu(), time.perf_counter()
+        try:
+            yield
+        finally:
+            self.statements.append({"line": line, "source": _summary(source),
+                                    "seconds": round(time.perf_counter() - start, 6),
+                                    "cpu_seconds": round(_cpu() - cpu, 6),
+                                    "alloc_kb": round((tracemalloc.get_traced_memory()[0] - traced) / 1024, 1)})
+
+    def _network(self) -> list:
+        spans = self._trace.spans[self._first_span:] if self._trace is not None else []
+        network = {}
+        for s in spans:
+            if s["stage"] != "fetch":
+                continue
+            entry = network.setdefault(s["url"], {"url": s["url"], "bytes": 0, "fetches": 0, "from_cache": 0, "seconds": 0.0})
+            entry["bytes"] += s.get("bytes", 0)
+            entry["fetches"] += 1
+            entry["from_cache"] += int(bool(s.get("cached")))
+            entry["seconds"] = round(entry["seconds"] + s["seconds"], 6)
+        return sorted(network.values(), key=lambda e: -e["bytes"])
+
+    def finish(self) -> dict:
+        """Stop measuring (call while the program's namespace is still alive) and record the report"""
+        wall = time.perf_counter() - self._start
+        cpu = _cpu() - self._cpu
+        sample = self._sampler.finish() if self._sampler is not None else None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>")))
+        python_peak = tracemalloc.get_traced_memory()[1]
+        if self._owns_tracing:
+            tracemalloc.stop()
+        rss = _status_mb("VmRSS")
+        peak = _status_mb("VmHWM") if self._hwm else max(_max_rss_mb(), rss)
+        report = {
+            "pid": os.getpid(), "cpu_seconds": round(cpu, 4),
+            "rss_start_mb": round(self._rss, 1), "rss_end_mb": round(rss, 1), "peak_rss_mb": round(peak, 1),
+            # Without a resettable watermark, growth only shows once the process exceeds its lifetime peak
+            "peak_rss_delta_mb": round(max(0.0, peak - (self._rss if self._hwm else self._max_rss)), 1),
+            "python_peak_mb": round(max(0, python_peak - self._traced) / 2**20, 1),
+            # Allocations still alive when the program finished, by the line that made them
+            "allocations": [{"site": _site(stat.traceback[0]), "kb": round(stat.size / 1024, 1), "count": stat.count}
+                            for stat in snapshot.statistics("lineno")[:PROFILE_TOP]],
+            "network": self._network(),
+            "statements": sorted(self.statements, key=lambda s: -s["seconds"]),
+            "figures_closed": self.figures_closed,
+        }
+        if sample is not None:
+            report["sample"] = sample
+        if self._trace is not None:
+            self._trace.add("profile", wall, **report)
+        return report
+
+def debug_block(spans) -> dict:
+    """Stage totals (ms) and every execution's profile, for a response"""
+    return {"stages": {stage: round(seconds * 1000, 1) for stage, seconds in metrics.stage_totals(spans).items()},
+            "executions": [{k: v for k, v in s.items() if k != "stage"} for s in spans or () if s["stage"] == "profile"]}
+
+class StatementReport:
+    """Statements of profiled runs aggregated by their code, slowest first; bounded by dropping
+    the statements with the least total time"""
+
+    def __init__(self, max_entries: int = PROFILE_STATEMENTS):
+        self.max_entries = max_entries
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, spans):
+        with self._lock:
+            for s in spans or ():
+                if s["stage"] != "profile":
+                    continue
+                for st in s.get("statements", ()):
+                    entry = self._stats.setdefault(st["source"], {"source": st["source"], "runs": 0, "seconds": 0.0,
+                                                                  "max_seconds": 0.0, "alloc_kb": 0.0})
+                    entry["runs"] += 1
+                    entry["seconds"] += st["seconds"]
+                    entry["max_seconds"] = max(entry["max_seconds"], st["seconds"])
+                    entry["alloc_kb"] += st.get("alloc_kb", 0.0)
+            if len(self._stats) > self.max_entries:
+                keep = sorted(self._stats.values(), key=lambda e: -e["seconds"])[:self.max_entries]
+                self._stats = {e["source"]: e for e in keep}
+
+    ORDERS = ("seconds", "max_seconds", "mean_seconds", "alloc_kb")
+
+    def top(self, n: int = 20, by: str = "seconds") -> list:
+        """The n largest entries by one of ORDERS; ValueError for any other field"""
+        if by not in self.ORDERS:
+            raise ValueError(f"Cannot order statements by {by!r}; use one of {', '.join(self.ORDERS)}")
+        with self._lock:
+            entries = [dict(e, mean_seconds=e["seconds"] / e["runs"]) for e in self._stats.values()]
+        entries.sort(key=lambda e: -e[by])
+        return [{k: round(v, 6) if isinstance(v, float) else v for k, v in e.items()} for e in entries[:n]]
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._stats)
+            self._stats.clear()
+        return count
+
+statements = StatementReport()
+
+def sample_path(name: str):
+    """Path of a stack-sample dump by file name (None for names that are not dumps)"""
+    if not SAMPLE_FILE.fullmatch(name):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Whole-response cache for /api: identical uploads (question plus attached files, by content) are
+answered from memory, and concurrent identical uploads share one in-flight job
+"""
+import os, re, json, time, asyncio, hashlib, logging
+from collections import OrderedDict
+
+import metrics
+
+RESPONSE_CACHE_ENABLED = os.getenv("AGENT_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_TTL = float(os.getenv("AGENT_RESPONSE_CACHE_TTL", "900"))
+# Answers to questions that fetch remote data can go stale sooner than ones computed from uploads
+RESPONSE_CACHE_URL_TTL = float(os.getenv("AGENT_RESPONSE_CACHE_URL_TTL", str(RESPONSE_CACHE_TTL)))
+RESPONSE_CACHE_POLICY = os.getenv("AGENT_RESPONSE_CACHE_POLICY", "ttl")
+RESPONSE_CACHE_ENTRIES = int(os.getenv("AGENT_RESPONSE_CACHE_ENTRIES", "256"))
+RESPONSE_CACHE_MB = float(os.getenv("AGENT_RESPONSE_CACHE_MB", "64"))
+# Job outcome labels whose answers may be reused; template fallbacks on synthetic data are not
+RESPONSE_CACHE_OUTCOMES = frozenset(o.strip() for o in os.getenv("AGENT_RESPONSE_CACHE_OUTCOMES", "llm,cached,template").split(",") if o.strip())
+
+POLICIES = ("ttl", "sliding")
+URL = re.compile(r"\b(?:https?|s3)://", re.IGNORECASE)
+
+RESPONSE_CACHE = metrics.Counter("agent_response_cache", "/api requests answered from the response cache, attached to an identical in-flight job, or run", ("result",))
+
+def request_key(task: str, files=()) -> str:
+    """Content key of an upload: the question text plus each data file's field, name and digest"""
+    parts = sorted((f["field"], f["name"], f.get("sha256", "")) for f in files)
+    return hashlib.sha256(json.dumps([task, parts]).encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Bounded LRU of answer bytes with per-entry expiry, plus the map of identical jobs still running.
+    Lives in the server process only, so a restart (e.g. a deploy with a new prompt) empties it."""
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, url_ttl: float = RESPONSE_CACHE_URL_TTL,
+                 policy: str = RESPONSE_CACHE_POLICY, max_entries: int = RESPONSE_CACHE_ENTRIES,
+                 max_bytes: int = int(RESPONSE_CACHE_MB * 1024 * 1024), outcomes=RESPONSE_CACHE_OUTCOMES):
+        if policy not in POLICIES:
+            logging.warning(f"Unknown AGENT_RESPONSE_CACHE_POLICY {policy!r}; using 'ttl'")
+            policy = "ttl"
+        self.ttl = ttl
+        self.url_ttl = url_ttl
+        self.policy = policy
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.outcomes = outcomes
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (body, lifetime, expires)
+        self._inflight = {}
+        self._watchers = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        body, lifetime, expires = entry
+        now = time.time()
+        if now >= expires:
+            self._drop(key)
+            return None
+        if self.policy == "sliding":
+            self._entries[key] = (body, lifetime, now + lifetime)
+        self._entries.move_to_end(key)
+        return body
+
+    def put(self, key: str, task: str, body: bytes):
+        lifetime = self.url_ttl if URL.search(task) else self.ttl
+        if lifetime <= 0 or len(body) > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = (body, lifetime, time.time() + lifetime)
+        self.size += len(body)
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def invalidate(self, key: str = None) -> int:
+        """Drop one entry, or every entry when key is None; returns how many were dropped"""
+        if key is not None:
+            found = key in self._entries
+            self._drop(key)
+            return int(found)
+        count = len(self._entries)
+        self._entries.clear()
+        self.size = 0
+        return count
+
+    def running(self, key: str):
+        """The unfinished job for an identical upload, if any"""
+        return self._inflight.get(key)
+
+    def track(self, key: str, job, shared: bool = True):
+        """Register a just-submitted job; its answer is stored once it finishes with a reusable outcome.
+        Identical uploads attach to it while it runs unless `shared` is off (a job its client may cancel)."""
+        if shared:
+            self._inflight[key] = job
+        watcher = asyncio.create_task(self._settle(key, job))
+        self._watchers.add(watcher)
+        watcher.add_done_callback(self._watchers.discard)
+
+    async def _settle(self, key: str, job):
+        try:
+            await job.done.wait()
+            # An older run finishing after a forced refresh started must not store its answer over the new one
+            newer = self._inflight.get(key) not in (None, job)
+            if job.finished_ok and job.label in self.outcomes and not newer:
+                self.put(key, job.task, job.result_bytes())
+        finally:
+            if self._inflight.get(key) is job:
+                del self._inflight[key]
+
+def _stats() -> dict:
+    return {("entries",): len(responses), ("bytes",): responses.size, ("inflight",): len(responses._inflight)}
+
+responses = ResponseCache()
+
+RESPONSE_CACHE_SIZE = metrics.Gauge("agent_response_cache_size", "Cached /api answers, their bytes, and distinct uploads being answered",
+                                    ("kind",), collect=_stats)
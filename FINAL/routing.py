@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Model routing: questions that look simple (by their detected patterns, and by how the fast model has
+done on the same kind of question) are planned by a cheaper, faster model with a smaller output cap;
+an attempt that fails escalates to the strong model. Decisions and outcomes are logged for tuning
+"""
+import os, json, contextvars, logging, random, sqlite3, threading, time, urllib.parse
+from contextlib import contextmanager
+
+from code_cache import CACHE_DIR
+from task_patterns import detect_task_patterns, extract_urls
+import attachments
+import metrics
+
+ROUTING_ENABLED = os.getenv("AGENT_ROUTING", "1") != "0"
+STRONG_MODEL = os.getenv("AGENT_MODEL", "models/gemini-2.5-flash")
+FAST_MODEL = os.getenv("AGENT_FAST_MODEL", "models/gemini-2.5-flash-lite")
+FAST_MAX_OUTPUT_TOKENS = int(os.getenv("AGENT_FAST_MAX_OUTPUT_TOKENS", "2000"))
+ROUTING_MIN_SUCCESS = float(os.getenv("AGENT_ROUTING_MIN_SUCCESS", "0.7"))
+ROUTING_MIN_SAMPLES = int(os.getenv("AGENT_ROUTING_MIN_SAMPLES", "5"))
+ROUTING_DECAY = float(os.getenv("AGENT_ROUTING_DECAY", "0.95"))  # weight of older outcomes per new one
+ROUTING_EXPLORE = float(os.getenv("AGENT_ROUTING_EXPLORE", "0.05"))  # demoted signatures still tried on the fast model
+ROUTING_DB = os.getenv("AGENT_ROUTING_DB", os.path.join(CACHE_DIR, "routing.sqlite"))
+ROUTING_LOG = os.getenv("AGENT_ROUTING_LOG", os.path.join(CACHE_DIR, "routing.jsonl"))
+
+TIERS = {"fast": FAST_MODEL, "strong": STRONG_MODEL}
+SIMPLE_ANALYSES = {"counting", "correlation", "regression", "temporal"}
+COMPLEX_SOURCES = {"wikipedia", "duckdb"}  # scraping and remote queries
+
+def signature(patterns: dict) -> str:
+    """The kind of question, e.g. "correlation/csv/plot/json_array" (what routing history is kept by)"""
+    sources = "+".join(sorted(patterns["data_sources"])) or "none"
+    plot = "plot" if patterns["has_visualization"] else "noplot"
+    return f"{patterns['analysis_type']}/{sources}/{plot}/{patterns['output_format']}"
+
+def classify(task: str, patterns: dict) -> tuple:
+    """("simple" or "complex", why) from the detected patterns and the sources the question names"""
+    if patterns["analysis_type"] not in SIMPLE_ANALYSES:
+        return "complex", f"analysis:{patterns['analysis_type']}"
+    scraped = COMPLEX_SOURCES.intersection(patterns["data_sources"])
+    if scraped:
+        return "complex", f"source:{'+'.join(sorted(scraped))}"
+    for url in extract_urls(task):
+        if not attachments.reader(os.path.basename(urllib.parse.urlparse(url).path)):
+            return "complex", "source:page"
+    return "simple", f"analysis:{patterns['analysis_type']}"
+
+class History:
+    """Decayed success rate of each tier per question signature, in SQLite shared by every worker"""
+
+    def __init__(self, path: str = ROUTING_DB, decay: float = ROUTING_DECAY):
+        self.decay = decay
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS routing (
+                signature TEXT NOT NULL,
+                tier TEXT NOT NULL,
+                runs INTEGER NOT NULL,
+                weight REAL NOT NULL,
+                successes REAL NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (signature, tier)
+            )""")
+        self._db.commit()
+
+    def rate(self, sig: str, tier: str) -> tuple:
+        """(runs, decayed success rate or None)"""
+        with self._lock:
+            row = self._db.execute("SELECT runs, weight, successes FROM routing WHERE signature = ? AND tier = ?",
+                                   (sig, tier)).fetchone()
+        if not row or not row[1]:
+            return 0, None
+        return row[0], row[2] / row[1]
+
+    def record(self, sig: str, tier: str, success: bool):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO routing (signature, tier, runs, weight, successes, updated) VALUES (?, ?, 1, 1, ?, ?) "
+                "ON CONFLICT (signature, tier) DO UPDATE SET runs = runs + 1, weight = weight * ? + 1, "
+                "successes = successes * ? + excluded.successes, updated = excluded.updated",
+                (sig, tier, float(success), time.time(), self.decay, self.decay))
+            self._db.commit()
+
+    def table(self) -> list:
+        with self._lock:
+            rows = self._db.execute("SELECT signature, tier, runs, weight, successes FROM routing "
+                                    "ORDER BY signature, tier").fetchall()
+        return [{"signature": s, "tier": t, "runs": n, "success_rate": round(ok / w, 3) if w else None}
+                for s, t, n, w, ok in rows]
+
+_history = None
+_history_pid = None
+
+def get_history():
+    """Per-process handle (forked workers never share a SQLite connection), or None if unavailable"""
+    global _history, _history_pid
+    if _history_pid != os.getpid():
+        try:
+            _history = History() if ROUTING_DB else None
+        except sqlite3.Error as e:
+            logging.warning(f"Routing history disabled: {str(e)}")
+            _history = None
+        _history_pid = os.getpid()
+    return _history
+
+class Decision:
+    """Where one question's planning goes and how each attempt ended"""
+
+    def __init__(self, task: str):
+        patterns = detect_task_patterns(task)
+        self.signature = signature(patterns)
+        self.complexity, self.reason = classify(task, patterns)
+        self.tier = "strong"
+        self.fast_runs, self.fast_success = 0, None
+        self.attempts = []
+        self.started = time.time()
+        if not ROUTING_ENABLED:
+            self.reason = "disabled"
+        elif self.complexity == "simple":
+            history = get_history()
+            if history is not None:
+                self.fast_runs, self.fast_success = history.rate(self.signature, "fast")
+            demoted = self.fast_runs >= ROUTING_MIN_SAMPLES and self.fast_success < ROUTING_MIN_SUCCESS
+            if demoted and random.random() >= ROUTING_EXPLORE:
+                self.reason = "history"
+            else:
+                self.tier = "fast"
+                if demoted:
+                    self.reason = "explore"
+
+    def tier_for(self, attempt: int) -> str:
+        """The routed tier first; the strong model once an attempt has failed"""
+        return self.tier if attempt == 0 else "strong"
+
+    def attempted(self, tier: str, outcome: str, started: float, cached: bool = False):
+        """One attempt by a tier; `cached` for a replay of a program the tier planned earlier"""
+        attempt = {"tier": tier, "model": TIERS[tier], "outcome": outcome, "seconds": round(time.time() - started, 3)}
+        if cached:
+            attempt["cached"] = True
+        self.attempts.append(attempt)
+
+    def finish(self):
+        """Record the outcome in the routing history, the trace and the decision log"""
+        if not self.attempts:
+            return
+        if self.attempts[0].get("cached"):
+            # The question was answered, or first tried, by the tier whose program was cached
+            self.tier, self.reason = self.attempts[0]["tier"], "code_cache"
+        success = self.attempts[-1]["outcome"] == "passed"
+        escalated = len({a["tier"] for a in self.attempts}) > 1
+        history = get_history()
+        for tier in dict.fromkeys(a["tier"] for a in self.attempts):
+            passed = any(a["tier"] == tier and a["outcome"] == "passed" for a in self.attempts)
+            if history is not None:
+                try:
+                    history.record(self.signature, tier, passed)
+                except sqlite3.Error as e:
+                    logging.warning(f"Routing history write failed: {str(e)}")
+        outcome = "escalated" if escalated and success else ("passed" if success else "failed")
+        seconds = time.time() - self.started
+        trace = metrics.current_trace()
+        if trace is not None:
+            trace.add("route", seconds, tier=self.tier, outcome=outcome)
+        record = {"time": time.time(), "signature": self.signature, "complexity": self.complexity,
+                  "reason": self.reason, "tier": self.tier, "fast_runs": self.fast_runs,
+                  "fast_success": self.fast_success and round(self.fast_success, 3), "attempts": self.attempts,
+                  "escalated": escalated, "success": success, "seconds": round(seconds, 3)}
+        logging.info(f"Routing {self.signature}: {self.tier} ({self.reason}) -> {outcome}")
+        if not ROUTING_LOG:
+            return
+        try:
+            os.makedirs(os.path.dirname(ROUTING_LOG) or ".", exist_ok=True)
+            with open(ROUTING_LOG, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logging.warning(f"Could not write routing log: {str(e)}")
+
+_tier = contextvars.ContextVar("agent_model_tier", default="strong")
+
+@contextmanager
+def using(tier: str):
+    """Gemini calls made inside (including tasks started inside) go to this tier's model"""
+    token = _tier.set(tier)
+    try:
+        yield
+    finally:
+        _tier.reset(token)
+
+def current() -> tuple:
+    """(model, output token cap or None) for calls made in this context"""
+    tier = _tier.get()
+    return TIERS[tier], FAST_MAX_OUTPUT_TOKENS if tier == "fast" else None
+
+def summary(path: str = ROUTING_LOG) -> list:
+    """Decision log aggregated per signature and first tier: runs, success, escalations and latency"""
+    groups = {}
+    try:
+        with open(path, encoding="utf-8") as fh:
+            records = [json.loads(line) for line in fh if line.strip()]
+    except OSError:
+        return []
+    for r in records:
+        g = groups.setdefault((r["signature"], r["tier"]), {"signature": r["signature"], "tier": r["tier"],
+                                                             "runs": 0, "passed": 0, "escalated": 0, "seconds": []})
+        g["runs"] += 1
+        g["passed"] += int(r["success"])
+        g["escalated"] += int(r["escalated"])
+        g["seconds"].append(r["seconds"])
+    out = []
+    for g in groups.values():
+        seconds = sorted(g.pop("seconds"))
+        out.append(dict(g, success_rate=round(g["passed"] / g["runs"], 3), p50_seconds=seconds[len(seconds) // 2]))
+    return sorted(out, key=lambda g: (g["signature"], g["tier"]))
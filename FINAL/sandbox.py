@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Reusable child processes that run generated code under CPU, memory and wall-clock limits
+"""
+import os, logging, math, multiprocessing, multiprocessing.forkserver, signal, threading, time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - non-POSIX
+    resource = None
+
+from worker_pool import rss_mb
+import lazy_modules
+import metrics
+import events
+import profiling
+
+SANDBOX_SIZE = int(os.getenv("AGENT_SANDBOX_SIZE", "2"))
+SANDBOX_START_METHOD = os.getenv("AGENT_SANDBOX_START_METHOD", "fork")
+SANDBOX_MAX_RUNS = int(os.getenv("AGENT_SANDBOX_MAX_RUNS", "100"))
+EXEC_TIMEOUT = float(os.getenv("AGENT_EXEC_TIMEOUT", "120"))
+EXEC_CPU_SECONDS = float(os.getenv("AGENT_EXEC_CPU_SECONDS", "100"))
+EXEC_MAX_RSS_MB = float(os.getenv("AGENT_EXEC_MAX_RSS_MB", "1536"))
+POLL_INTERVAL = 0.05
+
+class CpuLimitExceeded(BaseException):
+    """Raised inside the child on SIGXCPU; BaseException so generated try/except Exception can't swallow it"""
+
+def _on_sigxcpu(signum, frame):
+    raise CpuLimitExceeded()
+
+def _cpu_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def _set_cpu_limit(seconds: float):
+    """RLIMIT_CPU is cumulative per process, so each run gets 'used so far + budget' as its soft limit"""
+    if resource is None or not seconds:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = math.ceil(_cpu_used() + seconds)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _clear_cpu_limit():
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+def _child_main(conn, execute):
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, _on_sigxcpu)
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if msg is None:
+            break
+
+        _set_cpu_limit(msg["cpu_seconds"])
+        trace = metrics.start_trace()
+        # Answers published early by the program go up the same pipe, ahead of the result
+        sink = events.PipeSink(conn) if msg.get("stream") else None
+        token = events.listen(sink)
+        profile = profiling.request(msg.get("profile"))
+        try:
+            result = execute(msg["code"], msg.get("params"), msg.get("files"))
+        except CpuLimitExceeded:
+            result = {"error": f"Execution exceeded the {msg['cpu_seconds']:.0f}s CPU-time limit",
+                      "error_type": "cpu_limit"}
+        finally:
+            profiling.stop(profile)
+            events.stop(token)
+            if sink is not None:
+                sink.close()
+            _clear_cpu_limit()
+
+        try:
+            conn.send({"result": result, "spans": trace.spans})
+        except (BrokenPipeError, EOFError):
+            break
+
+class _Child:
+    def __init__(self, ctx, execute):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_child_main, args=(child_conn, execute), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.runs = 0
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(2)
+        self.kill()
+
+class SandboxPool:
+    """Thread-safe pool of up to `size` warm executor processes"""
+
+    def __init__(self, execute, size: int = SANDBOX_SIZE, start_method: str = SANDBOX_START_METHOD,
+                 max_runs: int = SANDBOX_MAX_RUNS):
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = "spawn"
+        self._ctx = multiprocessing.get_context(start_method)
+        # Children started later (replacing killed or retired ones) come from a forkserver: by then this
+        # process runs threads (event relay, prefetch, DuckDB, rate-limiter waits) whose locks a plain
+        # fork could copy into the child in a held state
+        self._respawn_ctx = self._ctx
+        if start_method == "fork" and "forkserver" in multiprocessing.get_all_start_methods():
+            self._respawn_ctx = multiprocessing.get_context("forkserver")
+            self._respawn_ctx.set_forkserver_preload([execute.__module__, *lazy_modules.HEAVY_MODULES])
+        self._execute = execute
+        self._max_runs = max_runs
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self.size = size
+
+    def warm(self):
+        """Start every child up front; call before this process starts threads, as these are plain forks"""
+        with self._lock:
+            while len(self._idle) < self.size:
+                self._idle.append(_Child(self._ctx, self._execute))
+        if self._respawn_ctx is not self._ctx:
+            multiprocessing.forkserver.ensure_running()  # its preload is paid now, not by the first replacement
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for child in idle:
+            child.stop()
+
+    def _checkout(self) -> _Child:
+        with self._lock:
+            if self._idle:
+                # Most recently used first, so a retry lands where its imports and memo are warm
+                return self._idle.pop()
+        return _Child(self._respawn_ctx, self._execute)
+
+    def _checkin(self, child: _Child, max_rss_mb: float):
+        child.runs += 1
+        if child.runs >= self._max_runs or (max_rss_mb and rss_mb(child.pid) > max_rss_mb * 0.8):
+            child.stop()
+            return
+        with self._lock:
+            self._idle.append(child)
+
+    def run(self, code: str, timeout: float = EXEC_TIMEOUT, cpu_seconds: float = EXEC_CPU_SECONDS,
+            max_rss_mb: float = EXEC_MAX_RSS_MB, cancel: threading.Event = None, params: dict = None,
+            files=None) -> dict:
+        """Execute code in a child; limit violations kill the child and return a structured error"""
+        with self._slots:
+            child = self._checkout()
+            child.conn.send({"code": code, "cpu_seconds": cpu_seconds, "params": params, "files": files,
+                             "stream": events.active(), "profile": profiling.requested()})
+            deadline = time.time() + timeout
+            while True:
+                if child.conn.poll(POLL_INTERVAL):
+                    try:
+                        reply = child.conn.recv()
+                    except (EOFError, OSError):
+                        return self._died(child, cpu_seconds)
+                    if not events.is_event(reply):
+                        self._checkin(child, max_rss_mb)
+                        # Stage timings recorded inside the child join the caller's trace
+                        trace = metrics.current_trace()
+                        if trace is not None:
+                            trace.extend(reply["spans"])
+                        return reply["result"]
+                    # An early answer: pass it on, and keep enforcing the limits while more arrive
+                    events.forward(reply["event"])
+
+                if not child.process.is_alive():
+                    return self._died(child, cpu_seconds)
+                if cancel is not None and cancel.is_set():
+                    child.kill()
+                    return {"error": "Execution cancelled", "error_type": "cancelled"}
+                if time.time() > deadline:
+                    child.kill()
+                    logging.warning(f"Sandbox {child.pid} killed after {timeout:.0f}s wall-clock")
+                    return {"error": f"Execution timed out after {timeout:.0f}s (wall-clock limit) and was killed",
+                            "error_type": "timeout", "limit": timeout}
+                used = rss_mb(child.pid)
+                if max_rss_mb and used > max_rss_mb:
+                    child.kill()
+                    logging.warning(f"Sandbox {child.pid} killed at {used:.0f}MB RSS")
+                    return {"error": f"Execution exceeded the {max_rss_mb:.0f}MB memory limit ({used:.0f}MB) and was killed",
+                            "error_type": "oom", "limit": max_rss_mb}
+
+    def _died(self, child: _Child, cpu_seconds: float) -> dict:
+        child.kill()
+        code = child.process.exitcode
+        if resource is not None and code == -signal.SIGXCPU:
+            return {"error": f"Execution exceeded the {cpu_seconds:.0f}s CPU-time limit and was killed",
+                    "error_type": "cpu_limit", "limit": cpu_seconds}
+        if code == -getattr(signal, "SIGKILL", 9):
+            return {"error": "Execution process was killed by the system, most likely out of memory",
+                    "error_type": "oom"}
+        return {"error": f"Execution process died unexpectedly (exit code {code})", "error_type": "crashed"}
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Single-pass JSON serializer for analysis results (numpy/pandas aware, vectorized)
+"""
+import json, math, datetime, decimal
+import numpy as np, pandas as pd
+
+class Payload:
+    """Serialized result bytes, produced once in execute_code and passed through to the HTTP response"""
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    @property
+    def value(self):
+        return json.loads(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"Payload({len(self.data)} bytes)"
+
+def _datetimes(values) -> list:
+    """datetime64 / tz-aware datetimes -> ISO strings, NaT -> None"""
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        values = pd.DatetimeIndex(values).tz_convert("UTC").tz_localize(None).to_numpy()
+        strings = np.datetime_as_string(values, unit="auto", timezone="UTC")
+    else:
+        values = np.asarray(values)
+        strings = np.datetime_as_string(values, unit="auto")
+    out = strings.astype(object)
+    out[np.isnat(values)] = None
+    return out.tolist()
+
+def _array(values) -> list:
+    """Convert a 1-D or n-D array-like to nested lists in bulk"""
+    if isinstance(values, (pd.Series, pd.Index)):
+        if isinstance(values.dtype, pd.DatetimeTZDtype) or values.dtype.kind == "M":
+            return _datetimes(values.array if isinstance(values.dtype, pd.DatetimeTZDtype) else values.to_numpy())
+        if isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+            # Nullable ints/bools/strings/categoricals: pd.NA -> None via the object path
+            values = values.to_numpy(dtype=object)
+        else:
+            values = values.to_numpy()
+    arr = np.asarray(values)
+    kind = arr.dtype.kind
+
+    if kind in "biu":
+        return arr.tolist()
+    if kind == "f":
+        finite = np.isfinite(arr)
+        if finite.all():
+            return arr.tolist()
+        out = arr.astype(object)
+        out[~finite] = None
+        return out.tolist()
+    if kind == "M":
+        return _datetimes(arr)
+    if kind == "m":
+        seconds = arr / np.timedelta64(1, "s")
+        out = seconds.astype(object)
+        out[np.isnat(arr)] = None
+        return out.tolist()
+    if kind == "U":
+        return arr.tolist()
+    if kind == "S":
+        return np.char.decode(arr, "utf-8", errors="ignore").tolist()
+    if kind == "c":
+        raise TypeError("Complex numbers are not JSON serializable")
+
+    # Object arrays: strings with missing values go through in bulk, anything else element-wise
+    if arr.ndim == 1:
+        inferred = pd.api.types.infer_dtype(arr, skipna=True)
+        if inferred in ("string", "empty"):
+            out = arr.copy()
+            out[pd.isna(arr)] = None
+            return out.tolist()
+        return [prepare(x) for x in arr]
+    return [_array(row) for row in arr]
+
+def _frame(df: pd.DataFrame) -> list:
+    """DataFrame -> list of records, converting column by column"""
+    columns = [str(c) for c in df.columns]
+    converted = [_array(df.iloc[:, i]) for i in range(df.shape[1])]
+    return [dict(zip(columns, row)) for row in zip(*converted)]
+
+def _key(key):
+    if isinstance(key, str):
+        return key
+    prepared = prepare(key)
+    return prepared if isinstance(prepared, str) else json.dumps(prepared)
+
+def prepare(obj):
+    """Convert a result into JSON-native Python objects (NaN/inf -> None, datetimes -> ISO)"""
+    if obj is None or isinstance(obj, (str, bool)):
+        return obj
+    if isinstance(obj, int) and not isinstance(obj, np.integer):
+        return obj
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, np.generic):
+        if isinstance(obj, np.bool_):
+            return bool(obj)
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            val = float(obj)
+            return val if math.isfinite(val) else None
+        if isinstance(obj, (np.datetime64, np.timedelta64)):
+            return _array(np.array([obj]))[0]
+        if isinstance(obj, np.str_):
+            return str(obj)
+        if isinstance(obj, np.bytes_):
+            return bytes(obj).decode("utf-8", errors="ignore")
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [prepare(x) for x in obj]
+    if isinstance(obj, dict):
+        return {_key(k): prepare(v) for k, v in obj.items()}
+    if isinstance(obj, pd.DataFrame):
+        return _frame(obj)
+    if isinstance(obj, (np.ndarray, pd.Series, pd.Index)):
+        return _array(obj)
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, (pd.Timestamp, datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (pd.Timedelta, datetime.timedelta)):
+        return obj.total_seconds()
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="ignore")
+    if isinstance(obj, decimal.Decimal):
+        return prepare(float(obj))
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def encode(prepared) -> bytes:
+    """Serialize an already-prepared result; allow_nan=False guards against anything prepare() missed"""
+    return json.dumps(prepared, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def dumps(obj) -> bytes:
+    return encode(prepare(obj))
@@ -3,16 +3,70 @@ import os
 import requests
 import json
 import tempfile
+import base64
+import time
 
 st.set_page_config(page_title="Data Analyst Agent", layout="wide")
 st.title("📊 Data-Analyst Agent UI")
 
 API_URL = st.text_input("API endpoint URL", "http://localhost:8080/api")
 uploaded = st.file_uploader("Upload your `question.txt` file", type="txt")
+stream = st.checkbox("Show answers as they are computed", value=True)
 run = st.button("Run Analysis")
 
+STAGES = {"planning": "🧠 Planning", "executing": "⚙️ Executing", "retrying": "🔁 Self-correcting",
+          "template": "📋 Answering from a template", "fallback": "🛟 Fallback template"}
+
+def render_item(container, label, item):
+    """One answer element: images inline, everything else as code"""
+    with container.container():
+        if isinstance(item, str) and item.startswith("data:image/"):
+            st.markdown(f"**{label}** 📈 Generated Plot")
+            img_kb = len(base64.b64decode(item.split(",", 1)[1])) / 1024
+            st.caption(f"Image size: {img_kb:.1f} KB")
+            st.image(item, use_column_width=True)
+        else:
+            st.markdown(f"**{label}** `{item}`")
+
+def label_for(index) -> str:
+    return f"{index + 1}." if isinstance(index, int) else f"{index}:"
+
+def run_streaming(url: str, path: str, start_time: float):
+    """Read NDJSON events from /api/stream and fill in answers as they arrive"""
+    status = st.empty()
+    status.info("⏳ Queued...")
+    slots = {}
+
+    def slot(index):
+        if index not in slots:
+            slots[index] = st.empty()
+        return slots[index]
+
+    with open(path, "rb") as fh:
+        resp = requests.post(url, files={"file": fh}, stream=True, timeout=(10, 300))
+    resp.raise_for_status()
+    for line in resp.iter_lines():
+        if not line:
+            continue
+        event = json.loads(line)
+        kind = event["event"]
+        elapsed = time.time() - start_time
+        if kind == "stage":
+            detail = f" (attempt {event['attempt']})" if event.get("attempt") else ""
+            status.info(f"{STAGES.get(event['stage'], event['stage'])}{detail}... {elapsed:.1f}s")
+        elif kind == "answer":
+            # Provisional until the complete result arrives
+            render_item(slot(event["index"]), label_for(event["index"]), event["value"])
+        elif kind == "result":
+            data = event["result"]
+            items = data.items() if isinstance(data, dict) else enumerate(data if isinstance(data, list) else [data])
+            for index, item in items:
+                render_item(slot(index), label_for(index), item)
+            status.success(f"⏱️ Time taken: {elapsed:.2f} seconds")
+        elif kind == "error":
+            status.error(f"❌ Error: {event['error']}")
+
 if run and uploaded:
-    import time
     start_time = time.time()
     with tempfile.NamedTemporaryFile(delete=False, suffix=".txt") as tmp:
         tmp.write(uploaded.getvalue())
@@ -20,38 +74,35 @@ if run and uploaded:
         tmp_path = tmp.name
 
     try:
-        files = {"file": open(tmp_path, "rb")}
-        with st.spinner("Running agent..."):
-            resp = requests.post(API_URL, files=files, timeout=180)
-            elapsed_time = time.time() - start_time
-            resp.raise_for_status()
-            response_data = resp.json()
-            # Handle both direct result and wrapped result formats
-            if isinstance(response_data, dict) and "result" in response_data:
-                data = response_data["result"]
-            else:
-                data = response_data
-            question_text = uploaded.getvalue().decode("utf-8").strip()
-
+        question_text = uploaded.getvalue().decode("utf-8").strip()
         st.subheader("📝 Question")
         st.markdown(f"```text\n{question_text}\n```")
 
-        st.subheader("📄 Result Summary")
-        import base64
-        for i, item in enumerate(data):
-            if isinstance(item, str) and item.startswith("data:image/png;base64,"):
-                st.subheader("📈 Generated Plot")
-                img_bytes = base64.b64decode(item.split(",")[1])
-                img_kb = len(img_bytes) / 1024
-                st.caption(f"Image size: {img_kb:.1f} KB")
-                st.image(item, use_column_width=True)
-            else:
-                st.markdown(f"**{i+1}.** `{item}`")
+        if stream:
+            st.subheader("📄 Result Summary")
+            run_streaming(API_URL.rstrip("/") + "/stream", tmp_path, start_time)
+        else:
+            files = {"file": open(tmp_path, "rb")}
+            with st.spinner("Running agent..."):
+                resp = requests.post(API_URL, files=files, timeout=180)
+                elapsed_time = time.time() - start_time
+                resp.raise_for_status()
+                response_data = resp.json()
+                # Handle both direct result and wrapped result formats
+                if isinstance(response_data, dict) and "result" in response_data:
+                    data = response_data["result"]
+                else:
+                    data = response_data
+
+            st.subheader("📄 Result Summary")
+            items = data.items() if isinstance(data, dict) else enumerate(data)
+            for index, item in items:
+                render_item(st.empty(), label_for(index), item)
 
-        st.success(f"⏱️ Time taken: {elapsed_time:.2f} seconds")
+            st.success(f"⏱️ Time taken: {elapsed_time:.2f} seconds")
 
     except Exception as e:
         st.error(f"❌ Error: {e}")
 
     finally:
-        os.unlink(tmp_path)
\ No newline at end of file
+        os.unlink(tmp_path)
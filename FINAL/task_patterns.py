@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Keyword analysis of a question (data sources, output shape, analysis type) and the URLs it names;
+light enough for the API server to group batch questions without loading the agent
+"""
+import re
+import metrics
+
+URL_PATTERN = re.compile(r"(?:https?|s3)://[^\s\"'<>()\[\]]+")
+
+@metrics.timed("detect_task_patterns")
+def detect_task_patterns(text: str) -> dict:
+    """Analyze the task to understand data sources, output format, and analysis type"""
+    patterns = {
+        'data_sources': [],
+        'output_format': 'json_array',
+        'has_visualization': False,
+        'analysis_type': 'general',
+        'specific_requirements': []
+    }
+    
+    text_lower = text.lower()
+    
+    # Detect data sources
+    if 'wikipedia' in text_lower or 'wiki' in text_lower:
+        patterns['data_sources'].append('wikipedia')
+    if 'duckdb' in text_lower or 'parquet' in text_lower or 's3://' in text:
+        patterns['data_sources'].append('duckdb')
+    if '.csv' in text_lower:
+        patterns['data_sources'].append('csv')
+    
+    # Detect output format
+    if 'json object' in text_lower or 'json dictionary' in text_lower:
+        patterns['output_format'] = 'json_object'
+    elif 'json array' in text_lower:
+        patterns['output_format'] = 'json_array'
+    
+    # Detect visualization requirements
+    if any(word in text_lower for word in ['plot', 'chart', 'graph', 'scatter', 'histogram', 'visualization']):
+        patterns['has_visualization'] = True
+    
+    # Detect analysis type
+    if 'correlation' in text_lower:
+        patterns['analysis_type'] = 'correlation'
+    elif 'regression' in text_lower:
+        patterns['analysis_type'] = 'regression'
+    elif 'count' in text_lower or 'how many' in text_lower:
+        patterns['analysis_type'] = 'counting'
+    elif 'earliest' in text_lower or 'latest' in text_lower or 'first' in text_lower:
+        patterns['analysis_type'] = 'temporal'
+    
+    # Extract specific requirements
+    if 'base64' in text_lower or 'data uri' in text_lower:
+        patterns['specific_requirements'].append('base64_encoding')
+    if '100' in text and ('kb' in text_lower or 'kilobyte' in text_lower):
+        patterns['specific_requirements'].append('size_limit_100kb')
+    if 'dotted' in text_lower and 'red' in text_lower:
+        patterns['specific_requirements'].append('dotted_red_line')
+    
+    return patterns
+
+def extract_urls(text: str) -> list:
+    """URLs and S3 paths named in a question, in order, without trailing punctuation"""
+    urls = []
+    for url in URL_PATTERN.findall(text):
+        url = url.rstrip(".,;:!?")
+        if url not in urls:
+            urls.append(url)
+    return urls
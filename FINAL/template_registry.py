@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Template registry: TF-IDF matching of tasks to known question shapes, parameter extraction
+and compile-once code objects
+"""
+import os, re, math, logging
+from collections import Counter
+from functools import lru_cache
+
+FAST_PATH_CONFIDENCE = float(os.getenv("AGENT_TEMPLATE_FAST_PATH_CONFIDENCE", "0.6"))
+FALLBACK_CONFIDENCE = float(os.getenv("AGENT_TEMPLATE_FALLBACK_CONFIDENCE", "0.45"))
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from how in is it of on or the this to was were what which with
+answer following questions question return respond json array object string encode data uri under
+""".split())
+
+_NUMBERED = re.compile(r"^\s*\d+[.)]\s+(.+)$", re.MULTILINE)
+_JSON_KEY = re.compile(r'^\s*"([^"\n]+)"\s*:', re.MULTILINE)
+
+def tokenize(text: str) -> list:
+    return [t for t in re.findall(r"[a-z0-9_]+", text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+def sub_questions(task: str) -> list:
+    """What the task asks: its numbered items or JSON-object keys, else the whole text as one question"""
+    return _NUMBERED.findall(task) or _JSON_KEY.findall(task) or [task]
+
+@lru_cache(maxsize=64)
+def compiled(source: str, filename: str = "<analysis>"):
+    """Compile source once per process; repeated runs of the same template or cached code reuse the code object"""
+    return compile(source, filename, "exec")
+
+class Param:
+    """A template parameter: a default, optionally overridden by a regex match on the task text"""
+
+    def __init__(self, default, pattern: str = None, cast=None, group: int = 1):
+        self.default = default
+        self.pattern = re.compile(pattern, re.IGNORECASE) if pattern else None
+        self.cast = cast or type(default)
+        self.group = group
+
+    def extract(self, task: str):
+        if self.pattern:
+            match = self.pattern.search(task)
+            if match:
+                try:
+                    return self.cast(match.group(self.group))
+                except (TypeError, ValueError):
+                    pass
+        return self.default
+
+class Template:
+    """Parameterized analysis program for one known question shape"""
+
+    def __init__(self, name: str, source: str, description: str, keywords=(), params=None, questions=()):
+        self.name = name
+        self.source = source
+        self.description = description
+        self.keywords = tuple(k.lower() for k in keywords)
+        self.params = params or {}
+        # One regex per sub-question the program answers
+        self.questions = tuple(re.compile(q, re.IGNORECASE) for q in questions)
+
+    def answers(self, task: str) -> bool:
+        """True when the task asks each of this template's sub-questions and nothing else"""
+        asked = sub_questions(task)
+        if not self.questions or len(asked) != len(self.questions):
+            return False
+        return (all(any(q.search(a) for a in asked) for q in self.questions)
+                and all(any(q.search(a) for q in self.questions) for a in asked))
+
+    def bind(self, task: str) -> dict:
+        """Parameter values for this task"""
+        return {name: param.extract(task) for name, param in self.params.items()}
+
+class Match:
+    def __init__(self, template: Template, confidence: float, params: dict):
+        self.template = template
+        self.confidence = confidence
+        self.params = params
+
+    @property
+    def name(self) -> str:
+        return self.template.name
+
+    def __repr__(self):
+        return f"Match({self.name}, confidence={self.confidence:.2f})"
+
+class TemplateRegistry:
+    """TF-IDF index over template descriptions; confidence mixes cosine similarity and keyword coverage"""
+
+    def __init__(self, templates=()):
+        self._templates = []
+        self._vectors = []
+        self._idf = {}
+        for template in templates:
+            self.register(template)
+
+    def register(self, template: Template):
+        self._templates.append(template)
+        self._reindex()
+
+    def __iter__(self):
+        return iter(self._templates)
+
+    def _reindex(self):
+        docs = [Counter(tokenize(f"{t.description} {' '.join(t.keywords)}")) for t in self._templates]
+        n = len(docs)
+        df = Counter(term for doc in docs for term in doc)
+        self._idf = {term: math.log((1 + n) / (1 + count)) + 1 for term, count in df.items()}
+        self._unknown_idf = math.log(1 + n) + 1
+        self._vectors = [self._vector(doc) for doc in docs]
+
+    def _vector(self, counts: Counter) -> dict:
+        vec = {term: (1 + math.log(tf)) * self._idf.get(term, self._unknown_idf) for term, tf in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+        return {term: w / norm for term, w in vec.items()}
+
+    def scores(self, task: str) -> list:
+        """(template, confidence) for every template, best first"""
+        query = self._vector(Counter(tokenize(task)))
+        task_lower = task.lower()
+        scored = []
+        for template, vec in zip(self._templates, self._vectors):
+            cosine = sum(w * vec[term] for term, w in query.items() if term in vec)
+            coverage = sum(k in task_lower for k in template.keywords) / len(template.keywords) if template.keywords else 0.0
+            scored.append((template, round(0.5 * cosine + 0.5 * coverage, 3)))
+        return sorted(scored, key=lambda item: item[1], reverse=True)
+
+    def match(self, task: str, min_confidence: float = FALLBACK_CONFIDENCE):
+        """Best template at or above min_confidence that answers exactly what the task asks, or None
+        (never a default): similarity alone only says the dataset looks alike"""
+        for template, confidence in self.scores(task):
+            if confidence < min_confidence:
+                break
+            if template.answers(task):
+                logging.info(f"Template match: {template.name} ({confidence:.2f})")
+                return Match(template, confidence, template.bind(task))
+            logging.info(f"Template {template.name} ({confidence:.2f}) does not answer this task's questions")
+        return None
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Targeted Wikipedia table extraction: only `wikitable` elements are considered, the one that best
+fits the requested columns is parsed, and parsed tables are cached per page revision
+"""
+import os, io, re, json, hashlib, logging, threading
+from collections import OrderedDict
+import numpy as np, pandas as pd, requests
+import http_cache, metrics
+from code_cache import CACHE_DIR
+from lazy_modules import lxml_html
+
+WIKI_CACHE_DIR = os.getenv("AGENT_WIKI_CACHE_DIR", os.path.join(CACHE_DIR, "wiki"))
+WIKI_MEMORY_TABLES = int(os.getenv("AGENT_WIKI_MEMORY_TABLES", "32"))
+NUMERIC_SHARE = 0.9  # share of non-empty cells that must parse for a column to become numeric
+
+WIKITABLE = "//table[contains(concat(' ', normalize-space(@class), ' '), ' wikitable ')]"
+REVISION = re.compile(r'"wgRevisionId"\s*:\s*(\d+)')
+FOOTNOTE = r"\[[^\]]*\]|[†‡§¶*#]+(?=\s|$)"
+CURRENCY = r"[$€£¥₹]|\b(?:US|USD|EUR|GBP|INR|Rs\.?)\b"
+EMPTY = {"", "—", "–", "-", "n/a", "N/A", "TBA", "TBD", "?"}
+SCALE = {"thousand": 1e3, "k": 1e3, "million": 1e6, "mn": 1e6, "m": 1e6, "billion": 1e9, "bn": 1e9, "b": 1e9,
+         "trillion": 1e12, "tn": 1e12}
+NUMBER = re.compile(r"^([-+−]?\d*\.?\d+)\s*(" + "|".join(sorted(SCALE, key=len, reverse=True)) + r")?$", re.IGNORECASE)
+
+def _norm(text) -> str:
+    text = re.sub(FOOTNOTE, " ", str(text).lower())
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+def _similarity(wanted: str, header: str) -> float:
+    wanted, header = _norm(wanted), _norm(header)
+    if not wanted or not header:
+        return 0.0
+    if wanted == header:
+        return 1.0
+    if wanted in header or header in wanted:
+        return 0.75
+    a, b = set(wanted.split()), set(header.split())
+    return 0.5 * len(a & b) / len(a | b)
+
+def _best(wanted: str, headers) -> tuple:
+    """(index, similarity) of the header closest to a requested column"""
+    scored = [(i, _similarity(wanted, h)) for i, h in enumerate(headers)]
+    return max(scored, key=lambda s: s[1], default=(None, 0.0))
+
+def _text(el) -> str:
+    return re.sub(r"\s+", " ", el.text_content()).strip()
+
+def _describe(index: int, table) -> dict:
+    """Caption, header cells, first rows and size of one wikitable, for scoring without parsing it"""
+    caption = table.find("caption")
+    rows = table.xpath("./tr|./thead/tr|./tbody/tr|./tfoot/tr")
+    headers = [_text(th) for tr in rows[:3] if not tr.xpath("./td") for th in tr.xpath("./th")]
+    preview = " ".join(_text(tr) for tr in rows[:6])
+    return {"index": index, "caption": _text(caption) if caption is not None else "", "headers": headers,
+            "preview": preview[:2000], "rows": len(rows)}
+
+def score(table: dict, match: str = None, columns=None) -> float:
+    """How well a described table fits: mean column similarity, plus 1 when `match` is found"""
+    value = 0.0
+    if columns:
+        value += sum(_best(c, table["headers"])[1] for c in columns) / len(columns)
+    if match:
+        haystack = " ".join([table["caption"], " ".join(table["headers"]), table["preview"]])
+        value += 1.0 if re.search(match, haystack, re.IGNORECASE) else 0.0
+    return value
+
+def _flatten(df: pd.DataFrame) -> pd.DataFrame:
+    """Single-level, unique column names (multi-row headers joined, repeated levels dropped)"""
+    if isinstance(df.columns, pd.MultiIndex):
+        names = []
+        for levels in df.columns:
+            parts = []
+            for level in map(str, levels):
+                if not level.startswith("Unnamed:") and level not in parts:
+                    parts.append(level)
+            names.append(" ".join(parts))
+    else:
+        names = [str(c) for c in df.columns]
+    names = [re.sub(r"\s+", " ", re.sub(FOOTNOTE, "", n)).strip() or f"column_{i}" for i, n in enumerate(names)]
+    seen = {}
+    for i, name in enumerate(names):
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            names[i] = f"{name}_{seen[name]}"
+    df.columns = names
+    return df
+
+def clean(df: pd.DataFrame) -> pd.DataFrame:
+    """Strip footnote markers and turn currency / numeric text columns into numbers, column-wise"""
+    out = df.copy()
+    for col in out.columns:
+        if out[col].dtype != object and not pd.api.types.is_string_dtype(out[col]):
+            continue
+        text = out[col].astype("string").str.replace(FOOTNOTE, "", regex=True).str.replace(r"\s+", " ", regex=True).str.strip()
+        text = text.mask(text.isin(EMPTY))
+        parts = (text.str.replace(CURRENCY, "", regex=True).str.replace(",", "", regex=False)
+                 .str.replace("−", "-", regex=False).str.strip().str.extract(NUMBER))
+        values = pd.to_numeric(parts[0], errors="coerce") * parts[1].str.lower().map(SCALE).fillna(1).astype(float)
+        present = int(text.notna().sum())
+        if present and values.notna().sum() >= NUMERIC_SHARE * present:
+            whole = values.dropna()
+            out[col] = values.astype("Int64") if (whole == whole.round()).all() and whole.abs().max() < 2**53 else values
+        else:
+            out[col] = text.to_numpy(dtype=object, na_value=np.nan)
+    return out
+
+class WikiTableCache:
+    """Parsed tables on disk under <page>/<revision>/ (table index, then one pickle per parsed table
+    and per cleaned table), with a small in-memory LRU in front"""
+
+    def __init__(self, root: str = WIKI_CACHE_DIR, memory_tables: int = WIKI_MEMORY_TABLES):
+        self.root = root
+        self.memory_tables = memory_tables
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _dir(self, page: str, revision: str = "") -> str:
+        return os.path.join(self.root, hashlib.sha256(page.encode("utf-8")).hexdigest()[:24], revision)
+
+    def index(self, page: str, revision: str):
+        try:
+            with open(os.path.join(self._dir(page, revision), "tables.json"), encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def save_index(self, page: str, revision: str, tables: list):
+        directory = self._dir(page, revision)
+        os.makedirs(directory, exist_ok=True)
+        tmp = os.path.join(directory, f"tables.json.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(tables, fh)
+        os.replace(tmp, os.path.join(directory, "tables.json"))
+
+    def latest_revision(self, page: str):
+        """Most recently cached revision of a page (for serving it when the page cannot be fetched)"""
+        try:
+            revisions = [e for e in os.scandir(self._dir(page)) if e.is_dir()]
+        except OSError:
+            return None
+        return max(revisions, key=lambda e: e.stat().st_mtime).name if revisions else None
+
+    def get(self, page: str, revision: str, name: str):
+        key = (page, revision, name)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        try:
+            df = pd.read_pickle(os.path.join(self._dir(page, revision), f"{name}.pkl"))
+        except (OSError, ValueError, EOFError):
+            return None
+        self._remember(key, df)
+        return df
+
+    def put(self, page: str, revision: str, name: str, df: pd.DataFrame):
+        directory = self._dir(page, revision)
+        os.makedirs(directory, exist_ok=True)
+        tmp = os.path.join(directory, f"{name}.pkl.{os.getpid()}.tmp")
+        df.to_pickle(tmp)
+        os.replace(tmp, os.path.join(directory, f"{name}.pkl"))
+        self._remember((page, revision, name), df)
+
+    def _remember(self, key, df):
+        with self._lock:
+            self._memory[key] = df
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_tables:
+                self._memory.popitem(last=False)
+
+_cache = None
+
+def get_wiki_cache() -> WikiTableCache:
+    global _cache
+    if _cache is None:
+        _cache = WikiTableCache()
+    return _cache
+
+def page_key(url: str) -> str:
+    return url.split("#")[0].split("?")[0].rstrip("/")
+
+def revision_id(page_html: str) -> str:
+    """MediaWiki revision id from the page's config block, else a digest of the HTML"""
+    found = REVISION.search(page_html[:200_000])
+    return found.group(1) if found else "sha-" + hashlib.sha256(page_html.encode("utf-8")).hexdigest()[:24]
+
+def _choose(tables: list, url: str, match: str = None, columns=None) -> dict:
+    if not tables:
+        raise ValueError(f"No wikitable found at {url}")
+    if not match and not columns:
+        return max(tables, key=lambda t: t["rows"])
+    best = max(tables, key=lambda t: (score(t, match, columns), t["rows"]))
+    if score(best, match, columns) <= 0:
+        found = "; ".join(f"#{t['index']} {t['caption'] or '(no caption)'}: {t['headers'][:8]}" for t in tables[:10])
+        raise ValueError(f"No wikitable at {url} fits match={match!r} columns={columns!r}. Tables: {found}")
+    return best
+
+def _select(df: pd.DataFrame, columns) -> pd.DataFrame:
+    """Requested columns, in order and under the requested names"""
+    picked = {}
+    for wanted in columns:
+        i, similarity = _best(wanted, list(df.columns))
+        if similarity <= 0:
+            raise KeyError(f"Column {wanted!r} not found; table has {list(df.columns)}")
+        picked[wanted] = df.columns[i]
+    return df[list(picked.values())].set_axis(list(picked), axis=1)
+
+def _page(cache: WikiTableCache, url: str) -> tuple:
+    """(page HTML or None when only the cache has it, revision, table index, parsed document or None)"""
+    page = page_key(url)
+    try:
+        resp = http_cache.fetch(url)
+        if resp.status_code >= 400:
+            raise requests.HTTPError(f"{resp.status_code} error fetching {url}")
+        page_html, revision = resp.text, revision_id(resp.text)
+    except (requests.RequestException, OSError) as e:
+        revision = cache.latest_revision(page)
+        if revision is None:
+            raise
+        logging.warning(f"Serving cached tables of {page} (revision {revision}): {str(e)}")
+        page_html = None
+
+    tables, doc = cache.index(page, revision), None
+    if tables is None:
+        if page_html is None:
+            raise ValueError(f"No cached tables for {page}")
+        doc = lxml_html.fromstring(page_html)
+        tables = [_describe(i, el) for i, el in enumerate(doc.xpath(WIKITABLE))]
+        cache.save_index(page, revision, tables)
+    return page_html, revision, tables, doc
+
+def page_tables(url: str) -> list:
+    """Index of the wikitables at url (caption, headers, preview, row count) without parsing any;
+    cached per revision like the tables themselves"""
+    return _page(get_wiki_cache(), url)[2]
+
+def read_wiki_table(url: str, match: str = None, columns=None, clean_values: bool = True) -> pd.DataFrame:
+    """The wikitable at url that best fits `columns` (requested header names) and `match` (regex
+    searched in the caption, headers and first rows), with footnotes stripped and numbers parsed"""
+    columns = [columns] if isinstance(columns, str) else list(columns or [])
+    cache = get_wiki_cache()
+    page = page_key(url)
+    with metrics.span("wiki_table") as attrs:
+        page_html, revision, tables, doc = _page(cache, url)
+        attrs["revision"] = revision
+        chosen = _choose(tables, url, match, columns)
+        attrs["table"] = chosen["index"]
+
+        raw = str(chosen["index"])
+        name = f"{raw}.clean" if clean_values else raw
+        df = cache.get(page, revision, name)
+        attrs["cache"] = "hit" if df is not None else "miss"
+        if df is None:
+            df = cache.get(page, revision, raw) if clean_values else None
+            if df is None:
+                if page_html is None:
+                    raise ValueError(f"Table {raw} of {page} is not cached")
+                doc = doc if doc is not None else lxml_html.fromstring(page_html)
+                element = doc.xpath(WIKITABLE)[chosen["index"]]
+                df = _flatten(pd.read_html(io.StringIO(lxml_html.tostring(element, encoding="unicode")))[0])
+                cache.put(page, revision, raw, df)
+            if clean_values:
+                # Cleaning costs more than unpickling, so the cleaned table is kept per revision too
+                df = clean(df)
+                cache.put(page, revision, name, df)
+        df = df.copy()
+    return _select(df, columns) if columns else df
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Warm worker pool that runs agent tasks in pre-imported child processes
+"""
+import os, asyncio, logging, multiprocessing, time
+import limits
+import lazy_modules
+import events
+import profiling
+
+POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", "2"))
+MAX_TASKS_PER_WORKER = int(os.getenv("AGENT_MAX_TASKS_PER_WORKER", "50"))
+MAX_WORKER_RSS_MB = float(os.getenv("AGENT_MAX_WORKER_RSS_MB", "1536"))
+TASK_TIMEOUT = float(os.getenv("AGENT_TASK_TIMEOUT", "170"))
+
+class WorkerCrashed(RuntimeError):
+    """Raised when a worker process dies while handling a task"""
+
+def rss_mb(pid="self") -> float:
+    """Resident set size of a process in MB (0.0 when unavailable)"""
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+def _worker_main(conn, semaphores, held):
+    """Child loop: receive tasks, run them in-process and send back the outcome"""
+    import data_analyst_agent as agent
+
+    # Workers are daemonic so they die with the server, but the sandbox backend needs children of its own
+    multiprocessing.current_process().daemon = False
+    limits.configure(semaphores, held)
+    agent.warm_up()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if msg is None:
+            break
+
+        # Streaming clients get progress events on the same pipe, before the outcome
+        sink = events.PipeSink(conn) if msg.get("stream") else None
+        token = events.listen(sink)
+        profile = profiling.request(msg.get("profile"))
+        try:
+            if "batch" in msg:
+                run = agent.solve_batch(msg["batch"], msg.get("files"), msg.get("combined", False))
+            else:
+                run = agent.solve(msg["task"], msg.get("files"))
+            outcome = loop.run_until_complete(run)
+        except Exception as e:
+            outcome = {"success": False, "error": f"Worker failure: {str(e)}"}
+        finally:
+            profiling.stop(profile)
+            events.stop(token)
+            if sink is not None:
+                sink.close()
+
+        outcome["rss_mb"] = rss_mb()
+        try:
+            conn.send(outcome)
+        except (BrokenPipeError, EOFError):
+            break
+
+def _context():
+    """Fork workers from a server that has already imported the agent and its heavy deps"""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["data_analyst_agent", *lazy_modules.HEAVY_MODULES])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+class Worker:
+    def __init__(self, ctx, semaphores=None):
+        self.conn, child_conn = ctx.Pipe()
+        self.semaphores = semaphores
+        self.held = limits.held_counter(ctx)
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, semaphores, self.held), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+        self.rss_mb = 0.0
+        self.started = time.time()
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def run(self, msg, timeout: float, on_event=None) -> dict:
+        """Blocking round-trip, passing progress events to on_event; raises TimeoutError or WorkerCrashed"""
+        self.conn.send(msg)
+        deadline = time.monotonic() + timeout
+        while True:
+            if not self.conn.poll(max(0.0, deadline - time.monotonic())):
+                raise TimeoutError(f"Worker {self.pid} exceeded {timeout:.0f}s")
+            try:
+                reply = self.conn.recv()
+            except (EOFError, OSError):
+                raise WorkerCrashed(f"Worker {self.pid} exited with code {self.process.exitcode}")
+            if not events.is_event(reply):
+                return reply
+            if on_event is not None:
+                on_event(reply["event"])
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+        limits.release_held(self.semaphores, self.held)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(5)
+        self.kill()
+
+class WorkerPool:
+    """Fixed-size pool of warm agent processes fed through an idle-worker queue"""
+
+    def __init__(self, size: int = POOL_SIZE, max_tasks: int = MAX_TASKS_PER_WORKER,
+                 max_rss_mb: float = MAX_WORKER_RSS_MB, timeout: float = TASK_TIMEOUT):
+        self.size = size
+        self.max_tasks = max_tasks
+        self.max_rss_mb = max_rss_mb
+        self.timeout = timeout
+        self._ctx = None
+        self._semaphores = None
+        self._idle = None
+        self._workers = set()
+
+    async def start(self):
+        self._ctx = _context()
+        self._semaphores = limits.create(self._ctx)
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            worker = await asyncio.to_thread(Worker, self._ctx, self._semaphores)
+            self._workers.add(worker)
+            self._idle.put_nowait(worker)
+        logging.info(f"Worker pool started with {self.size} workers")
+
+    async def close(self):
+        for worker in list(self._workers):
+            await asyncio.to_thread(worker.stop)
+        self._workers.clear()
+
+    async def _replace(self, worker: Worker, kill: bool):
+        self._workers.discard(worker)
+        await asyncio.to_thread(worker.kill if kill else worker.stop)
+        fresh = await asyncio.to_thread(Worker, self._ctx, self._semaphores)
+        self._workers.add(fresh)
+        self._idle.put_nowait(fresh)
+
+    def _needs_recycle(self, worker: Worker) -> bool:
+        return worker.tasks >= self.max_tasks or (self.max_rss_mb and worker.rss_mb > self.max_rss_mb)
+
+    async def submit(self, task: str, timeout: float = None, files=None, on_event=None, profile: str = None) -> dict:
+        """Run one task (plus any uploaded data files) on an idle worker and return its outcome dict;
+        with on_event, progress events are passed to it (from a pool thread) as they arrive, and with
+        profile ("basic" or "sample") every execution adds a "profile" span"""
+        msg = {"task": task, "files": files or [], "stream": on_event is not None, "profile": profile}
+        return await self._submit(msg, timeout or self.timeout, on_event)
+
+    async def submit_batch(self, tasks: list, timeout: float = None, files=None, combined: bool = False) -> dict:
+        """Run related tasks together on one worker; the outcome holds one outcome dict per task"""
+        # Questions in a batch share LLM and execution slots, so allow for them running one after another
+        timeout = timeout or self.timeout * len(tasks)
+        return await self._submit({"batch": list(tasks), "files": files or [], "combined": combined}, timeout)
+
+    async def _submit(self, msg: dict, timeout: float, on_event=None) -> dict:
+        worker = await self._idle.get()
+        try:
+            outcome = await asyncio.to_thread(worker.run, msg, timeout, on_event)
+        except BaseException as e:
+            # Timeouts, crashes and cancellations leave the worker in an unknown state
+            logging.warning(f"Killing worker {worker.pid}: {type(e).__name__}: {e}")
+            await asyncio.shield(self._replace(worker, kill=True))
+            raise
+
+        worker.tasks += 1
+        worker.rss_mb = outcome.pop("rss_mb", 0.0)
+        if self._needs_recycle(worker):
+            logging.info(f"Recycling worker {worker.pid} after {worker.tasks} tasks ({worker.rss_mb:.0f}MB RSS)")
+            asyncio.create_task(self._replace(worker, kill=False))
+        else:
+            self._idle.put_nowait(worker)
+        return outcome